@@ -0,0 +1,357 @@
+"""Offline benchmarks: the real scheduler, outbox, send path and menus against local fakes.
+
+Telegram clients, Redis and Prisma are replaced with in-memory stand-ins that
+sleep a configurable latency per call, so results show what a change costs in
+round trips as well as time. Nothing touches the network.
+
+    pip install -r bench/requirements.txt
+    python -m bench.benchmark
+    python -m bench.benchmark --scales 1000x500,10000x500 --no-memory
+    python -m bench.benchmark --save baseline.json
+    python -m bench.benchmark --compare baseline.json   # exits 1 on a regression
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# 1000x500 and up work too but take minutes: above ~100k pairs the in-memory
+# Redis itself is the bottleneck, so compare round trips rather than wall time there
+DEFAULT_SCALES = "10x10,10x500,1000x10,10000x10"
+
+# Channels posted to in the send scenarios, enough to see the per-post cost
+SEND_SAMPLE = 100
+
+# Size of the photo in the media send scenarios
+MEDIA_SIZE = 2 * 1024 * 1024
+
+# Post history seeded for the post history scenario: one attempt per day for
+# each channel and each of the first HISTORY_ADS adverts
+HISTORY_DAYS = 14
+HISTORY_ADS = 10
+
+# Wall-time differences below this are noise, not regressions (seconds)
+WALL_NOISE = 0.005
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", default=DEFAULT_SCALES, help="ADSxCHANNELS,... e.g. 1000x500")
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    parser.add_argument("--redis-latency", type=float, default=0.0005)
+    parser.add_argument("--db-latency", type=float, default=0.002)
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc, it slows runs down")
+    parser.add_argument("--verbose", action="store_true", help="keep the bot's own log output")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON from --save; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed wall-time growth")
+    return parser.parse_args()
+
+
+def load_app(args):
+    # Fakes go in before main is imported, so every module binds to them
+    for name, value in {
+        "API_ID": "1",
+        "API_HASH": "bench",
+        "BOT_TOKEN": "bench",
+        "CLIENT_API_ID": "1",
+        "CLIENT_API_HASH": "bench",
+        "REDIS_HOST": "localhost",
+        "REDIS_PORT": "6379",
+        "METRICS_PORT": "0",
+        # Token buckets would make the outbox drain measure the configured rates
+        "ACCOUNT_RATE": "0",
+        "CHANNEL_RATE": "0",
+    }.items():
+        os.environ.setdefault(name, value)
+
+    # TelegramClient opens its session files on construction, keep them out of the repo
+    workdir = tempfile.mkdtemp(prefix="teleads-bench-")
+    os.makedirs(os.path.join(workdir, "sessions"))
+    os.chdir(workdir)
+    sys.path.insert(0, str(ROOT))
+
+    from bench.fakes import FakePrisma, FakeTelegramClient, latency_redis
+
+    fake_prisma = types.ModuleType("teleads.prisma")
+    fake_prisma.db = FakePrisma(args.db_latency)
+    sys.modules["teleads.prisma"] = fake_prisma
+
+    import teleads.redis
+
+    teleads.redis.redis = latency_redis(
+        teleads.redis.InstrumentedRedis, teleads.redis.InstrumentedPipeline, args.redis_latency
+    )
+
+    import main
+
+    for account in main.account_pool:
+        account.client = FakeTelegramClient(args.telegram_latency)
+    main.user_client = main.account_pool.primary.client
+    # The bot fallback and bot-account sends go through main.bot_client
+    main.bot_client = FakeTelegramClient(args.telegram_latency)
+    return main
+
+
+class Bench:
+    def __init__(self, app, args):
+        self.app = app
+        self.args = args
+        self.db = sys.modules["teleads.prisma"].db
+        self.redis = sys.modules["teleads.redis"].redis
+        self.bot = app.bot_client
+        self.clients = [account.client for account in app.account_pool] + [self.bot]
+
+    def counters(self):
+        return {
+            "telegram": sum(sum(client.calls.values()) for client in self.clients),
+            "redis": self.redis.calls["round_trips"],
+            "redis_commands": self.redis.calls["commands"],
+            "prisma": sum(self.db.calls.values()),
+        }
+
+    async def reset(self, n_ads, n_channels):
+        from prisma.fields import Base64
+        from bench.fakes import channel_id
+        from teleads import entities, helpers
+        from teleads.floodwait import flood_table
+        from teleads.ledger import post_ledger
+        from teleads.membership import rpc_counter
+        from teleads.rules import rule_book
+
+        await self.redis.flushall()
+        for cache in (helpers.adverts_cache, helpers.channels_cache):
+            cache.value = None
+            cache.version = None
+        rule_book.rules = {}
+        rule_book.version = None
+        flood_table.bans = {}
+        rpc_counter.calls = {}
+        rpc_counter.posts = 0
+        entities._refreshing.clear()
+        for client in self.clients:
+            client.calls.clear()
+            client.session.clear()
+
+        for table in (
+            self.db.advert, self.db.channel, self.db.advertchannel, self.db.media, self.db.postlog
+        ):
+            table.rows.clear()
+        post_ledger.buffer = []
+        self.seed_history(n_ads, n_channels)
+        for i in range(n_channels):
+            self.db.channel._insert({"id": channel_id(i + 1)})
+        for i in range(n_ads):
+            # No explicit channels: every advert goes to every channel
+            self.db.advert._insert(
+                {
+                    "id": f"ad{i}",
+                    "content": f"Benchmark advert {i}",
+                    "schedule": "0-24 GMT+3",
+                    "active": True,
+                    "mediaId": None,
+                }
+            )
+        self.db.media._insert(
+            {
+                "id": "creative",
+                "kind": "photo",
+                "mimeType": "image/jpeg",
+                "fileName": "advert.jpg",
+                "size": MEDIA_SIZE,
+                "data": Base64.encode(bytes(MEDIA_SIZE)),
+            }
+        )
+        self.channels = [channel_id(i + 1) for i in range(n_channels)]
+
+    async def measure(self, make):
+        before = self.counters()
+        memory = not self.args.no_memory
+        if memory:
+            tracemalloc.start()
+        log = contextlib.nullcontext()
+        if not self.args.verbose:
+            log = contextlib.redirect_stdout(io.StringIO())
+        started = time.perf_counter()
+        with log:
+            await make()
+        wall = time.perf_counter() - started
+        peak = 0
+        if memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        after = self.counters()
+        result = {name: after[name] - before[name] for name in after}
+        result["wall"] = wall
+        result["peak_mb"] = peak / 1024 / 1024
+        return result
+
+    async def send_sample(self, media=None):
+        from teleads.config import POST_CONCURRENCY
+
+        ad = {"id": "ad0", "content": "Benchmark advert 0", "media": media}
+        semaphore = asyncio.Semaphore(POST_CONCURRENCY)
+
+        async def send(ch_id):
+            async with semaphore:
+                return await self.app.send_message_to_channel(ch_id, ad)
+
+        await asyncio.gather(*(send(ch) for ch in self.channels[:SEND_SAMPLE]))
+
+    def seed_history(self, n_ads, n_channels):
+        # PostLog rows as the ledger writes them; the outbox drain only adds
+        # one batch, so the history is seeded
+        from bench.fakes import channel_id
+        from teleads.ledger import _day
+
+        accounts = [account.name for account in self.app.account_pool]
+        now = datetime.datetime.now(datetime.timezone.utc)
+        outcomes = ["sent"] * 8 + ["failed", "deferred"]
+        for day in range(HISTORY_DAYS):
+            at = now - datetime.timedelta(days=day)
+            for i in range(min(n_ads, HISTORY_ADS)):
+                for j in range(n_channels):
+                    outcome = outcomes[(i + j + day) % len(outcomes)]
+                    self.db.postlog._insert(
+                        {
+                            "advertId": f"ad{i}",
+                            "channelId": channel_id(j + 1),
+                            "account": accounts[j % len(accounts)],
+                            "messageId": j if outcome == "sent" else None,
+                            "outcome": outcome,
+                            "error": "ChatWriteForbiddenError" if outcome == "failed" else None,
+                            "latencyMs": 120,
+                            "createdAt": at,
+                            "day": _day(at),
+                        }
+                    )
+
+    async def drain_outbox(self):
+        # One batch of what the scheduler queued: read, re-check, claim, send
+        # and commit, as a sender does on every loop
+        worker = self.app.outbox_worker
+        await worker.ensure_group()
+        await worker.process(await worker._read())
+
+    async def post_history(self):
+        from bench.fakes import FakeEvent
+
+        await self.app.stats_callback(FakeEvent(self.bot, data=b"stats"))
+        await self.app.stats_channels_callback(FakeEvent(self.bot, data=b"stats_channels"))
+
+    async def select_channel(self):
+        from bench.fakes import FakeEvent
+        from teleads.state import set_state
+
+        uid = 1
+        await set_state(uid, "awaiting_ad_channels")
+        await self.redis.set(
+            f"temp_ad:{uid}", json.dumps({"content": "x", "schedule": "0-24 GMT+3", "channels": []})
+        )
+        await self.app.select_channel_callback(
+            FakeEvent(self.bot, data=f"chsel:{self.channels[0]}".encode(), sender_id=uid)
+        )
+
+    async def run_scale(self, n_ads, n_channels):
+        from bench.fakes import FakeEvent
+
+        await self.reset(n_ads, n_channels)
+        scenarios = [
+            ("scheduler cold", self.app.run_scheduler_once),
+            ("scheduler warm", self.app.run_scheduler_once),
+            ("outbox drain", self.drain_outbox),
+            ("send cold", self.send_sample),
+            ("send warm", self.send_sample),
+            ("send media cold", lambda: self.send_sample(media="creative")),
+            ("send media warm", lambda: self.send_sample(media="creative")),
+            ("adverts menu", lambda: self.app.show_adverts_menu(FakeEvent(self.bot))),
+            ("adverts page deep", lambda: self.app.show_advert_page(
+                FakeEvent(self.bot), "edit", cursor=f"ad{n_ads // 2}"
+            )),
+            ("channels page deep", lambda: self.app.show_channels_page(
+                FakeEvent(self.bot), cursor=self.channels[n_channels // 2]
+            )),
+            ("channel select cold", self.select_channel),
+            ("channel select warm", self.select_channel),
+            ("post history", self.post_history),
+        ]
+        results = {}
+        for name, make in scenarios:
+            results[name] = await self.measure(make)
+        return results
+
+
+def print_results(label, results):
+    print(f"\n=== {label} ===")
+    print(f"{'scenario':<22}{'wall':>10}{'telegram':>10}{'redis':>8}{'(cmds)':>9}{'prisma':>8}{'peak MB':>9}")
+    for name, r in results.items():
+        print(
+            f"{name:<22}{r['wall'] * 1000:>8.1f}ms{r['telegram']:>10}{r['redis']:>8}"
+            f"{r['redis_commands']:>9}{r['prisma']:>8}{r['peak_mb']:>9.1f}"
+        )
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for scale, scenarios in results.items():
+        for name, r in scenarios.items():
+            base = baseline.get(scale, {}).get(name)
+            if not base:
+                continue
+            for counter in ("telegram", "redis", "prisma"):
+                if r[counter] > base[counter]:
+                    regressions.append(f"{scale} {name}: {counter} {base[counter]} -> {r[counter]}")
+            if r["wall"] > base["wall"] * (1 + tolerance) and r["wall"] - base["wall"] > WALL_NOISE:
+                regressions.append(
+                    f"{scale} {name}: wall {base['wall'] * 1000:.1f}ms -> {r['wall'] * 1000:.1f}ms"
+                )
+    return regressions
+
+
+async def run(args):
+    app = load_app(args)
+    bench = Bench(app, args)
+    results = {}
+    for scale in args.scales.split(","):
+        n_ads, n_channels = map(int, scale.lower().split("x"))
+        results[scale] = await bench.run_scale(n_ads, n_channels)
+        print_results(f"{n_ads} ads x {n_channels} channels", results[scale])
+    return results
+
+
+def main():
+    args = parse_args()
+    baseline = None
+    if args.compare:
+        # Read before load_app changes the working directory
+        baseline = json.loads(Path(args.compare).read_text())
+    save = Path(args.save).resolve() if args.save else None
+
+    results = asyncio.run(run(args))
+
+    if save:
+        save.write_text(json.dumps(results, indent=2))
+        print(f"\nSaved to {save}")
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\n❌ Regressions against the baseline:")
+            for line in regressions:
+                print(line)
+            sys.exit(1)
+        print("\n✅ No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
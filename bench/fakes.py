@@ -0,0 +1,361 @@
+import asyncio
+import datetime
+import itertools
+from collections import Counter
+from types import SimpleNamespace
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeConnection
+from redis.asyncio import ConnectionPool
+from telethon import utils
+from telethon.tl.types import Channel, ChatPhotoEmpty, MessageMediaPhoto, Photo
+
+# Telethon uploads files in parts of up to 512 KB, one request each
+UPLOAD_PART = 512 * 1024
+
+
+def channel_id(n):
+    # Marked id of the n-th fake channel, the way the bot stores them
+    return str(utils.get_peer_id(fake_channel(n)))
+
+
+def fake_channel(real_id):
+    return Channel(
+        id=real_id,
+        title=f"Channel {real_id}",
+        photo=ChatPhotoEmpty(),
+        date=datetime.datetime(2024, 1, 1),
+        access_hash=real_id * 7,
+        broadcast=True,
+        username=f"channel{real_id}",
+    )
+
+
+# -------------------
+# Telegram
+# -------------------
+class FakeTelegramClient:
+    # Stands in for a TelegramClient: every method that would hit Telegram sleeps
+    # for `latency` and is counted, session-cache lookups are free like the real ones
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.calls = Counter()
+        self.session = {}
+
+    async def _rpc(self, name):
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def is_connected(self):
+        return True
+
+    def _entity(self, peer):
+        real_id, _ = utils.resolve_id(int(peer))
+        entity = fake_channel(real_id)
+        self.session[utils.get_peer_id(entity)] = entity
+        return entity
+
+    async def get_entity(self, peer):
+        await self._rpc("get_entity")
+        if isinstance(peer, list):
+            return [self._entity(p) for p in peer]
+        if isinstance(peer, str):
+            return self._entity(-1000000000000 - int(peer.removeprefix("channel")))
+        return self._entity(peer)
+
+    async def get_input_entity(self, peer):
+        if isinstance(peer, str):
+            return utils.get_input_peer(await self.get_entity(peer))
+        if hasattr(peer, "access_hash"):
+            return peer
+        if int(peer) not in self.session:
+            raise ValueError(f"Could not find the input entity for {peer}")
+        return utils.get_input_peer(self.session[int(peer)])
+
+    async def get_permissions(self, peer, user):
+        await self._rpc("get_permissions")
+        return SimpleNamespace(is_banned=False, post_messages=True)
+
+    async def send_message(self, peer, message, **kwargs):
+        await self._rpc("send_message")
+        return SimpleNamespace(id=self.calls["send_message"], message=message)
+
+    async def upload_file(self, file, file_name=None, **kwargs):
+        for _ in range(max(1, -(-len(file) // UPLOAD_PART))):
+            await self._rpc("upload_part")
+        return SimpleNamespace(name=file_name, size=len(file))
+
+    async def send_file(self, peer, file, caption=None, **kwargs):
+        await self._rpc("send_file")
+        msg_id = self.calls["send_file"]
+        # Uploads become a new photo; a sent photo handle is passed through as is
+        photo_id = getattr(file, "id", None) or msg_id
+        photo = Photo(
+            id=photo_id,
+            access_hash=photo_id * 3,
+            file_reference=b"ref",
+            date=datetime.datetime(2024, 1, 1),
+            sizes=[],
+            dc_id=1,
+        )
+        return SimpleNamespace(id=msg_id, media=MessageMediaPhoto(photo=photo), message=caption)
+
+    async def get_messages(self, peer, ids=None):
+        await self._rpc("get_messages")
+        return None
+
+    async def __call__(self, request):
+        await self._rpc(type(request).__name__)
+
+
+class FakeEvent:
+    # A bot callback or message: edits, replies and answers are Bot API calls
+
+    def __init__(self, bot, data=b"", sender_id=1, raw_text=""):
+        self.bot = bot
+        self.data = data
+        self.sender_id = sender_id
+        self.raw_text = raw_text
+        self.chat_id = sender_id
+
+    async def edit(self, *args, **kwargs):
+        await self.bot._rpc("edit")
+
+    async def respond(self, *args, **kwargs):
+        await self.bot._rpc("respond")
+
+    async def reply(self, *args, **kwargs):
+        await self.bot._rpc("reply")
+
+    async def answer(self, *args, **kwargs):
+        await self.bot._rpc("answer")
+
+
+# -------------------
+# Redis
+# -------------------
+def fake_redis_pool():
+    # In-memory Redis behind the real client classes, so pipelines and scripts
+    # go through the same code paths as production
+    return ConnectionPool(
+        connection_class=FakeConnection, server=FakeServer(), decode_responses=True
+    )
+
+
+def latency_redis(redis_class, pipeline_class, latency=0.0005):
+    # Extends the production client classes with a per-round-trip delay and counters
+    calls = Counter()
+
+    class LatencyPipeline(pipeline_class):
+        async def execute(self, raise_on_error=True):
+            calls["round_trips"] += 1
+            calls["commands"] += len(self.command_stack)
+            if latency:
+                await asyncio.sleep(latency)
+            return await super().execute(raise_on_error)
+
+    class LatencyRedis(redis_class):
+        async def execute_command(self, *args, **options):
+            calls["round_trips"] += 1
+            calls["commands"] += 1
+            if latency:
+                await asyncio.sleep(latency)
+            return await super().execute_command(*args, **options)
+
+        def pipeline(self, transaction=True, shard_hint=None):
+            return LatencyPipeline(
+                self.connection_pool, self.response_callbacks, transaction, shard_hint
+            )
+
+    client = LatencyRedis(connection_pool=fake_redis_pool())
+    client.calls = calls
+    return client
+
+
+# -------------------
+# Prisma
+# -------------------
+class FakeTable:
+    def __init__(self, db, name, key):
+        self.db = db
+        self.name = name
+        self.key = key
+        self.rows = {}
+
+    def _match(self, row, where):
+        for field, value in (where or {}).items():
+            actual = getattr(row, field)
+            if isinstance(value, dict):
+                if "startswith" in value and not actual.lower().startswith(value["startswith"].lower()):
+                    return False
+                if "gte" in value and actual < value["gte"]:
+                    return False
+                if "in" in value and actual not in value["in"]:
+                    return False
+            elif actual != value:
+                return False
+        return True
+
+    def _records(self, rows, include=None):
+        links = self.db.links_by_advert() if include and include.get("channels") else None
+        records = []
+        for row in rows:
+            record = SimpleNamespace(**vars(row))
+            if links is not None:
+                record.channels = links.get(row.id, [])
+            records.append(record)
+        return records
+
+    def _record(self, row, include=None):
+        return self._records([row], include)[0]
+
+    async def find_many(
+        self, where=None, include=None, order=None, take=None, skip=None, cursor=None, **_
+    ):
+        await self.db._query(self.name, "find_many")
+        rows = [row for row in self.rows.values() if self._match(row, where)]
+        # Prisma semantics: sort, start at the cursor row, skip, then take (backwards if negative)
+        for item in reversed(order if isinstance(order, list) else [order] if order else []):
+            field, direction = next(iter(item.items()))
+            rows.sort(key=lambda row: getattr(row, field), reverse=direction == "desc")
+        start = 0
+        if cursor:
+            field, value = next(iter(cursor.items()))
+            start = next((i for i, row in enumerate(rows) if getattr(row, field) == value), None)
+            if start is None:
+                return []
+        if take is not None and take < 0:
+            end = start + 1 - (skip or 0) if cursor else len(rows) - (skip or 0)
+            rows = rows[max(0, end + take) : max(0, end)]
+        else:
+            rows = rows[start + (skip or 0) :]
+            if take is not None:
+                rows = rows[:take]
+        return self._records(rows, include)
+
+    async def find_unique(self, where, include=None):
+        await self.db._query(self.name, "find_unique")
+        for row in self.rows.values():
+            if self._match(row, where):
+                return self._record(row, include)
+        return None
+
+    async def count(self, where=None):
+        await self.db._query(self.name, "count")
+        return sum(1 for row in self.rows.values() if self._match(row, where))
+
+    async def group_by(self, by, where=None, count=False):
+        await self.db._query(self.name, "group_by")
+        groups = Counter(
+            tuple(getattr(row, field) for field in by)
+            for row in self.rows.values()
+            if self._match(row, where)
+        )
+        return [
+            {**dict(zip(by, values)), "_count": {"_all": n}} for values, n in groups.items()
+        ]
+
+    def _insert(self, data):
+        now = datetime.datetime.now()
+        row = SimpleNamespace(**{"createdAt": now, "updatedAt": now, **data})
+        self.rows[self.key(row)] = row
+        return row
+
+    async def create(self, data):
+        await self.db._query(self.name, "create")
+        return self._record(self._insert(data))
+
+    async def create_many(self, data, skip_duplicates=False):
+        await self.db._query(self.name, "create_many")
+        created = 0
+        for item in data:
+            if self.key(SimpleNamespace(**item)) in self.rows:
+                continue
+            self._insert(item)
+            created += 1
+        return created
+
+    async def update(self, where, data):
+        await self.db._query(self.name, "update")
+        for row in self.rows.values():
+            if self._match(row, where):
+                vars(row).update(data)
+                return self._record(row)
+        return None
+
+    async def upsert(self, where, data):
+        await self.db._query(self.name, "upsert")
+        for row in self.rows.values():
+            if self._match(row, where):
+                vars(row).update(data.get("update", {}))
+                return self._record(row)
+        return self._record(self._insert(data["create"]))
+
+    async def delete_many(self, where=None):
+        await self.db._query(self.name, "delete_many")
+        doomed = [key for key, row in self.rows.items() if self._match(row, where)]
+        for key in doomed:
+            del self.rows[key]
+        if self.name == "advert":
+            self.db.advertchannel.rows = {
+                key: link for key, link in self.db.advertchannel.rows.items()
+                if link.advertId not in doomed
+            }
+        return len(doomed)
+
+
+class FakePrisma:
+    # The handful of Prisma calls teleads makes, over dicts, with a fixed latency per query
+
+    def __init__(self, latency=0.002):
+        self.latency = latency
+        self.calls = Counter()
+        self.advert = FakeTable(self, "advert", lambda row: row.id)
+        self.channel = FakeTable(self, "channel", lambda row: row.id)
+        self.advertchannel = FakeTable(
+            self, "advertchannel", lambda row: (row.advertId, row.channelId)
+        )
+        self.cache = FakeTable(self, "cache", lambda row: row.key)
+        self.media = FakeTable(self, "media", lambda row: row.id)
+        # Autoincrement ids, as MySQL hands them out
+        ids = itertools.count(1)
+        self.postlog = FakeTable(self, "postlog", lambda row: vars(row).setdefault("id", next(ids)))
+
+    async def _query(self, model, method):
+        self.calls[f"{model}.{method}"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def links_by_advert(self):
+        links = {}
+        for link in self.advertchannel.rows.values():
+            links.setdefault(link.advertId, []).append(link)
+        return links
+
+    def tx(self):
+        db = self
+
+        class Transaction:
+            async def __aenter__(self):
+                return db
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return Transaction()
+
+    async def execute_raw(self, query, *args):
+        await self._query("raw", "execute_raw")
+        if "NOT `active`" in query:
+            row = self.advert.rows.get(args[0])
+            if row:
+                row.active = not row.active
+                return 1
+        return 0
+
+    async def connect(self):
+        pass
+
+    async def disconnect(self):
+        pass
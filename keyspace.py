@@ -0,0 +1,35 @@
+import argparse
+import asyncio
+from teleads.helpers import get_adverts, get_channels
+from teleads.keyspace import compact, format_report, key_report
+from teleads.prisma import db
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Redis key counts and memory per prefix; --compact migrates the old "
+        "per-pair slot keys and drops keys of deleted adverts and channels."
+    )
+    parser.add_argument("--compact", action="store_true")
+    parser.add_argument("--dry-run", action="store_true", help="with --compact: only count")
+    parser.add_argument("--top", type=int, default=50, help="prefixes shown in the report")
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_args()
+    if args.compact:
+        await db.connect()
+        try:
+            ad_ids = [ad["id"] for ad in await get_adverts()]
+            channels = await get_channels()
+        finally:
+            await db.disconnect()
+        counts = await compact(ad_ids, channels, dry_run=args.dry_run)
+        verb = "Would change" if args.dry_run else "Changed"
+        print(f"🧹 {verb}: " + (", ".join(f"{n} {what}" for what, n in sorted(counts.items())) or "nothing"))
+    print(format_report(await key_report(), top=args.top))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,63 +1,114 @@
 import asyncio
 import json
 import sys
+import time
 import uuid
 import datetime
-import pytz
-from teleads.helpers import get_adverts, set_adverts, get_channels, set_channels
-from teleads.redis import redis
+from teleads.helpers import (
+    get_adverts,
+    get_advert,
+    create_advert,
+    update_advert,
+    toggle_advert,
+    set_advert_channels,
+    delete_advert,
+    set_advert_media,
+    get_adverts_page,
+    get_channels,
+    get_channels_page,
+    remove_channel,
+    migrate_cache_blob,
+    cache_stats,
+)
+from teleads.redis import redis, pool as redis_pool
+from teleads.posting import Posted, PostJob, engine
+from teleads.floodwait import AccountUnavailable, FloodDeferred, SendFailed, flood_table, retry_queue
+from teleads.accounts import account_pool
+from teleads.scheduler import Scheduler, scheduler_now
+from teleads.slots import record_sent_many
+from teleads.outbox import OutboxWorker, enqueue, stats as outbox_stats
+from teleads.leader import LeaderLease
+from teleads.simulate import simulate, simulation_now
+from teleads.rules import parse_schedule, rule_book
+from teleads.membership import ensure_member, forget_member, input_peer, rpc, rpc_counter
+from teleads.metrics import observe, start_metrics_server, timed_handler
+from teleads.entities import get_channel_meta, get_channel_titles
+from teleads.state import get_state, set_state, clear_state, get_search, set_search, clear_search
+from teleads.keyspace import format_report, key_report
+from teleads.tokens import callback_tokens
+from teleads.runs import scheduler_runs
+from teleads.onboarding import LINKS_FILE_MAX_BYTES, Onboarding, parse_links
+from teleads.startup import Startup, format_history, startup_history, warm_caches
+from teleads.ledger import (
+    failure_rate,
+    post_ledger,
+    posts_by_account,
+    posts_by_channel,
+    posts_by_day,
+)
+from teleads.media import BOT_ACCOUNT, CAPTION_LIMIT, media_from_message, media_sender, save_media
 from telethon import events, Button, TelegramClient
-from telethon.tl.functions.channels import JoinChannelRequest
-from telethon.errors import FloodWaitError, ChatAdminRequiredError, ChannelPrivateError
+from telethon.errors import (
+    FloodWaitError,
+    SlowModeWaitError,
+    ChatAdminRequiredError,
+    ChannelPrivateError,
+    ChatWriteForbiddenError,
+    UserBannedInChannelError,
+    UserNotParticipantError,
+)
 import telethon
-from teleads.config import BOT_TOKEN, API_ID, API_HASH, CLIENT_ID, CLIENT_HASH, CHANNEL_RULES
-from uuid import uuid4
+from teleads.config import (
+    BOT_TOKEN, API_ID, API_HASH, DRAFT_TTL, MEDIA_MAX_BYTES, SIMULATE_MAX_DAYS, TELEADS_ROLE,
+)
 from teleads.prisma import db
 
 # -------------------
 # Clients
 # -------------------
 bot_client = TelegramClient("sessions/bot_session", API_ID, API_HASH)
-user_client = TelegramClient("sessions/user_session", CLIENT_ID, CLIENT_HASH)
-
-# Temporary mapping: short keys → (ad_id, ch_id)
-instant_post_map = {}
-
-def get_state(uid):
-    return redis.get(f"state:{uid}")
-
-def set_state(uid, state):
-    redis.set(f"state:{uid}", state)
-
-def clear_state(uid):
-    redis.delete(f"state:{uid}")
-    
-def get_channel_last(ad_id, ch_id):
-    key = f"ad_posted:{ad_id}:{ch_id}"
-    val = redis.get(key)
-    return datetime.datetime.fromisoformat(val) if val else None
-
-def set_channel_last(ad_id, ch_id, dt):
-    key = f"ad_posted:{ad_id}:{ch_id}"
-    redis.set(key, dt.isoformat())
-
-def get_last_posted(ad_id):
-    date_str = redis.get(f"ad_posted:{ad_id}")
-    return datetime.datetime.fromisoformat(date_str) if date_str else None
-
-def set_last_posted(ad_id, dt):
-    redis.set(f"ad_posted:{ad_id}", dt.isoformat())
+# The first pooled account does lookups and menus; sends are sharded over the pool
+user_client = account_pool.primary.client
+USER_ACCOUNT = account_pool.primary.name
+engine.pool = account_pool
+
+def on(event):
+    # bot_client.on, with a latency histogram per handler
+    def decorator(handler):
+        bot_client.add_event_handler(timed_handler(handler), event)
+        return handler
+
+    return decorator
+
+scheduler = Scheduler()
+# State moved under the event-driven scheduler after a manual run, let it recompute its heap
+scheduler_runs.on_planned = scheduler.invalidate_all
+# Every replica serves the bot; only the lease holder runs the scheduler
+scheduler_lease = LeaderLease("scheduler")
+
+# Send failures that mean the cached membership/rights for a channel are stale
+PERMISSION_ERRORS = (
+    ChannelPrivateError,
+    ChatAdminRequiredError,
+    ChatWriteForbiddenError,
+    UserBannedInChannelError,
+    UserNotParticipantError,
+)
 
 async def find_ad(ad_id):
-    adverts = await get_adverts()
-    for ad in adverts:
-        if ad["id"] == ad_id:
-            return ad
-    return None
+    return await get_advert(ad_id)
 
 # -------------------
 # UI
 # -------------------
+# Channels listed on the stats screens
+STATS_TOP = 15
+
+# Seconds between edits of a scheduler run's progress message
+RUN_PROGRESS_INTERVAL = 3
+
+progress_tasks = set()
+
 async def show_main_menu(event):
     buttons=[
         [Button.inline("🛰 Channels", data=b"channels")],
@@ -65,6 +116,11 @@ async def show_main_menu(event):
         [Button.inline("⚡ Run Scheduler", data=b"run_scheduler_once")],
         [Button.inline("🌩️ Instant Post (Ad)", data=b"run_without_scheduler")],
         [Button.inline("⛈️ Instant Post (Ad & Channel)", data=b"instant_post_select_ad")],
+        [Button.inline("📐 Channel Rules", data=b"rules")],
+        [Button.inline("⏳ Flood Backoff", data=b"backoff")],
+        [Button.inline("📬 Outbox", data=b"outbox")],
+        [Button.inline("👥 Accounts", data=b"accounts")],
+        [Button.inline("📊 Post History", data=b"stats")],
     ]
 
     try:
@@ -72,27 +128,99 @@ async def show_main_menu(event):
     except Exception:
         await event.respond("📋 Main Menu:", buttons=buttons)
 
-async def show_adverts_menu(event):
-    try:
-        adverts = await get_adverts()
-        if not adverts:
-            await event.edit(
-                "📝 No adverts yet.",
-                buttons=[
-                    [Button.inline("➕ New Ad", data=b"new_ad")],
-                    [Button.inline("⬅️ Back", data=b"back")],
-                ],
-            )
+# Channel multi-select while creating or editing an ad: state -> (draft key, done callback)
+CHANNEL_PICKERS = {
+    "awaiting_ad_channels": ("temp_ad:{}", b"done_selecting_channels"),
+    "editing_channels": ("temp_edit_ad:{}", b"done_editing_channels"),
+}
+
+
+async def show_channel_picker(event, state, cursor=None, backward=False, respond=False):
+    # One page of channels with a toggle each; the draft remembers the page so a
+    # toggle redraws the same one
+    key = CHANNEL_PICKERS[state][0].format(event.sender_id)
+    draft = json.loads(await redis.get(key))
+    draft["page"] = [cursor, backward]
+    await redis.set(key, json.dumps(draft), ex=DRAFT_TTL)
+
+    page = await get_channels_page(cursor, backward)
+    titles = await get_channel_titles(user_client, page.items)
+    selected = set(draft["channels"])
+    buttons = [
+        [Button.inline(
+            f"{'✅' if ch_id in selected else '⬜'} {titles[ch_id]}", data=f"chsel:{ch_id}".encode()
+        )]
+        for ch_id in page.items
+    ]
+    buttons += page_nav(page, "chsel_page")
+    buttons.append([Button.inline("✅ Done", data=CHANNEL_PICKERS[state][1])])
+    text = (
+        f"📡 Select channels for this ad ({len(selected)} selected, none means every "
+        "channel), then ✅ Done:"
+    )
+    await (event.respond if respond else event.edit)(text, buttons=buttons)
+
+# Paged advert lists: menu -> (title, callback prefix of an advert button)
+ADVERT_MENUS = {
+    "edit": ("📝 Your adverts:", "edit_ad"),
+    "all": ("📝 Select an ad to post instantly (to all its channels):", "instant_post_ad_all"),
+    "pick": ("📝 Select an ad to instantly post:", "instant_post_ad"),
+}
+
+
+def page_nav(page, prefix, key=lambda item: item):
+    # Prev/next row; each button carries the id of the row to page from
+    nav = []
+    if page.has_prev and page.items:
+        nav.append(Button.inline("◀️ Prev", data=f"{prefix}:<:{key(page.items[0])}".encode()))
+    if page.has_next and page.items:
+        nav.append(Button.inline("Next ▶️", data=f"{prefix}:>:{key(page.items[-1])}".encode()))
+    return [nav] if nav else []
+
+
+async def show_advert_page(event, menu, cursor=None, backward=False, respond=False):
+    title, action = ADVERT_MENUS[menu]
+    search = await get_search(event.sender_id)
+    page = await get_adverts_page(cursor, backward, prefix=search)
+    show = event.respond if respond else event.edit
+
+    if not page.items and not search:
+        if menu != "edit":
+            await event.answer("❌ No adverts available.", alert=True)
             return
+        await show(
+            "📝 No adverts yet.",
+            buttons=[
+                [Button.inline("➕ New Ad", data=b"new_ad")],
+                [Button.inline("⬅️ Back", data=b"back")],
+            ],
+        )
+        return
 
-        buttons = []
-        for ad in adverts:
-            label = f"{'🟢' if ad['active'] else '🔴'} {ad['content'][:25]}"
-            buttons.append([Button.inline(label, data=f"edit_ad:{ad['id']}".encode())])
+    buttons = []
+    for ad in page.items:
+        label = f"{'🟢' if ad['active'] else '🔴'} {ad['content'][:25]}"
+        buttons.append([Button.inline(label, data=f"{action}:{ad['id']}".encode())])
+    buttons.extend(page_nav(page, f"adpage:{menu}", key=lambda ad: ad["id"]))
+    search_row = [Button.inline("🔍 Search", data=f"adsearch:{menu}".encode())]
+    if search:
+        search_row.append(Button.inline("✖️ Clear search", data=f"adclear:{menu}".encode()))
+    buttons.append(search_row)
+    if menu == "edit":
         buttons.append([Button.inline("➕ New Ad", data=b"new_ad")])
-        buttons.append([Button.inline("⬅️ Back", data=b"back")])
+    buttons.append([Button.inline("⬅️ Back", data=b"back")])
+
+    text = title
+    if search:
+        text += f"\n🔍 Starting with: {search}"
+        if not page.items:
+            text += "\nNothing found."
+    await show(text, buttons=buttons)
 
-        await event.edit("📝 Your adverts:", buttons=buttons)
+
+async def show_adverts_menu(event):
+    try:
+        await show_advert_page(event, "edit")
     except Exception as e:
         await event.answer(f"❌ Failed to load adverts: {e}", alert=True)
 
@@ -100,165 +228,492 @@ async def show_adverts_menu(event):
 # -------------------
 # Callbacks
 # -------------------
-@bot_client.on(events.NewMessage(pattern="/start"))
+@on(events.NewMessage(pattern="/start"))
 async def start_handler(event):
     # remove any lingering state
-    clear_state(event.sender_id)
+    await clear_state(event.sender_id)
+    await clear_search(event.sender_id)
     await show_main_menu(event)
 
 
-@bot_client.on(events.CallbackQuery(data=b"adverts"))
+@on(events.NewMessage(pattern="/cache"))
+async def cache_stats_handler(event):
+    lines = ["🧠 Cache stats:"]
+    for name, stats in cache_stats().items():
+        lines.append(
+            f"{name}: {stats['hits']} hits / {stats['misses']} misses "
+            f"({stats['hit_rate']:.0%}), version {stats['version']}"
+        )
+    await event.respond("\n".join(lines))
+
+
+@on(events.NewMessage(pattern="/keys"))
+async def keys_handler(event):
+    # SCANs the whole keyspace, fine for an admin command, not for a hot path
+    await event.respond(format_report(await key_report(), top=30))
+
+
+@on(events.NewMessage(pattern="/startup"))
+async def startup_handler(event):
+    await event.respond(format_history(await startup_history()))
+
+
+@on(events.NewMessage(pattern="/throughput"))
+async def throughput_handler(event):
+    if not engine.history:
+        await event.respond("📈 No posting runs yet.")
+        return
+    lines = [f"📈 Last posting runs (concurrency {engine.concurrency}):"]
+    lines.extend(stats.summary() for stats in reversed(engine.history))
+    lines.append(f"\n📞 {rpc_counter.summary()}")
+    await event.respond("\n".join(lines))
+
+
+@on(events.NewMessage(pattern=r"/simulate(?:\s+(\S+))?(?:\s+(\d+))?$"))
+async def simulate_handler(event):
+    # /simulate [ad_id] [days]: dry run of the rules, nothing is sent or written
+    ad_id, days = event.pattern_match.group(1), int(event.pattern_match.group(2) or 7)
+    if days > SIMULATE_MAX_DAYS:
+        await event.respond(f"❌ Simulate at most {SIMULATE_MAX_DAYS} days.")
+        return
+    all_channels = await get_channels()
+    if ad_id:
+        ad = await find_ad(ad_id)
+        if not ad:
+            await event.respond("❌ Ad not found.")
+            return
+        targets = [(ad, ad["channels"] or all_channels)]
+    else:
+        targets = [(ad, ad["channels"] or all_channels) for ad in await get_adverts() if ad["active"]]
+
+    simulation = await simulate(targets, simulation_now(), days)
+    # Tallying the simulated posts is CPU work as well, keep it off the loop
+    summary, calendar = await asyncio.to_thread(
+        lambda: (simulation.summary(accounts=len(account_pool)), simulation.calendar())
+    )
+    lines = [summary]
+    busiest = sorted(calendar.items(), key=lambda item: sum(item[1].values()), reverse=True)[:10]
+    titles = await get_channel_titles(user_client, [ch for ch, _ in busiest])
+    if busiest:
+        lines.append("\nBusiest channels:")
+    for ch, hours in busiest:
+        used = sorted({hour.hour for hour in hours})
+        lines.append(
+            f"{titles[ch]}: {sum(hours.values())} posts, hours {', '.join(map(str, used))}"
+        )
+    await event.respond("\n".join(lines))
+
+
+@on(events.CallbackQuery(data=b"adverts"))
 async def adverts_callback(event):
     await show_adverts_menu(event)
 
 
-@bot_client.on(events.CallbackQuery(data=b"run_scheduler_once"))
+@on(events.CallbackQuery(data=b"run_scheduler_once"))
 async def run_scheduler_once_callback(event):
-    await event.respond("⚡ Running scheduler once for debug...")
-    await run_scheduler_once()
-    await event.respond("✅ Scheduler run completed!")
+    # The run goes on in the background; pressing again while it does joins it
+    joined = scheduler_runs.running
+    run = scheduler_runs.start()
+    await event.answer("Joining the run in progress." if joined else "Scheduler run started.")
+    message = await event.respond(run.summary(), buttons=run_buttons(run))
+    task = asyncio.create_task(show_run_progress(message, run))
+    progress_tasks.add(task)
+    task.add_done_callback(progress_tasks.discard)
+
+def run_buttons(run):
+    return [[Button.inline("🛑 Cancel", data=b"cancel_run")]] if run.running else None
+
+async def show_run_progress(message, run):
+    # Edits the progress message until the run is over
+    text = message.text
+    while True:
+        finished = not run.running
+        if run.summary() != text:
+            text = run.summary()
+            try:
+                await message.edit(text, buttons=run_buttons(run))
+            except telethon.errors.rpcerrorlist.MessageNotModifiedError:
+                pass
+            except Exception as e:
+                print(f"⚠️ Stopped reporting scheduler run progress: {e}")
+                return
+        if finished:
+            return
+        await asyncio.wait([run.task], timeout=RUN_PROGRESS_INTERVAL)
 
-@bot_client.on(events.CallbackQuery(data=b"run_without_scheduler"))
-async def run_without_scheduler(event):
-    adverts = await get_adverts()
-    if not adverts:
-        await event.answer("❌ No adverts available.", alert=True)
-        return
+@on(events.CallbackQuery(data=b"cancel_run"))
+async def cancel_run_callback(event):
+    if scheduler_runs.cancel():
+        await event.answer("Cancelling, posts already queued still go out.")
+    else:
+        await event.answer("No scheduler run in progress.")
+
+@on(events.CallbackQuery(data=b"backoff"))
+async def backoff_callback(event):
+    rows = await flood_table.table()
+    if rows:
+        lines = ["⏳ Active flood waits:"]
+        for scope, remaining in rows:
+            lines.append(f"{scope}: {int(remaining)}s left")
+    else:
+        lines = ["✅ No active flood waits."]
 
-    buttons = []
-    for ad in adverts:
-        label = f"{'🟢' if ad['active'] else '🔴'} {ad['content'][:25]}"
-        buttons.append([Button.inline(label, data=f"instant_post_ad_all:{ad['id']}".encode())])
+    pending = retry_queue.pending()
+    if pending:
+        lines.append(f"\n🔁 {len(pending)} post(s) queued for retry:")
+        for ready_at, job in pending[:20]:
+            wait = max(0, int(ready_at - time.time()))
+            lines.append(f"ad {job.ad['id'][:8]} → {job.ch_id} in {wait}s")
+
+    try:
+        await event.edit("\n".join(lines), buttons=[[Button.inline("⬅️ Back", data=b"back")]])
+    except telethon.errors.rpcerrorlist.MessageNotModifiedError:
+        await event.answer("Nothing changed.")
+
+@on(events.CallbackQuery(data=b"outbox"))
+async def outbox_callback(event):
+    stats = await outbox_stats()
+    lines = [
+        "📬 Outbox:",
+        f"Queued: {stats['queued']}",
+        f"Being sent: {stats['pending']}",
+        f"Waiting for retry: {stats['delayed']}",
+        f"Dead letters: {stats['dead']}",
+    ]
+    holder, token = await scheduler_lease.current()
+    if holder:
+        me = " (this replica)" if scheduler_lease.is_leader else ""
+        lines.append(f"👑 Scheduler leader: {holder}{me}, token {token}")
+    else:
+        lines.append("👑 No scheduler leader right now")
+    for _, fields in stats["recent_dead"]:
+        lines.append(
+            f"💀 ad {fields['ad_id'][:8]} → {fields['ch_id']}: "
+            f"{fields.get('error', '?')} after {fields.get('attempt')} attempts"
+        )
+    try:
+        await event.edit("\n".join(lines), buttons=[[Button.inline("⬅️ Back", data=b"back")]])
+    except telethon.errors.rpcerrorlist.MessageNotModifiedError:
+        await event.answer("Nothing changed.")
+
+@on(events.CallbackQuery(data=b"accounts"))
+async def accounts_callback(event):
+    await flood_table.load()
+    shares = account_pool.shares(await get_channels())
+    lines = [f"👥 {len(account_pool)} user account(s):"]
+    for account in account_pool:
+        last = (
+            f", last post {int(time.time() - account.last_sent_at)}s ago"
+            if account.last_sent_at
+            else ""
+        )
+        lines.append(
+            f"\n{account.name} ({account.health()}): {shares[account.name]} channel(s)\n"
+            f"{account.sent} sent, {account.failed} failed, {account.failovers} failed over{last}"
+        )
+        if account.last_error:
+            lines.append(f"Last error: {account.last_error}")
+    try:
+        await event.edit("\n".join(lines), buttons=[[Button.inline("⬅️ Back", data=b"back")]])
+    except telethon.errors.rpcerrorlist.MessageNotModifiedError:
+        await event.answer("Nothing changed.")
+
+def outcome_summary(outcomes):
+    line = f"✅ {outcomes.get('sent', 0)} ❌ {outcomes.get('failed', 0)}"
+    if outcomes.get("deferred"):
+        line += f" ⏳ {outcomes['deferred']}"
+    return line
+
+
+def day_lines(by_day):
+    if not by_day:
+        return ["No posts recorded."]
+    return [f"{day:%m-%d}: {outcome_summary(o)}" for day, o in sorted(by_day.items())]
+
+
+def top_channels(by_ch, top=STATS_TOP):
+    return sorted(by_ch.items(), key=lambda item: sum(item[1].values()), reverse=True)[:top]
+
+
+@on(events.CallbackQuery(data=b"stats"))
+async def stats_callback(event):
+    by_day, by_account = await asyncio.gather(posts_by_day(14), posts_by_account(30))
+    lines = ["📊 Posts in the last 14 days:", *day_lines(by_day)]
+    if by_account:
+        lines.append("\n👥 Failure rate per account (30 days):")
+        for account, outcomes in sorted(by_account.items()):
+            lines.append(f"{account}: {failure_rate(outcomes):.0%} ({outcome_summary(outcomes)})")
+    if post_ledger.buffer or post_ledger.dropped:
+        lines.append(f"\n📝 {len(post_ledger.buffer)} attempt(s) not written yet, {post_ledger.dropped} dropped")
+    await event.edit(
+        "\n".join(lines),
+        buttons=[
+            [Button.inline("📡 By channel", data=b"stats_channels")],
+            [Button.inline("⬅️ Back", data=b"back")],
+        ],
+    )
+
+
+@on(events.CallbackQuery(data=b"stats_channels"))
+async def stats_channels_callback(event):
+    rows = top_channels(await posts_by_channel(30))
+    titles = await get_channel_titles(user_client, [ch for ch, _ in rows])
+    buttons = [
+        [Button.inline(
+            f"{titles[ch]}: {outcome_summary(o)} · {failure_rate(o):.0%} failed",
+            data=f"ch_stats:{ch}".encode(),
+        )]
+        for ch, o in rows
+    ]
+    buttons.append([Button.inline("⬅️ Back", data=b"stats")])
+    text = f"📡 Busiest {len(rows)} channel(s), last 30 days:" if rows else "No posts recorded."
+    await event.edit(text, buttons=buttons)
+
+
+@on(events.CallbackQuery(pattern=b"ch_stats:(.*)"))
+async def channel_stats_callback(event):
+    ch_id = event.data.decode().split(":", 1)[1]
+    titles = await get_channel_titles(user_client, [ch_id])
+    lines = [f"📡 {titles[ch_id]}, last 30 days:", *day_lines(await posts_by_day(30, ch_id=ch_id))]
+    await event.edit("\n".join(lines), buttons=[[Button.inline("⬅️ Back", data=b"stats_channels")]])
 
+
+@on(events.CallbackQuery(pattern=b"ad_stats:(.*)"))
+async def advert_stats_callback(event):
+    ad_id = event.data.decode().split(":", 1)[1]
+    by_day, by_ch = await asyncio.gather(
+        posts_by_day(30, ad_id=ad_id), posts_by_channel(30, ad_id=ad_id)
+    )
+    rows = top_channels(by_ch)
+    titles = await get_channel_titles(user_client, [ch for ch, _ in rows])
+    lines = ["📊 This ad, last 30 days:", *day_lines(by_day)]
+    if rows:
+        lines.append("\n📡 Per channel:")
+        lines.extend(f"{titles[ch]}: {outcome_summary(o)}" for ch, o in rows)
+    await event.edit("\n".join(lines), buttons=[[Button.inline("⬅️ Back", data=f"edit_ad:{ad_id}".encode())]])
+
+
+@on(events.CallbackQuery(data=b"rules"))
+async def rules_callback(event):
+    await rule_book.refresh()
+    channels = await get_channels()
+    titles = await get_channel_titles(user_client, channels)
+    buttons = []
+    for ch_id in channels:
+        kind = rule_book.get(ch_id).kind
+        buttons.append([Button.inline(f"{titles[ch_id]} · {kind}", data=f"rule:{ch_id}".encode())])
     buttons.append([Button.inline("⬅️ Back", data=b"back")])
-    await event.edit("📝 Select an ad to post instantly (to all its channels):", buttons=buttons)
+    await event.edit("📐 Posting rules per channel:", buttons=buttons)
+
+@on(events.CallbackQuery(pattern=b"rule:(.*)"))
+async def rule_callback(event):
+    ch_id = event.data.decode().split(":", 1)[1]
+    await rule_book.refresh()
+    rule = rule_book.get(ch_id)
+    text = (
+        f"📐 Rule for {ch_id}: {rule.kind}\n"
+        f"Policies: {', '.join(p.name for p in rule.policies)}\n\n"
+        f"{json.dumps(rule.spec, indent=2)}"
+    )
+    await event.edit(
+        text,
+        buttons=[
+            [Button.inline("✏️ Edit", data=f"rule_edit:{ch_id}".encode())],
+            [Button.inline("🗑 Reset to default", data=f"rule_reset:{ch_id}".encode())],
+            [Button.inline("⬅️ Back", data=b"rules")],
+        ],
+    )
+
+@on(events.CallbackQuery(pattern=b"rule_edit:(.*)"))
+async def rule_edit_callback(event):
+    ch_id = event.data.decode().split(":", 1)[1]
+    await event.edit(
+        "✍️ Send the rule as JSON, e.g.\n"
+        '`{"type": "custom", "start": 10, "end": 22, "max_posts_per_day": 2, "max_length": 110}`\n'
+        "Types: barcelona, ltgrupe, hourly, custom, normal.",
+        buttons=[[Button.inline("⬅️ Cancel", data=f"rule:{ch_id}".encode())]],
+    )
+    await set_state(event.sender_id, f"editing_rule:{ch_id}")
+
+@on(events.CallbackQuery(pattern=b"rule_reset:(.*)"))
+async def rule_reset_callback(event):
+    ch_id = event.data.decode().split(":", 1)[1]
+    await rule_book.delete_rule(ch_id)
+    scheduler.invalidate_all()
+    await event.answer("✅ Rule reset to default")
+    await rules_callback(event)
+
+@on(events.CallbackQuery(data=b"run_without_scheduler"))
+async def run_without_scheduler(event):
+    await show_advert_page(event, "all")
 
-@bot_client.on(events.CallbackQuery(data=b"back"))
+@on(events.CallbackQuery(data=b"back"))
 async def handle_back(event):
-    clear_state(event.sender_id)
+    await clear_state(event.sender_id)
     await show_main_menu(event)
 
-@bot_client.on(events.CallbackQuery(data=b"instant_post_select_ad"))
+@on(events.CallbackQuery(data=b"instant_post_select_ad"))
 async def instant_post_select_ad_callback(event):
-    adverts = await get_adverts()
-    if not adverts:
-        await event.answer("❌ No adverts available.", alert=True)
-        return
+    await show_advert_page(event, "pick")
 
-    buttons = []
-    for ad in adverts:
-        label = f"{'🟢' if ad['active'] else '🔴'} {ad['content'][:25]}"
-        buttons.append([Button.inline(label, data=f"instant_post_ad:{ad['id']}".encode())])
+@on(events.CallbackQuery(pattern=rb"adpage:(\w+):([<>]):(.*)"))
+async def advert_page_callback(event):
+    menu, direction, cursor = (g.decode() for g in event.pattern_match.groups())
+    await show_advert_page(event, menu, cursor, backward=direction == "<")
 
-    buttons.append([Button.inline("⬅️ Back", data=b"back")])
-    await event.edit("📝 Select an ad to instantly post:", buttons=buttons)
+@on(events.CallbackQuery(pattern=rb"adsearch:(\w+)"))
+async def advert_search_callback(event):
+    menu = event.pattern_match.group(1).decode()
+    await set_state(event.sender_id, f"awaiting_ad_search:{menu}")
+    await event.edit(
+        "🔍 Send the beginning of the advert text:",
+        buttons=[[Button.inline("⬅️ Cancel", data=f"adclear:{menu}".encode())]],
+    )
 
-@bot_client.on(events.CallbackQuery(data=b"channels"))
-async def handle_channels(event):
-    channels = await get_channels()  # list of channel IDs as strings
-    if channels:
+@on(events.CallbackQuery(pattern=rb"adclear:(\w+)"))
+async def advert_clear_search_callback(event):
+    await clear_search(event.sender_id)
+    await clear_state(event.sender_id)
+    await show_advert_page(event, event.pattern_match.group(1).decode())
+
+async def show_channels_page(event, cursor=None, backward=False):
+    page = await get_channels_page(cursor, backward)
+    buttons = []
+    if page.items:
+        meta = await get_channel_meta(user_client, page.items)
         lines = []
-        for ch_id in channels:
-            try:
-                entity = await user_client.get_entity(int(ch_id))
-                lines.append(f"{getattr(entity, 'title', ch_id)} ({ch_id})")
-            except Exception:
+        for ch_id in page.items:
+            title = (meta.get(ch_id) or {}).get("title")
+            if title:
+                lines.append(f"{title} ({ch_id})")
+            else:
                 lines.append(f"❌ Could not fetch {ch_id}")
-        text = "📡 Current Channels:\n" + "\n".join(lines)
+            buttons.append([Button.inline(f"🗑 {title or ch_id}", data=f"chdel:{ch_id}".encode())])
+        text = "📡 Current Channels (tap 🗑 to remove one):\n" + "\n".join(lines)
     else:
         text = "No channels added yet."
 
     await event.edit(
-        f"{text}\n\nSend me a Telegram channel link (t.me/...) to add one.",
-        buttons=[[Button.inline("⬅️ Back", data=b"back")]],
+        f"{text}\n\nSend me Telegram channel links (t.me/...) to add them: any number "
+        "in one message, or a .txt file with one per line.",
+        buttons=buttons + page_nav(page, "chpage") + [[Button.inline("⬅️ Back", data=b"back")]],
     )
-    set_state(event.sender_id, "awaiting_channel")
+    await set_state(event.sender_id, "awaiting_channel")
+
+@on(events.CallbackQuery(data=b"channels"))
+async def handle_channels(event):
+    await show_channels_page(event)
+
+@on(events.CallbackQuery(pattern=rb"chpage:([<>]):(.*)"))
+async def channel_page_callback(event):
+    direction, cursor = (g.decode() for g in event.pattern_match.groups())
+    await show_channels_page(event, cursor, backward=direction == "<")
+
+@on(events.CallbackQuery(pattern=rb"chdel:(.*)"))
+async def remove_channel_callback(event):
+    # Drops the channel, its links to adverts and everything kept for it in Redis
+    ch_id = event.data.decode().split(":", 1)[1]
+    if not await remove_channel(ch_id):
+        await event.answer("❌ Channel not found.", alert=True)
+        return
+    scheduler.invalidate_all()
+    await event.answer("🗑 Channel removed.")
+    await show_channels_page(event)
 
 
-@bot_client.on(events.CallbackQuery(data=b"new_ad"))
+@on(events.CallbackQuery(data=b"new_ad"))
 async def new_ad_callback(event):
     await event.edit(
         "✍️ Send the content for your new advertisement:",
         buttons=[[Button.inline("⬅️ Cancel", data=b"adverts")]],
     )
-    set_state(event.sender_id, "awaiting_ad_content")
+    await set_state(event.sender_id, "awaiting_ad_content")
 
 
-@bot_client.on(events.NewMessage)
+@on(events.NewMessage)
 async def handle_messages(event):
     uid = event.sender_id
-    state = get_state(uid)
+    state = await get_state(uid)
     if not state:
         # Ignore normal messages unless user is in a flow
         return
 
     if state == "awaiting_channel":
-        text = event.raw_text.strip()
-        if "t.me/" not in text:
-            clear_state(uid)
-            await event.respond("❌ Invalid channel link. Try again.")
+        text = event.raw_text
+        if event.document:
+            if event.file.size > LINKS_FILE_MAX_BYTES:
+                await event.respond("❌ That file is too big for a list of links.")
+                return
+            with observe("telegram", "download_media"):
+                data = await event.download_media(file=bytes)
+            text += "\n" + data.decode("utf-8", errors="ignore")
+        links = parse_links(text)
+        if not links:
+            await clear_state(uid)
+            await event.respond("❌ No channel links found. Try again.")
             return
+
+        await clear_state(uid)
+        onboarding = Onboarding(user_client, USER_ACCOUNT, links)
+        status = await event.respond(onboarding.progress())
+        task = asyncio.create_task(onboarding.run())
+        # Progress while the links resolve, the report once they're committed
+        while not task.done():
+            await asyncio.wait([task], timeout=RUN_PROGRESS_INTERVAL)
+            if not task.done():
+                try:
+                    await status.edit(onboarding.progress())
+                except telethon.errors.rpcerrorlist.MessageNotModifiedError:
+                    pass
         try:
-            entity = await user_client.get_entity(text)
-            eid = int(getattr(entity, "id"))
-            eid_str = str(eid)
-            if not eid_str.startswith("-100"):
-                full = f"-100{abs(eid)}"
-            else:
-                full = eid_str
-
-            channels = await get_channels()
-            if full not in channels:
-                channels.append(full)
-                await set_channels(channels)
-                await event.respond(
-                    f"✅ Added channel {getattr(entity, 'title', text)} ({full})"
-                )
-            else:
-                await event.respond("⚠️ Channel already added.")
+            added = task.result()
         except Exception as e:
-            await event.respond(f"❌ Failed: {e}")
-        finally:
-            clear_state(uid)
-            await show_main_menu(event)
+            await status.edit(f"❌ Failed: {e}")
+        else:
+            if added:
+                # Ads without an explicit channel list post everywhere
+                scheduler.invalidate_all()
+            await status.edit(onboarding.report())
+        await show_main_menu(event)
     elif state == "awaiting_ad_content":
-        redis.set(f"temp_ad_content:{uid}", event.raw_text)
+        if media_from_message(event.message):
+            if event.file.size > MEDIA_MAX_BYTES:
+                await event.respond(f"❌ Files are limited to {MEDIA_MAX_BYTES // 1024 // 1024} MB.")
+                return
+            if len(event.raw_text) > CAPTION_LIMIT:
+                await event.respond(f"❌ Captions are limited to {CAPTION_LIMIT} characters.")
+                return
+            # Downloaded and stored only once the ad is actually created
+            await redis.set(f"temp_ad_media:{uid}", event.id, ex=DRAFT_TTL)
+        await redis.set(f"temp_ad_content:{uid}", event.raw_text, ex=DRAFT_TTL)
         await event.respond("🕒 Now send schedule for this ad (e.g. `2-10 GMT+3`):")
-        set_state(uid, "awaiting_ad_schedule")
+        await set_state(uid, "awaiting_ad_schedule")
     elif state == "awaiting_ad_schedule":
-        content = redis.get(f"temp_ad_content:{uid}")
+        content = await redis.get(f"temp_ad_content:{uid}")
         schedule = event.raw_text.strip()
         channels = await get_channels()
         if not channels:
             await event.respond("⚠️ No channels available. Add channels first.")
-            clear_state(uid)
+            await clear_state(uid)
             return
 
         # Store temp ad
-        redis.set(
+        await redis.set(
             f"temp_ad:{uid}",
             json.dumps({"content": content, "schedule": schedule, "channels": []}),
+            ex=DRAFT_TTL,
         )
-        set_state(uid, "awaiting_ad_channels")
-
-        # Buttons use index instead of full ID to avoid 64-byte limit
-        buttons = [
-            [Button.inline(ch, data=f"ch:{i}".encode())]
-            for i, ch in enumerate(channels)
-        ]
-        buttons.append([Button.inline("✅ Done", data=b"done_selecting_channels")])
-        await event.respond(
-            "📡 Select channels for this ad (click multiple, then ✅ Done):",
-            buttons=buttons,
-        )
+        await set_state(uid, "awaiting_ad_channels")
+        await show_channel_picker(event, "awaiting_ad_channels", respond=True)
     elif state.startswith("editing_text:"):
         ad_id = state.split(":")[1]
-        adverts = await get_adverts()
-        for ad in adverts:
-            if ad["id"] == ad_id:
-                ad["content"] = event.raw_text
-        await set_adverts(adverts)
-        clear_state(uid)
+        ad = await find_ad(ad_id)
+        if ad and ad["media"] and len(event.raw_text) > CAPTION_LIMIT:
+            await event.respond(f"❌ Ads with media are limited to {CAPTION_LIMIT} characters.")
+            return
+        await update_advert(ad_id, content=event.raw_text)
+        scheduler.invalidate_ad(ad_id)
+        await clear_state(uid)
 
         await edit_ad_callback(
             type(
@@ -272,6 +727,49 @@ async def handle_messages(event):
                 },
             )()
         )
+    elif state.startswith("editing_media:"):
+        ad_id = state.split(":")[1]
+        if event.raw_text.strip() == "/nomedia":
+            media_id = None
+        else:
+            ad = await find_ad(ad_id)
+            if ad and len(ad["content"]) > CAPTION_LIMIT:
+                await event.respond(f"❌ Shorten the text to {CAPTION_LIMIT} characters first.")
+                return
+            try:
+                media_id = await save_media(event.message, MEDIA_MAX_BYTES)
+            except ValueError as e:
+                await event.respond(f"❌ {e}")
+                return
+            if not media_id:
+                await event.respond("❌ Send a photo or a video, or /nomedia to remove it.")
+                return
+
+        await set_advert_media(ad_id, media_id)
+        await clear_state(uid)
+        await event.respond("🖼 Media updated." if media_id else "🖼 Media removed.")
+        await show_ad_menu(event, ad_id)
+    elif state.startswith("awaiting_ad_search:"):
+        menu = state.split(":", 1)[1]
+        await set_search(uid, event.raw_text.strip())
+        await clear_state(uid)
+        await show_advert_page(event, menu, respond=True)
+    elif state.startswith("editing_rule:"):
+        ch_id = state.split(":", 1)[1]
+        try:
+            spec = json.loads(event.raw_text)
+            rule = await rule_book.set_rule(ch_id, spec)
+        except Exception as e:
+            await event.respond(f"❌ Invalid rule: {e}")
+            return
+
+        await clear_state(uid)
+        scheduler.invalidate_all()
+        await event.respond(
+            f"✅ Rule for {ch_id} saved: {rule.kind} "
+            f"({', '.join(p.name for p in rule.policies)})"
+        )
+        await show_main_menu(event)
     elif state.startswith("editing_schedule:"):
         ad_id = state.split(":")[1]
         new_schedule = event.raw_text.strip()
@@ -280,12 +778,9 @@ async def handle_messages(event):
             await event.respond("❌ Invalid format. Use `2-10 GMT+3`")
             return
 
-        adverts = await get_adverts()
-        for ad in adverts:
-            if ad["id"] == ad_id:
-                ad["schedule"] = new_schedule
-        await set_adverts(adverts)
-        clear_state(uid)
+        await update_advert(ad_id, schedule=new_schedule)
+        scheduler.invalidate_ad(ad_id)
+        await clear_state(uid)
 
         await edit_ad_callback(
             type(
@@ -304,32 +799,34 @@ async def handle_messages(event):
 # -------------------
 # Channel selection callbacks
 # -------------------
-@bot_client.on(events.CallbackQuery(pattern=b"instant_post_ad:(.*)"))
-async def instant_post_ad_callback(event):
-    ad_id = event.data.decode().split(":")[1]
+async def show_instant_channels(event, ad_id, cursor=None, backward=False):
     ad = await find_ad(ad_id)
     if not ad:
         await event.answer("❌ Ad not found.", alert=True)
         return
 
-    channels = await get_channels()
-    if not channels:
+    page = await get_channels_page(cursor, backward)
+    if not page.items:
         await event.answer("⚠️ No channels configured.", alert=True)
         return
 
-    buttons = []
-    for ch in channels:
-        try:
-            entity = await user_client.get_entity(int(ch))
-            title = getattr(entity, "title", str(ch))
-        except Exception:
-            title = f"❌ {ch}"
-
-        # Create a short mapping key
-        key = str(uuid4())[:8]
-        instant_post_map[key] = (ad_id, ch)
-
-        buttons.append([Button.inline(title, data=f"instant_post_channel:{key}".encode())])
+    # (ad, channel) plus the prefix is past the 64-byte callback limit, hence tokens
+    titles = await get_channel_titles(user_client, page.items)
+    targets = await callback_tokens.data_many(
+        "instant_post_channel", [{"ad": ad_id, "ch": ch} for ch in page.items]
+    )
+    buttons = [
+        [Button.inline(titles[ch], data=data)] for ch, data in zip(page.items, targets)
+    ]
+    nav = []
+    if page.has_prev:
+        payload = {"ad": ad_id, "cursor": page.items[0], "back": True}
+        nav.append(Button.inline("◀️ Prev", data=await callback_tokens.data("ipc_page", payload)))
+    if page.has_next:
+        payload = {"ad": ad_id, "cursor": page.items[-1], "back": False}
+        nav.append(Button.inline("Next ▶️", data=await callback_tokens.data("ipc_page", payload)))
+    if nav:
+        buttons.append(nav)
 
     buttons.append([Button.inline("⬅️ Back", data=b"instant_post_select_ad")])
     await event.edit(
@@ -337,96 +834,72 @@ async def instant_post_ad_callback(event):
         buttons=buttons,
     )
 
-@bot_client.on(events.CallbackQuery(pattern=b"instant_post_channel:(.*)"))
+@on(events.CallbackQuery(pattern=b"instant_post_ad:(.*)"))
+async def instant_post_ad_callback(event):
+    ad_id = event.data.decode().split(":")[1]
+    await show_instant_channels(event, ad_id)
+
+@on(events.CallbackQuery(pattern=b"ipc_page:(.*)"))
+async def instant_channels_page_callback(event):
+    payload = await callback_tokens.resolve(event.pattern_match.group(1).decode())
+    if not payload:
+        await event.answer("⚠️ Session expired or invalid key.", alert=True)
+        return
+    await show_instant_channels(event, payload["ad"], payload["cursor"], payload["back"])
+
+@on(events.CallbackQuery(pattern=b"instant_post_channel:(.*)"))
 async def instant_post_channel_callback(event):
-    key = event.data.decode().split(":")[1]
-    if key not in instant_post_map:
+    payload = await callback_tokens.resolve(event.pattern_match.group(1).decode())
+    if not payload:
         await event.answer("⚠️ Session expired or invalid key.", alert=True)
         return
 
-    ad_id, ch_id = instant_post_map.pop(key)  # remove after use
+    ad_id, ch_id = payload["ad"], payload["ch"]
     ad = await find_ad(ad_id)
     if not ad:
         await event.answer("❌ Ad not found.", alert=True)
         return
 
     await event.respond(f"🚀 Posting ad '{ad_id}' to channel {ch_id}...")
-    try:
-        await send_message_to_channel(ch_id, ad)
+    stats = await engine.run(
+        [PostJob(ch_id, ad)],
+        send_message_to_channel,
+        label=f"instant {ad_id}",
+        commit=record_instant_posts,
+    )
+    if stats.sent:
         await event.respond(f"✅ Successfully posted ad '{ad_id}' to {ch_id}!")
-    except Exception as e:
-        await event.respond(f"❌ Failed to post: {e}")
+    elif stats.deferred:
+        await event.respond(f"⏳ Flood wait on {ch_id}, the post is queued for retry.")
+    else:
+        await event.respond(f"❌ Failed to post ad '{ad_id}' to {ch_id}.")
 
-@bot_client.on(events.CallbackQuery(pattern=b"ch:(\d+)"))
+@on(events.CallbackQuery(pattern=rb"chsel:(.*)"))
 async def select_channel_callback(event):
-    uid = event.sender_id
-    idx = int(event.data.decode().split(":")[1])
-    state = get_state(uid)
-
-    channels = await get_channels()
-    if idx >= len(channels):
-        await event.answer("Invalid channel index", alert=True)
+    # Toggles a channel in the ad being created or edited
+    ch = event.data.decode().split(":", 1)[1]
+    state = await get_state(event.sender_id)
+    if state not in CHANNEL_PICKERS:
+        await event.answer("❌ Not in channel selection mode.", alert=True)
         return
 
-    ch = channels[idx]
-
-    # CASE 1: user is creating a new ad
-    if state == "awaiting_ad_channels":
-        temp = json.loads(redis.get(f"temp_ad:{uid}"))
-        if ch in temp["channels"]:
-            temp["channels"].remove(ch)
-        else:
-            temp["channels"].append(ch)
-        redis.set(f"temp_ad:{uid}", json.dumps(temp))
-
-        # Refresh buttons (multi-select visual update)
-        buttons = []
-        for i, ch_id in enumerate(channels):
-            try:
-                entity = await user_client.get_entity(int(ch_id))
-                title = getattr(entity, "title", ch_id)
-            except Exception:
-                title = f"❌ {ch_id}"
-            selected = "✅" if ch_id in temp["channels"] else "⬜"
-            buttons.append(
-                [Button.inline(f"{selected} {title}", data=f"ch:{i}".encode())]
-            )
-        buttons.append([Button.inline("✅ Done", data=b"done_selecting_channels")])
-
-        await event.edit(
-            "📡 Select channels for this ad (click multiple, then ✅ Done):",
-            buttons=buttons,
-        )
-
-    # CASE 2: user is editing an ad
-    elif state == "editing_channels":
-        temp = json.loads(redis.get(f"temp_edit_ad:{uid}"))
-        if ch in temp["channels"]:
-            temp["channels"].remove(ch)
-        else:
-            temp["channels"].append(ch)
-        redis.set(f"temp_edit_ad:{uid}", json.dumps(temp))
-
-        # Refresh buttons (multi-select visual update)
-        buttons = []
-        for i, ch_id in enumerate(channels):
-            try:
-                entity = await user_client.get_entity(int(ch_id))
-                title = getattr(entity, "title", ch_id)
-            except Exception:
-                title = f"❌ {ch_id}"
-            selected = "✅" if ch_id in temp["channels"] else "⬜"
-            buttons.append(
-                [Button.inline(f"{selected} {title}", data=f"ch:{i}".encode())]
-            )
-        buttons.append([Button.inline("✅ Done", data=b"done_editing_channels")])
-
-        await event.edit(
-            "📡 Select channels for this ad (click multiple, then ✅ Done):",
-            buttons=buttons,
-        )
+    key = CHANNEL_PICKERS[state][0].format(event.sender_id)
+    draft = json.loads(await redis.get(key))
+    if ch in draft["channels"]:
+        draft["channels"].remove(ch)
     else:
+        draft["channels"].append(ch)
+    await redis.set(key, json.dumps(draft), ex=DRAFT_TTL)
+    await show_channel_picker(event, state, *draft.get("page", [None, False]))
+
+@on(events.CallbackQuery(pattern=rb"chsel_page:([<>]):(.*)"))
+async def channel_picker_page_callback(event):
+    state = await get_state(event.sender_id)
+    if state not in CHANNEL_PICKERS:
         await event.answer("❌ Not in channel selection mode.", alert=True)
+        return
+    direction, cursor = (g.decode() for g in event.pattern_match.groups())
+    await show_channel_picker(event, state, cursor, backward=direction == "<")
 
 def format_schedule(schedule: str) -> str:
     try:
@@ -451,7 +924,8 @@ async def show_ad_menu(event, ad_id):
         f"📝 Ad: {ad['content']}\n"
         f"⏰ Schedule: {format_schedule(ad['schedule'])}\n"
         f"Status: {'✅ Active' if ad['active'] else '⛔ Inactive'}\n"
-        f"Channels: {len(ad.get('channels', []))}"
+        f"Channels: {len(ad.get('channels', []))}\n"
+        f"Media: {'🖼 attached' if ad['media'] else 'none'}"
     )
 
     buttons = [
@@ -459,6 +933,8 @@ async def show_ad_menu(event, ad_id):
         [Button.inline("✏️ Edit Content", data=f"edit_content:{ad_id}".encode())],
         [Button.inline("🕒 Edit Schedule", data=f"edit_schedule:{ad_id}".encode())],
         [Button.inline("📡 Edit Channels", data=f"edit_channels:{ad_id}".encode())],
+        [Button.inline("🖼 Edit Media", data=f"edit_media:{ad_id}".encode())],
+        [Button.inline("📊 Stats", data=f"ad_stats:{ad_id}".encode())],
         [Button.inline("🗑 Delete", data=f"delete_ad:{ad_id}".encode())],
         [Button.inline("⬅️ Back", data=b"adverts")],
     ]
@@ -470,12 +946,12 @@ async def show_ad_menu(event, ad_id):
         # Fallback to sending a new message (works for NewMessage)
         await event.respond(text, buttons=buttons)
 
-@bot_client.on(events.CallbackQuery(pattern=b"edit_ad:(.*)"))
+@on(events.CallbackQuery(pattern=b"edit_ad:(.*)"))
 async def edit_ad_callback(event):
     ad_id = event.data.decode().split(":")[1]
     await show_ad_menu(event, ad_id)
 
-@bot_client.on(events.CallbackQuery(pattern=b"edit_schedule:(.*)"))
+@on(events.CallbackQuery(pattern=b"edit_schedule:(.*)"))
 async def edit_schedule_callback(event):
     ad_id = event.data.decode().split(":")[1]
     ad = await find_ad(ad_id)
@@ -487,10 +963,10 @@ async def edit_schedule_callback(event):
         "🕒 Send the new schedule for the ad (e.g. `2-10 GMT+3`):",
         buttons=[[Button.inline("⬅️ Cancel", data=f"edit_ad:{ad_id}".encode())]],
     )
-    set_state(event.sender_id, f"editing_schedule:{ad_id}")
+    await set_state(event.sender_id, f"editing_schedule:{ad_id}")
 
 
-@bot_client.on(events.CallbackQuery(pattern=b"edit_content:(.*)"))
+@on(events.CallbackQuery(pattern=b"edit_content:(.*)"))
 async def edit_content_callback(event):
     ad_id = event.data.decode().split(":")[1]
     ad = await find_ad(ad_id)
@@ -502,10 +978,26 @@ async def edit_content_callback(event):
         "✍️ Send the new advertisement text:",
         buttons=[[Button.inline("⬅️ Cancel", data=f"edit_ad:{ad_id}".encode())]],
     )
-    set_state(event.sender_id, f"editing_text:{ad_id}")
+    await set_state(event.sender_id, f"editing_text:{ad_id}")
+
+
+@on(events.CallbackQuery(pattern=b"edit_media:(.*)"))
+async def edit_media_callback(event):
+    ad_id = event.data.decode().split(":")[1]
+    ad = await find_ad(ad_id)
+    if not ad:
+        await event.respond("❌ Ad not found.")
+        return
 
+    await event.edit(
+        "🖼 Send a photo or video for the ad (the ad text stays the caption), "
+        "or /nomedia to remove the current one:",
+        buttons=[[Button.inline("⬅️ Cancel", data=f"edit_ad:{ad_id}".encode())]],
+    )
+    await set_state(event.sender_id, f"editing_media:{ad_id}")
 
-@bot_client.on(events.CallbackQuery(pattern=b"edit_channels:(.*)"))
+
+@on(events.CallbackQuery(pattern=b"edit_channels:(.*)"))
 async def edit_channels_callback(event):
     ad_id = event.data.decode().split(":")[1]
     ad = await find_ad(ad_id)
@@ -518,62 +1010,27 @@ async def edit_channels_callback(event):
         await event.respond("⚠️ No channels available. Add channels first.")
         return
 
-    redis.set(
+    await redis.set(
         f"temp_edit_ad:{event.sender_id}",
         json.dumps({"ad_id": ad_id, "channels": ad.get("channels", [])}),
+        ex=DRAFT_TTL,
     )
-    set_state(event.sender_id, "editing_channels")
-
-    buttons = []
-    for i, ch_id in enumerate(channels):
-        try:
-            entity = await user_client.get_entity(int(ch_id))
-            title = getattr(entity, "title", ch_id)
-        except Exception:
-            title = f"❌ {ch_id}"
-        selected = "✅" if ch_id in ad.get("channels", []) else "⬜"
-        buttons.append(
-            [Button.inline(f"{selected} {title}", data=f"edit_ch:{i}".encode())]
-        )
-
-    buttons.append([Button.inline("✅ Done", data=b"done_editing_channels")])
-    await event.edit(
-        "📡 Select channels for this ad (click multiple, then ✅ Done):",
-        buttons=buttons,
-    )
-
-
-@bot_client.on(events.CallbackQuery(pattern=b"edit_ch:(\d+)"))
-async def toggle_edit_channel_callback(event):
-    idx = int(event.data.decode().split(":")[1])
-    uid = event.sender_id
-    temp = json.loads(redis.get(f"temp_edit_ad:{uid}"))
-    ch = await get_channels()[idx]
-
-    if ch in temp["channels"]:
-        temp["channels"].remove(ch)
-    else:
-        temp["channels"].append(ch)
+    await set_state(event.sender_id, "editing_channels")
+    await show_channel_picker(event, "editing_channels")
 
-    redis.set(f"temp_edit_ad:{uid}", json.dumps(temp))
-    await event.answer(f"Selected channels: {len(temp['channels'])}")
 
-
-@bot_client.on(events.CallbackQuery(data=b"done_editing_channels"))
+@on(events.CallbackQuery(data=b"done_editing_channels"))
 async def done_editing_channels(event):
     uid = event.sender_id
-    temp = json.loads(redis.get(f"temp_edit_ad:{uid}"))
+    temp = json.loads(await redis.get(f"temp_edit_ad:{uid}"))
     ad_id = temp["ad_id"]
     selected_channels = temp["channels"]
 
-    adverts = await get_adverts()
-    for ad in adverts:
-        if ad["id"] == ad_id:
-            ad["channels"] = selected_channels
-    await set_adverts(adverts)
+    await set_advert_channels(ad_id, selected_channels)
+    scheduler.invalidate_ad(ad_id)
 
-    redis.delete(f"temp_edit_ad:{uid}")
-    clear_state(uid)
+    await redis.delete(f"temp_edit_ad:{uid}")
+    await clear_state(uid)
     await event.respond("✅ Channels updated for the ad!")
 
     # Show ad menu again
@@ -590,7 +1047,7 @@ async def done_editing_channels(event):
         )()
     )
 
-@bot_client.on(events.CallbackQuery(pattern=b"instant_post_ad_all:(.*)"))
+@on(events.CallbackQuery(pattern=b"instant_post_ad_all:(.*)"))
 async def instant_post_ad_all_callback(event):
     ad_id = event.data.decode().split(":")[1]
     ad = await find_ad(ad_id)
@@ -605,75 +1062,74 @@ async def instant_post_ad_all_callback(event):
 
     await event.respond(f"🚀 Posting ad '{ad_id}' to {len(channels)} channel(s)...")
 
-    success = 0
-    for ch in channels:
-        try:
-            await send_message_to_channel(ch, ad)
-            success += 1
-        except Exception as e:
-            await event.respond(f"❌ Failed for {ch}: {e}")
+    async def on_result(job, ok):
+        if not ok:
+            await event.respond(f"❌ Failed for {job.ch_id}")
 
-    await event.respond(f"✅ Done! Posted to {success}/{len(channels)} channels.")
+    stats = await engine.run(
+        [PostJob(ch, ad) for ch in channels],
+        send_message_to_channel,
+        label=f"instant {ad_id}",
+        on_result=on_result,
+        commit=record_instant_posts,
+    )
+    await event.respond(
+        f"✅ Done! Posted to {stats.sent}/{len(channels)} channels "
+        f"in {stats.elapsed:.1f}s ({stats.throughput:.2f} posts/s)."
+    )
 
-@bot_client.on(events.CallbackQuery(pattern=b"toggle_ad:(.*)"))
+@on(events.CallbackQuery(pattern=b"toggle_ad:(.*)"))
 async def toggle_ad_callback(event):
     ad_id = event.data.decode().split(":")[1]
-    adverts = await get_adverts()
-    updated = False
-    for ad in adverts:
-        if ad["id"] == ad_id:
-            ad["active"] = not ad["active"]
-            updated = True
-    await set_adverts(adverts)
-
-    if updated:
+    if await toggle_advert(ad_id):
+        scheduler.invalidate_ad(ad_id)
         try:
             await edit_ad_callback(event)
         except telethon.errors.rpcerrorlist.MessageNotModifiedError:
             await event.answer("✅ Toggled successfully", alert=True)
 
 
-@bot_client.on(events.CallbackQuery(pattern=b"delete_ad:(.*)"))
+@on(events.CallbackQuery(pattern=b"delete_ad:(.*)"))
 async def delete_ad_callback(event):
     ad_id = event.data.decode().split(":")[1]
-    adverts = await get_adverts()
-    adverts_normalized = [ad for ad in adverts if ad["id"] != ad_id]
-    await set_adverts(adverts_normalized)
+    await delete_advert(ad_id)
+    scheduler.invalidate_ad(ad_id)
     await event.edit("🗑 Ad deleted.")
     await show_adverts_menu(event)
 
 
-@bot_client.on(events.CallbackQuery(data=b"done_selecting_channels"))
+@on(events.CallbackQuery(data=b"done_selecting_channels"))
 async def done_selecting_channels(event):
     uid = event.sender_id
-    temp_ad = json.loads(redis.get(f"temp_ad:{uid}"))
+    temp_ad = json.loads(await redis.get(f"temp_ad:{uid}"))
+    media_msg = await redis.get(f"temp_ad_media:{uid}")
+    media_id = None
+    if media_msg:
+        try:
+            message = await bot_client.get_messages(uid, ids=int(media_msg))
+            media_id = await save_media(message, MEDIA_MAX_BYTES) if message else None
+        except Exception as e:
+            await event.respond(f"❌ Could not store the media: {e}")
+            return
     ad = {
         "id": str(uuid.uuid4()),
         "content": temp_ad["content"],
         "schedule": temp_ad["schedule"],
         "channels": temp_ad["channels"],
         "active": False,
+        "media": media_id,
     }
-    adverts = await get_adverts()
-    adverts.append(ad)
-    await set_adverts(adverts)
-    clear_state(uid)
-    redis.delete(f"temp_ad:{uid}")
+    await create_advert(ad)
+    scheduler.invalidate_ad(ad["id"])
+    await clear_state(uid)
+    await redis.delete(f"temp_ad:{uid}", f"temp_ad_content:{uid}", f"temp_ad_media:{uid}")
     await event.respond(
         f"✅ Ad created!\nContent: {ad['content']}\nSchedule: {ad['schedule']}\nChannels: {ad['channels']}"
+        + ("\nMedia: attached" if media_id else "")
     )
     await show_adverts_menu(event)
 
 
-def parse_schedule(schedule_str):
-    try:
-        hours, tz = schedule_str.split()
-        start, end = map(int, hours.split("-"))
-        offset = int(tz.replace("GMT", ""))
-        return start, end, offset
-    except Exception:
-        return None
-
 async def debug_chat_permissions(ch_id: int):
     try:
         entity = await user_client.get_entity(ch_id)
@@ -696,168 +1152,177 @@ async def debug_chat_permissions(ch_id: int):
     except Exception as e:
         print(f"❌ Failed to inspect chat: {e}")
 
-async def send_message_to_channel(ch_id, ad):
+async def send_message_to_channel(ch_id, ad, account=USER_ACCOUNT, retry=True):
+    ch_id = str(ch_id)
+    client = account_pool.client(account)
+    sending = False
     try:
+        # Cached peer and membership: a warm post costs the send_message call only
         try:
-            permissions = await user_client.get_permissions(int(ch_id), 'me')
-            print("=== Permissions ===")
-            print(permissions)
-        except:
-            await user_client(JoinChannelRequest(ch_id))
-            print(f"Not in channel {ch_id}. Joining.")
-
-        # await debug_chat_permissions(int(ch_id))
-        entity = await user_client.get_entity(int(ch_id))
-        await user_client.send_message(entity, ad["content"])
-        print(f"[{datetime.datetime.now()}] ✅ Posted ad '{ad['id']}' to {ch_id}")
-        await asyncio.sleep(1)
+            peer = await input_peer(client, ch_id, primary=account == USER_ACCOUNT)
+        except ValueError:
+            # This account has no way to find the channel, let another one post
+            raise AccountUnavailable(ch_id)
+        await ensure_member(client, account, ch_id, peer)
+
+        sending = True
+        if ad.get("media"):
+            message = await media_sender.send(client, account, peer, ad["media"], ad["content"])
+        else:
+            with rpc("send_message"):
+                message = await client.send_message(peer, ad["content"])
+        rpc_counter.post()
+        print(f"[{datetime.datetime.now()}] ✅ Posted ad '{ad['id']}' to {ch_id} as {account}")
+        # The message itself, so the post history gets its id
+        return message
+    except SlowModeWaitError as e:
+        until = await flood_table.record(account, ch_id, e.seconds)
+        raise FloodDeferred(until)
     except FloodWaitError as e:
-        print(f"⚠️ Flood wait {e.seconds}s — sleeping...")
-        await asyncio.sleep(e.seconds + 5)
-    except ChannelPrivateError:
-        print(f"❌ Channel {ch_id} is private or you are not a memberedis.")
-    except ChatAdminRequiredError:
-        try:
-            await bot_client.send_message(int(ch_id), "content")
-        except Exception as e:
-            print(f"❌ Failed via bot to {ch_id}: {e}")
+        # A flood on send_message is tied to this peer, anything earlier blocks the account
+        peer = ch_id if sending else None
+        until = await flood_table.record(account, peer, e.seconds)
+        raise FloodDeferred(until)
+    except PERMISSION_ERRORS as e:
+        await forget_member(account, ch_id)
+        if retry:
+            # Membership or rights changed since we cached them, check once more
+            return await send_message_to_channel(ch_id, ad, account, retry=False)
+
+        if isinstance(e, ChatAdminRequiredError):
+            # A sender process has no bot, and retrying there won't grow one
+            if not bot_client.is_connected():
+                print(f"❌ No admin rights in {ch_id} and no bot in this process to post instead")
+                raise SendFailed("admin rights missing, bot not connected", permanent=True)
+            try:
+                if ad.get("media"):
+                    message = await media_sender.send(
+                        bot_client, BOT_ACCOUNT, int(ch_id), ad["media"], ad["content"]
+                    )
+                else:
+                    with observe("telegram", "bot_send_message"):
+                        message = await bot_client.send_message(int(ch_id), ad["content"])
+            except Exception as e:
+                print(f"❌ Failed via bot to {ch_id}: {e}")
+                raise SendFailed(type(e).__name__)
+            # Recorded under the bot, not the account that lacked the rights
+            return Posted(message, BOT_ACCOUNT)
+        else:
+            # Kicked or banned: the pool moves the channel to another account
+            account_pool.accounts[account].last_error = f"{ch_id}: {type(e).__name__}"
+            await account_pool.mark_kicked(account, ch_id)
+            raise AccountUnavailable(ch_id)
+    except AccountUnavailable:
+        raise
     except Exception as e:
         print(f"Failed to send ad {ad['id']} to {ch_id}: {e}")
-
-async def try_post_ad(ad):
-    if not ad["active"]:
-        return
-
-    tz = pytz.timezone("Europe/Vilnius")
-    now = datetime.datetime.now(tz)
-
-    channels = ad.get("channels") or await get_channels()
-
-    for ch in channels:
-        ch = str(ch)
-        rules = CHANNEL_RULES.get(ch, {"type": "normal"})
-
-        last = get_channel_last(ad["id"], ch)
-
-        # ---- 1) Barcelona ----
-        if rules["type"] == "barcelona":
-            # time window
-            if not (rules["start"] <= now.hour < rules["end"]):
-                continue
-
-            # max length
-            if len(ad["content"]) > rules["max_length"]:
-                print(f"❌ Ad too long for Barcelona ({ch}).")
-                continue
-
-            # daily limit
-            if last and last.date() == now.date():
-                # count posts today
-                key = f"ad_count:{ad['id']}:{ch}:{now.date()}"
-                count = int(redis.get(key) or 0)
-                if count >= rules["max_posts_per_day"]:
-                    print(f"⛔ Barcelona max daily reached for {ad['id']}")
-                    continue
-
-                # still in allowed hour slot? avoid duplicates
-                if last.hour == now.hour:
-                    continue
-
-            # perform send
-            await send_message_to_channel(ch, ad)
-            # increment daily counter
-            key = f"ad_count:{ad['id']}:{ch}:{now.date()}"
-            redis.set(key, int(redis.get(key) or 0) + 1)
-            set_channel_last(ad["id"], ch, now)
-            continue
-
-        # ---- 2) LTgrupe ----
-        if rules["type"] == "ltgrupe":
-            week = now.isocalendar()[1]
-            key = f"week_post:{ad['id']}:{ch}:{week}"
-            if redis.get(key):
-                continue  # already posted this week
-
-            # daytime restriction
-            if not (rules["daytime_start"] <= now.hour < rules["daytime_end"]):
-                continue
-
-            await send_message_to_channel(ch, ad)
-            redis.set(key, "1")
-            set_channel_last(ad["id"], ch, now)
-            continue
-
-        # ---- 3) Hourly (Baltarusijos / Pribaltic) ----
-        if rules["type"] == "hourly":
-            # defaults to 1 hour
-            by_hours = rules.get("by_hours", 1)
-
-            # Calculate the "hour block"
-            hour_block = now.hour // by_hours
-
-            key = f"teleads:hour_block:{ch}:{ad['id']}:{by_hours}"
-            last_hour_block = redis.get(key)
-
-            # ❌ If we've already posted in this hour block → skip
-            if last_hour_block and int(last_hour_block) == hour_block:
-                print(f"📌 Hour block already satisfied for {ad['id']}_{ch}. Skipping post.")
-                return False
-            
-            # Store new block
-            next_expire = 3600 * by_hours
-            redis.set(key, hour_block, ex=next_expire)
-
-            # Also enforce last-post gap (optional but you added it)
-            if last:
-                elapsed_hours = (now - last).total_seconds() / 3600
-                if elapsed_hours < by_hours:
-                    continue
-
-            # All checks passed → post
-            await send_message_to_channel(ch, ad)
-            set_channel_last(ad["id"], ch, now)
-            continue
-
-        # ---- 4) Default scheduler (old behaviour) ----
-        parsed = parse_schedule(ad["schedule"])
-        if not parsed:
-            continue
-
-        start, end, offset = parsed
-
-        if start <= now.hour < end:
-            if last and last.date() == now.date() and last.hour == now.hour:
-                continue
-
-            await send_message_to_channel(ch, ad)
-            set_channel_last(ad["id"], ch, now)
+        raise SendFailed(type(e).__name__)
+
+async def record_instant_posts(jobs):
+    # Instant posts skip the rules but still count towards them, so the
+    # scheduler doesn't post the same ad there again right away
+    await rule_book.refresh()
+    now = scheduler_now()
+    for job in jobs:
+        job.slot = (job.ad["id"], job.ch_id, rule_book.get(job.ch_id), now)
+    await record_sent_many(jobs)
+    for ad_id in {job.ad["id"] for job in jobs}:
+        scheduler.invalidate_ad(ad_id)
 
 async def run_scheduler_once():
-    adverts = await get_adverts()
-    for ad in adverts:
-        await try_post_ad(ad)
+    # Joins a run already in progress; returns once its posts are queued
+    return await scheduler_runs.start(follow=False).wait_planned()
 
 async def scheduler_loop():
-    while True:
-        await run_scheduler_once()
-        await asyncio.sleep(3600)
+    async def lead():
+        # The previous leader may have queued anything, start from a fresh heap
+        scheduler.invalidate_all()
+        await scheduler.run(lambda jobs: enqueue(jobs, lease=scheduler_lease))
+
+    await scheduler_lease.elect(lead)
 
 # -------------------
 # Bootstrap
 # -------------------
-async def main():
+outbox_worker = OutboxWorker(
+    engine, send_message_to_channel, record_sent_many, account=USER_ACCOUNT
+)
+
+async def start_accounts(startup):
+    # Every session connects at once; each shows up as its own startup phase
+    await asyncio.gather(
+        *(startup.timed(f"account {account.name}", account.client.start()) for account in account_pool)
+    )
+    print(f"✅ {len(account_pool)} user session(s) started.")
+
+async def stop_accounts():
+    for account in account_pool:
+        await account.client.disconnect()
+
+def accounts_until_disconnected():
+    return [account.client.run_until_disconnected() for account in account_pool]
+
+async def connect_db():
     await db.connect()
-    async with bot_client:
-        await bot_client.start(bot_token=BOT_TOKEN)
-        async with user_client:
-            await user_client.start()
-            print("✅ Bot and user sessions started.")
-            await asyncio.gather(
-                bot_client.run_until_disconnected(),
-                user_client.run_until_disconnected(),
-                scheduler_loop(),
-            )
+    await migrate_cache_blob()
+
+async def connect(startup, with_bot):
+    # DB, Redis and the Telegram sessions don't depend on each other
+    async with startup.phase("connect"):
+        await asyncio.gather(
+            startup.timed("db", connect_db()),
+            startup.timed("redis", redis.ping()),
+            start_accounts(startup),
+            *([startup.timed("bot", bot_client.start(bot_token=BOT_TOKEN))] if with_bot else []),
+        )
+    startup.mark("ready")
+    print(f"⏱ Serving after {startup.phases['ready']:.2f}s: {startup.summary()}")
+
+async def run_sender(startup):
+    # Sender-only process: no bot and no scheduler, just drains the outbox
+    await connect(startup, with_bot=False)
+    try:
+        await asyncio.gather(
+            *accounts_until_disconnected(),
+            warm_caches(startup, user_client),
+            outbox_worker.run(),
+            retry_queue.run(engine),
+            post_ledger.run(),
+        )
+    finally:
+        await post_ledger.flush()
+        await stop_accounts()
+
+async def run_all(startup):
+    await connect(startup, with_bot=True)
+    print("✅ Bot and user sessions started.")
+    try:
+        await asyncio.gather(
+            bot_client.run_until_disconnected(),
+            *accounts_until_disconnected(),
+            # Handlers and the scheduler don't wait for it; whatever is cold
+            # by then just loads on first use, as before
+            warm_caches(startup, user_client),
+            scheduler_loop(),
+            outbox_worker.run(),
+            retry_queue.run(engine),
+            post_ledger.run(),
+        )
+    finally:
+        await post_ledger.flush()
+        await stop_accounts()
+        await bot_client.disconnect()
+
+async def main():
+    startup = Startup(TELEADS_ROLE)
+    start_metrics_server()
+    if TELEADS_ROLE == "sender":
+        await run_sender(startup)
+    else:
+        await run_all(startup)
     await db.disconnect()
+    await redis.aclose()
+    await redis_pool.disconnect()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,16 @@
+import asyncio
+from teleads.helpers import migrate_cache_blob
+from teleads.prisma import db
+
+
+async def main():
+    await db.connect()
+    try:
+        if not await migrate_cache_blob():
+            print("Nothing to migrate, row storage is already populated.")
+    finally:
+        await db.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
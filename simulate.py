@@ -0,0 +1,95 @@
+import argparse
+import asyncio
+import csv
+import datetime
+from teleads.config import USER_SESSIONS
+from teleads.helpers import get_advert, get_adverts, get_channels
+from teleads.prisma import db
+from teleads.rules import TZ
+from teleads.simulate import simulate, simulation_now
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Dry-run the posting rules over a simulated clock. Nothing is sent or written."
+    )
+    parser.add_argument("--ad", help="advert id; default: every active advert")
+    parser.add_argument("--schedule", help="simulate a new advert with this schedule, e.g. '8-20 GMT+3'")
+    parser.add_argument("--length", type=int, default=100, help="content length of the new advert")
+    parser.add_argument("--channels", help="comma-separated channel ids instead of the advert's own")
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--start", help="ISO start time in Europe/Vilnius; default: now")
+    parser.add_argument("--fresh", action="store_true", help="ignore what was already posted")
+    parser.add_argument("--top", type=int, default=20, help="channels shown in the calendar")
+    parser.add_argument("--csv", help="write channel,hour,posts rows here")
+    return parser.parse_args()
+
+
+async def targets(args):
+    override = args.channels.split(",") if args.channels else None
+    all_channels = await get_channels()
+    if args.schedule:
+        ad = {
+            "id": "simulated",
+            "content": "x" * args.length,
+            "schedule": args.schedule,
+            "active": True,
+            "channels": [],
+        }
+        return [(ad, override or all_channels)]
+    if args.ad:
+        ad = await get_advert(args.ad)
+        if not ad:
+            raise SystemExit(f"❌ Advert {args.ad} not found.")
+        return [(ad, override or ad["channels"] or all_channels)]
+    return [
+        (ad, override or ad["channels"] or all_channels)
+        for ad in await get_adverts()
+        if ad["active"]
+    ]
+
+
+def print_calendar(simulation, top):
+    calendar = simulation.calendar()
+    busiest = sorted(calendar.items(), key=lambda item: sum(item[1].values()), reverse=True)
+    print(f"\nPosts per hour of day (top {min(top, len(busiest))} channels):")
+    print(f"{'channel':<16}{'total':>7}  " + " ".join(f"{h:>3}" for h in range(24)))
+    for ch, hours in busiest[:top]:
+        by_hour = [0] * 24
+        for hour, posts in hours.items():
+            by_hour[hour.hour] += posts
+        row = " ".join(f"{n:>3}" if n else "  ." for n in by_hour)
+        print(f"{ch:<16}{sum(by_hour):>7}  {row}")
+
+
+def write_csv(simulation, path):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["channel", "hour", "posts"])
+        for ch, hours in sorted(simulation.calendar().items()):
+            for hour, posts in sorted(hours.items()):
+                writer.writerow([ch, hour.isoformat(), posts])
+    print(f"\nCalendar written to {path}")
+
+
+async def main():
+    args = parse_args()
+    start = (
+        TZ.localize(datetime.datetime.fromisoformat(args.start))
+        if args.start
+        else simulation_now()
+    )
+    await db.connect()
+    try:
+        simulation = await simulate(await targets(args), start, args.days, fresh=args.fresh)
+    finally:
+        await db.disconnect()
+
+    print(simulation.summary(accounts=len(USER_SESSIONS)))
+    print_calendar(simulation, args.top)
+    if args.csv:
+        write_csv(simulation, args.csv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,143 @@
+import bisect
+import hashlib
+import time
+from telethon import TelegramClient
+from .config import ACCOUNT_KICK_TTL, CLIENT_HASH, CLIENT_ID, USER_SESSIONS
+from .floodwait import flood_table
+from .membership import KICKED_KEY, MEMBER_KEY
+from .redis import redis
+
+# Virtual nodes per account, enough to spread channels evenly over a small pool
+RING_REPLICAS = 64
+
+
+def _hash(value):
+    return int(hashlib.md5(value.encode()).hexdigest()[:16], 16)
+
+
+class Account:
+    def __init__(self, name, client):
+        self.name = name
+        self.client = client
+        self.sent = 0
+        self.failed = 0
+        self.failovers = 0
+        self.last_sent_at = None
+        self.last_error = None
+
+    @property
+    def connected(self):
+        return self.client.is_connected()
+
+    def health(self):
+        if not self.connected:
+            return "offline"
+        until = flood_table.blocked_until(self.name, None)
+        if until:
+            return f"flood {until - time.time():.0f}s"
+        return "ok"
+
+
+class AccountPool:
+    # Channels are sharded over the user accounts with a consistent-hash ring, so
+    # adding an account only moves its share of channels. An account that is
+    # flood-banned, kicked or offline is skipped and the next one on the ring posts.
+
+    def __init__(self, sessions=USER_SESSIONS):
+        self.accounts = {
+            name: Account(name, TelegramClient(path, CLIENT_ID, CLIENT_HASH))
+            for name, path in sessions
+        }
+        self.names = list(self.accounts)
+        self.primary = self.accounts[self.names[0]]
+        self.ring = sorted(
+            (_hash(f"{name}#{i}"), name) for name in self.names for i in range(RING_REPLICAS)
+        )
+
+    def __iter__(self):
+        return iter(self.accounts.values())
+
+    def __len__(self):
+        return len(self.accounts)
+
+    def client(self, name):
+        return self.accounts[name].client
+
+    def ring_order(self, ch_id):
+        # Every account once, in the order the ring visits them from the channel's point
+        start = bisect.bisect(self.ring, (_hash(str(ch_id)),))
+        order = []
+        for i in range(len(self.ring)):
+            name = self.ring[(start + i) % len(self.ring)][1]
+            if name not in order:
+                order.append(name)
+                if len(order) == len(self.names):
+                    break
+        return order
+
+    def owner(self, ch_id):
+        return self.ring_order(ch_id)[0]
+
+    def _usable(self, name, ch_id):
+        return self.accounts[name].connected and not flood_table.blocked_until(name, ch_id)
+
+    async def pick(self, ch_id, exclude=()):
+        ch_id = str(ch_id)
+        order = [name for name in self.ring_order(ch_id) if name not in exclude]
+        if len(self.names) == 1:
+            # Nothing to fail over to, skip the membership lookup
+            return order[0] if order and self._usable(order[0], ch_id) else None
+        if not order:
+            return None
+
+        flags = await redis.mget(
+            [MEMBER_KEY.format(name, ch_id) for name in order]
+            + [KICKED_KEY.format(name, ch_id) for name in order]
+        )
+        members, kicked = flags[: len(order)], flags[len(order) :]
+        candidates = [
+            (name, member)
+            for name, member, gone in zip(order, members, kicked)
+            if not gone and self._usable(name, ch_id)
+        ]
+        # An account already in the channel saves a join, otherwise the ring decides
+        for name, member in candidates:
+            if member:
+                return name
+        return candidates[0][0] if candidates else None
+
+    def available_at(self, ch_id):
+        # Earliest moment a flood-banned account could take the channel again
+        bans = [
+            flood_table.blocked_until(name, str(ch_id))
+            for name in self.names
+            if self.accounts[name].connected
+        ]
+        bans = [until for until in bans if until]
+        return min(bans) if bans else None
+
+    async def mark_kicked(self, name, ch_id):
+        await redis.set(KICKED_KEY.format(name, ch_id), "1", ex=ACCOUNT_KICK_TTL)
+        print(f"🚫 Account {name} can't post to {ch_id}, failing over")
+
+    async def forget_kicked(self, ch_id):
+        await redis.delete(*(KICKED_KEY.format(name, ch_id) for name in self.names))
+
+    def record(self, name, ok, error=None):
+        account = self.accounts[name]
+        if ok:
+            account.sent += 1
+            account.last_sent_at = time.time()
+        else:
+            account.failed += 1
+            if error:
+                account.last_error = error
+
+    def shares(self, ch_ids):
+        counts = dict.fromkeys(self.names, 0)
+        for ch_id in ch_ids:
+            counts[self.owner(ch_id)] += 1
+        return counts
+
+
+account_pool = AccountPool()
@@ -16,7 +16,90 @@ REDIS_HOST = os.getenv("REDIS_HOST")
 REDIS_PORT = os.getenv("REDIS_PORT")
 REDIS_USER = os.getenv("REDIS_USER")
 REDIS_PASS = os.getenv("REDIS_PASS")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
 
+# Channel title/entity cache (seconds)
+CHANNEL_META_TTL = int(os.getenv("CHANNEL_META_TTL", str(7 * 24 * 3600)))
+CHANNEL_META_REFRESH = int(os.getenv("CHANNEL_META_REFRESH", str(6 * 3600)))
+CHANNEL_META_ERROR_TTL = int(os.getenv("CHANNEL_META_ERROR_TTL", "300"))
+
+# How long a confirmed channel membership is trusted before re-checking (seconds)
+MEMBERSHIP_TTL = int(os.getenv("MEMBERSHIP_TTL", str(24 * 3600)))
+
+# Half-finished bot flows (state:, temp_ad:, temp_edit_ad: keys) expire after this (seconds)
+DRAFT_TTL = int(os.getenv("DRAFT_TTL", str(24 * 3600)))
+
+# Largest photo/video accepted for an advert (bytes); MySQL's default
+# max_allowed_packet is 64 MB
+MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", str(50 * 1024 * 1024)))
+
+# Callback tokens: buttons whose context doesn't fit Telegram's 64-byte callback data
+# point at a Redis entry instead. Entries expire after CALLBACK_TOKEN_TTL seconds, and
+# beyond CALLBACK_TOKEN_CAP the least recently used ones are dropped.
+CALLBACK_TOKEN_TTL = int(os.getenv("CALLBACK_TOKEN_TTL", str(24 * 3600)))
+CALLBACK_TOKEN_CAP = int(os.getenv("CALLBACK_TOKEN_CAP", "10000"))
+
+# User account pool: "name=session_path" pairs separated by commas, the first one is
+# the primary account used for lookups. A kicked account skips the channel for
+# ACCOUNT_KICK_TTL seconds.
+USER_SESSIONS = [
+    tuple(entry.strip().split("=", 1))
+    for entry in os.getenv("USER_SESSIONS", "user=sessions/user_session").split(",")
+    if "=" in entry
+]
+ACCOUNT_KICK_TTL = int(os.getenv("ACCOUNT_KICK_TTL", str(7 * 24 * 3600)))
+
+# Posting engine: parallel sends and token-bucket limits (messages per second, 0 = no limit)
+POST_CONCURRENCY = int(os.getenv("POST_CONCURRENCY", "5"))
+ACCOUNT_RATE = float(os.getenv("ACCOUNT_RATE", "1.0"))
+ACCOUNT_BURST = int(os.getenv("ACCOUNT_BURST", "3"))
+CHANNEL_RATE = float(os.getenv("CHANNEL_RATE", "0.2"))
+CHANNEL_BURST = int(os.getenv("CHANNEL_BURST", "1"))
+
+# Scheduler: longest idle sleep and minimum gap before re-evaluating a pair (seconds)
+SCHEDULER_MAX_SLEEP = int(os.getenv("SCHEDULER_MAX_SLEEP", "900"))
+SCHEDULER_MIN_RECHECK = int(os.getenv("SCHEDULER_MIN_RECHECK", "60"))
+# Manual scheduler runs: pairs planned and queued per step (progress granularity),
+# and how long the bot keeps reporting on their posts afterwards
+SCHEDULER_RUN_CHUNK = int(os.getenv("SCHEDULER_RUN_CHUNK", "500"))
+SCHEDULER_RUN_FOLLOW = int(os.getenv("SCHEDULER_RUN_FOLLOW", "300"))
+# Longest dry run /simulate accepts (days)
+SIMULATE_MAX_DAYS = int(os.getenv("SIMULATE_MAX_DAYS", "31"))
+
+# Outbox: stream batch size, idle time before another sender reclaims a job (seconds),
+# attempts before dead-lettering and how long a pair stays gated while queued
+OUTBOX_BATCH = int(os.getenv("OUTBOX_BATCH", "50"))
+OUTBOX_CLAIM_IDLE = int(os.getenv("OUTBOX_CLAIM_IDLE", "300"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_INFLIGHT_TTL = int(os.getenv("OUTBOX_INFLIGHT_TTL", str(24 * 3600)))
+
+# Post history: attempts per batched insert, longest wait between flushes (seconds)
+# and how many unwritten attempts are kept while the database is unreachable
+LEDGER_BATCH = int(os.getenv("LEDGER_BATCH", "200"))
+LEDGER_FLUSH_INTERVAL = float(os.getenv("LEDGER_FLUSH_INTERVAL", "5"))
+LEDGER_MAX_BUFFER = int(os.getenv("LEDGER_MAX_BUFFER", "20000"))
+
+# Scheduler leader lease (seconds); a standby takes over within about ttl + ttl/3
+LEADER_TTL = int(os.getenv("LEADER_TTL", "10"))
+
+# Startups kept in teleads:startups for /startup, and channels per get_entity
+# batch when the metadata cache is warmed at startup
+STARTUP_HISTORY = int(os.getenv("STARTUP_HISTORY", "20"))
+WARM_CHUNK = int(os.getenv("WARM_CHUNK", "100"))
+
+# Bulk channel onboarding: links resolved at once, the longest flood wait sat out
+# before giving up on the rest, and links accepted per message or file
+ONBOARD_CONCURRENCY = int(os.getenv("ONBOARD_CONCURRENCY", "4"))
+ONBOARD_MAX_FLOOD_WAIT = int(os.getenv("ONBOARD_MAX_FLOOD_WAIT", "300"))
+ONBOARD_MAX_LINKS = int(os.getenv("ONBOARD_MAX_LINKS", "500"))
+
+# Prometheus endpoint port, 0 disables it
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Process role: "all" runs everything, "sender" only consumes the outbox
+TELEADS_ROLE = os.getenv("TELEADS_ROLE", "all")
+
+# Initial rules, copied once into Redis (teleads:rules); edit them from the bot afterwards
 CHANNEL_RULES = {
     "-1001810503890": {
         "type": "barcelona",
@@ -0,0 +1,128 @@
+import asyncio
+import json
+import time
+from .config import CHANNEL_META_ERROR_TTL, CHANNEL_META_REFRESH, CHANNEL_META_TTL
+from .metrics import observe
+from .redis import redis
+
+META_KEY = "teleads:channel_meta:{}"
+
+# Concurrency for the per-channel fallback when a batched lookup fails
+RESOLVE_FALLBACK_CONCURRENCY = 10
+
+_refreshing = set()
+_background_tasks = set()
+
+
+def _channel_type(entity):
+    if getattr(entity, "megagroup", False):
+        return "megagroup"
+    if getattr(entity, "broadcast", False):
+        return "broadcast"
+    return type(entity).__name__.lower()
+
+
+def meta_from_entity(entity):
+    return {
+        "title": getattr(entity, "title", None),
+        "access_hash": getattr(entity, "access_hash", None),
+        "username": getattr(entity, "username", None),
+        "type": _channel_type(entity),
+        "refreshed_at": time.time(),
+    }
+
+
+def channel_title(meta, ch_id):
+    if meta and meta.get("title"):
+        return meta["title"]
+    return f"❌ {ch_id}"
+
+
+async def store_channel_meta(entries):
+    # entries: {ch_id: meta}; failed lookups are kept briefly so we don't hammer Telegram
+    if not entries:
+        return
+    pipe = redis.pipeline(transaction=False)
+    for ch_id, meta in entries.items():
+        ttl = CHANNEL_META_TTL if meta.get("title") else CHANNEL_META_ERROR_TTL
+        pipe.set(META_KEY.format(ch_id), json.dumps(meta), ex=ttl)
+    await pipe.execute()
+
+
+async def resolve_channels(client, ch_ids):
+    ch_ids = [str(ch) for ch in ch_ids]
+    try:
+        # Telethon groups a list into a single GetChannelsRequest
+        with observe("telegram", "get_entity"):
+            entities = await client.get_entity([int(ch) for ch in ch_ids])
+    except Exception:
+        # One bad id fails the whole batch, resolve individually instead
+        semaphore = asyncio.Semaphore(RESOLVE_FALLBACK_CONCURRENCY)
+
+        async def resolve_one(ch):
+            async with semaphore:
+                with observe("telegram", "get_entity"):
+                    return await client.get_entity(int(ch))
+
+        entities = await asyncio.gather(
+            *(resolve_one(ch) for ch in ch_ids), return_exceptions=True
+        )
+
+    resolved = {}
+    for ch_id, entity in zip(ch_ids, entities):
+        if isinstance(entity, Exception):
+            resolved[ch_id] = {"title": None, "error": str(entity), "refreshed_at": time.time()}
+        else:
+            resolved[ch_id] = meta_from_entity(entity)
+
+    await store_channel_meta(resolved)
+    return resolved
+
+
+async def _refresh(client, ch_ids):
+    try:
+        await resolve_channels(client, ch_ids)
+    except Exception as e:
+        print(f"⚠️ Channel meta refresh failed: {e}")
+    finally:
+        _refreshing.difference_update(ch_ids)
+
+
+def refresh_in_background(client, ch_ids):
+    ch_ids = [ch for ch in ch_ids if ch not in _refreshing]
+    if not ch_ids:
+        return
+    _refreshing.update(ch_ids)
+    task = asyncio.create_task(_refresh(client, ch_ids))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def get_channel_meta(client, ch_ids):
+    ch_ids = [str(ch) for ch in ch_ids]
+    if not ch_ids:
+        return {}
+
+    raw = await redis.mget([META_KEY.format(ch) for ch in ch_ids])
+    now = time.time()
+    result, missing, stale = {}, [], []
+    for ch_id, value in zip(ch_ids, raw):
+        if value is None:
+            missing.append(ch_id)
+            continue
+        meta = json.loads(value)
+        result[ch_id] = meta
+        if now - meta.get("refreshed_at", 0) > CHANNEL_META_REFRESH:
+            stale.append(ch_id)
+
+    # Stale entries are served as-is and refreshed off the request path
+    if stale:
+        refresh_in_background(client, stale)
+    if missing:
+        result.update(await resolve_channels(client, missing))
+    return result
+
+
+async def get_channel_titles(client, ch_ids):
+    meta = await get_channel_meta(client, ch_ids)
+    return {str(ch): channel_title(meta.get(str(ch)), ch) for ch in ch_ids}
@@ -0,0 +1,152 @@
+import asyncio
+import heapq
+import itertools
+import time
+from .metrics import FLOOD_SECONDS
+from .redis import redis
+
+FLOOD_KEY = "teleads:flood"
+
+# Extra margin on top of what Telegram asks for
+FLOOD_MARGIN = 5
+
+
+class FloodDeferred(Exception):
+    """Raised by a send function when the post must wait for a flood ban to lift."""
+
+    def __init__(self, until):
+        super().__init__(f"flood wait until {until:.0f}")
+        self.until = until
+
+
+class AccountUnavailable(Exception):
+    """Raised by a send function when this account can't post to the channel at all."""
+
+
+class SendFailed(Exception):
+    """Raised by a send function when the post failed. error names the cause; a
+    permanent failure is not retried."""
+
+    def __init__(self, error, permanent=False):
+        super().__init__(error)
+        self.error = error
+        self.permanent = permanent
+
+
+def _scope(account, ch_id=None):
+    return f"{account}:{ch_id}" if ch_id is not None else account
+
+
+class FloodTable:
+    # Bans are shared through a Redis hash (scope -> unix time the ban lifts).
+    # A scope is either "<account>" or "<account>:<channel>".
+
+    def __init__(self):
+        self.bans = {}
+
+    async def load(self):
+        raw = await redis.hgetall(FLOOD_KEY)
+        now = time.time()
+        expired = [scope for scope, until in raw.items() if float(until) <= now]
+        if expired:
+            await redis.hdel(FLOOD_KEY, *expired)
+        self.bans = {
+            scope: float(until) for scope, until in raw.items() if float(until) > now
+        }
+        return self.bans
+
+    async def record(self, account, ch_id, seconds):
+        scope = _scope(account, ch_id)
+        FLOOD_SECONDS.labels(account, "channel" if ch_id is not None else "account").inc(seconds)
+        until = time.time() + seconds + FLOOD_MARGIN
+        if until > self.bans.get(scope, 0):
+            self.bans[scope] = until
+            await redis.hset(FLOOD_KEY, scope, until)
+        print(f"⚠️ Flood wait {seconds}s on {scope}, deferring until {time.ctime(until)}")
+        return self.bans[scope]
+
+    def blocked_until(self, account, ch_id):
+        until = max(
+            self.bans.get(_scope(account), 0),
+            self.bans.get(_scope(account, ch_id), 0),
+        )
+        return until if until > time.time() else None
+
+    async def table(self):
+        bans = await self.load()
+        now = time.time()
+        return sorted(
+            ((scope, until - now) for scope, until in bans.items()),
+            key=lambda row: row[1],
+            reverse=True,
+        )
+
+
+class RetryQueue:
+    # Jobs held back by a flood ban, re-sent as soon as the ban lifts
+
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        # Batches being re-sent; the loop doesn't wait for them
+        self.tasks = set()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def defer(self, ready_at, job, send, account, commit=None):
+        heapq.heappush(
+            self.heap, (ready_at, next(self.counter), job, send, account, commit)
+        )
+        self.wakeup.set()
+
+    def ready_at(self, ad_id, ch_id):
+        times = [
+            ready_at
+            for ready_at, _, job, *_ in self.heap
+            if job.ad["id"] == ad_id and str(job.ch_id) == str(ch_id)
+        ]
+        return min(times) if times else None
+
+    def pending(self):
+        return [(entry[0], entry[2]) for entry in sorted(self.heap, key=lambda e: e[:2])]
+
+    async def run(self, engine):
+        while True:
+            self.wakeup.clear()
+            if not self.heap:
+                await self.wakeup.wait()
+                continue
+
+            delay = self.heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    # Wake early if a job with an earlier deadline is deferred
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            batches = {}
+            while self.heap and self.heap[0][0] <= time.time():
+                _, _, job, send, account, commit = heapq.heappop(self.heap)
+                batches.setdefault((send, account, commit), []).append(job)
+
+            # Straight back to the heap: a slow batch (or one hitting flood waits
+            # of its own) must not hold up retries due before it finishes
+            for (send, account, commit), jobs in batches.items():
+                task = asyncio.create_task(
+                    engine.run(jobs, send, label="retry", account=account, commit=commit)
+                )
+                self.tasks.add(task)
+                task.add_done_callback(self._finished)
+
+    def _finished(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            print(f"❌ Retry batch failed: {task.exception()}")
+
+
+flood_table = FloodTable()
+retry_queue = RetryQueue()
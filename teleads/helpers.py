@@ -1,33 +1,360 @@
+import asyncio
 import json
+from dataclasses import dataclass
+from .keyspace import forget_advert, forget_channel
+from .media import delete_unused_media
 from .prisma import db
+from .redis import redis
 
+# Legacy blob keys in the Cache table, only read by the migration below
+CACHE_KEY_ADVERTS = "teleads:adverts"
 CACHE_KEY_CHANNELS = "teleads:channels"
+CACHE_KEY_MIGRATED = "teleads:migrated:rows"
+
+# Rows per menu page
+ADVERTS_PAGE_SIZE = 8
+CHANNELS_PAGE_SIZE = 25
+
+
+# -------------------
+# In-process cache
+# -------------------
+class ListCache:
+    """Decoded copy of a table, valid while its Redis version stamp is unchanged.
+
+    Every write bumps the stamp, so other replicas drop their copy on the next read.
+    Writers read loads before their DB write and pass it to commit: a copy reloaded
+    in between may already hold the write and must not get it applied twice.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.version_key = f"teleads:cache_version:{name}"
+        self.value = None
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.lock = asyncio.Lock()
+
+    async def get(self, loader):
+        version = int(await redis.get(self.version_key) or 0)
+        if self.value is not None and self.version == version:
+            self.hits += 1
+            return self.value
+
+        async with self.lock:
+            if self.value is None or self.version != version:
+                self.misses += 1
+                self.value = await loader()
+                self.version = version
+                self.loads += 1
+            else:
+                self.hits += 1
+        return self.value
+
+    async def commit(self, mutate=None, loads=None):
+        expected = self.version
+        version = await redis.incr(self.version_key)
+        # Keep our copy only if it wasn't reloaded during the write and nobody
+        # else wrote since we loaded it
+        if (
+            self.value is not None
+            and mutate
+            and loads == self.loads
+            and expected is not None
+            and version == expected + 1
+        ):
+            mutate(self.value)
+            self.version = version
+        else:
+            self.value = None
+            self.version = None
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "cached": self.value is not None,
+            "version": self.version,
+        }
+
+
+adverts_cache = ListCache("adverts")
+channels_cache = ListCache("channels")
+
+
+def cache_stats():
+    return {
+        adverts_cache.name: adverts_cache.stats(),
+        channels_cache.name: channels_cache.stats(),
+    }
+
+
+def _copy_advert(ad):
+    return dict(ad, channels=list(ad["channels"]))
+
+
+def _advert_to_dict(record):
+    return {
+        "id": record.id,
+        "content": record.content,
+        "schedule": record.schedule,
+        "active": record.active,
+        "channels": [link.channelId for link in record.channels or []],
+        "media": record.mediaId,
+    }
+
+
+# -------------------
+# Pages
+# -------------------
+@dataclass
+class Page:
+    items: list
+    has_prev: bool
+    has_next: bool
+
+
+# Stable order for paging: rows created in the same instant fall back to the id
+PAGE_ORDER = [{"createdAt": "asc"}, {"id": "asc"}]
+
+
+async def _page(table, size, cursor=None, backward=False, where=None):
+    """Keyset pagination: the `size` rows after (or before) the cursor row.
+
+    One extra row is read to tell whether the list goes on, so a page costs the
+    same however deep it is and however many rows the table holds.
+    """
+    query = {"where": where, "order": PAGE_ORDER, "take": -(size + 1) if backward else size + 1}
+    if cursor:
+        query.update(cursor={"id": cursor}, skip=1)
+    records = await table.find_many(**query)
+    if cursor and not records:
+        # The cursor row was deleted meanwhile, start over
+        return await _page(table, size, where=where)
+
+    more = len(records) > size
+    if backward:
+        records = records[1:] if more else records
+        return Page(records, has_prev=more, has_next=True)
+    return Page(records[:size], has_prev=bool(cursor), has_next=more)
+
+
+# -------------------
+# Adverts
+# -------------------
+async def _load_adverts():
+    records = await db.advert.find_many(
+        include={"channels": True},
+        order={"createdAt": "asc"},
+    )
+    return [_advert_to_dict(r) for r in records]
 
 
 async def get_adverts():
-    record = await db.cache.find_unique(where={"key": "teleads:adverts"})
-    if not record or not record.value:
-        return []
+    adverts = await adverts_cache.get(_load_adverts)
+    return [_copy_advert(ad) for ad in adverts]
+
+
+async def get_advert(ad_id):
+    adverts = await adverts_cache.get(_load_adverts)
+    for ad in adverts:
+        if ad["id"] == ad_id:
+            return _copy_advert(ad)
+    return None
+
+
+async def get_adverts_page(cursor=None, backward=False, prefix=None, size=ADVERTS_PAGE_SIZE):
+    # One page of {id, content, active}, optionally only adverts starting with prefix
+    where = {"content": {"startswith": prefix}} if prefix else None
+    page = await _page(db.advert, size, cursor, backward, where)
+    page.items = [{"id": r.id, "content": r.content, "active": r.active} for r in page.items]
+    return page
+
+
+def _patch_advert(ad_id, **fields):
+    def mutate(adverts):
+        for ad in adverts:
+            if ad["id"] == ad_id:
+                ad.update(fields)
+    return mutate
 
-    try:
-        return json.loads(record.value)
-    except json.JSONDecodeError:
-        return []
 
+async def create_advert(ad):
+    loads = adverts_cache.loads
+    async with db.tx() as tx:
+        await tx.advert.create(
+            data={
+                "id": ad["id"],
+                "content": ad["content"],
+                "schedule": ad["schedule"],
+                "active": ad.get("active", False),
+                "mediaId": ad.get("media"),
+            }
+        )
+        await _link_channels(tx, ad["id"], ad.get("channels", []))
 
-async def set_adverts(adverts):
-    value = json.dumps(adverts)
-    await db.cache.upsert(
-        where={"key": "teleads:adverts"},
-        data={
-            "update": {"value": value},
-            "create": {"key": "teleads:adverts", "value": value},
-        },
+    created = {
+        "id": ad["id"],
+        "content": ad["content"],
+        "schedule": ad["schedule"],
+        "active": ad.get("active", False),
+        "channels": [str(ch) for ch in ad.get("channels", [])],
+        "media": ad.get("media"),
+    }
+    await adverts_cache.commit(lambda adverts: adverts.append(created), loads)
+    if created["channels"]:
+        # Linking may have created missing channel rows
+        await channels_cache.commit()
+
+
+async def update_advert(ad_id, **fields):
+    loads = adverts_cache.loads
+    record = await db.advert.update(where={"id": ad_id}, data=fields)
+    if record is None:
+        return False
+    await adverts_cache.commit(_patch_advert(ad_id, **fields), loads)
+    return True
+
+
+async def set_advert_media(ad_id, media_id):
+    # media_id None detaches the media; a file no advert uses any more is deleted
+    ad = await get_advert(ad_id)
+    if not ad:
+        return False
+    loads = adverts_cache.loads
+    await db.advert.update(where={"id": ad_id}, data={"mediaId": media_id})
+    await adverts_cache.commit(_patch_advert(ad_id, media=media_id), loads)
+    if ad["media"] != media_id:
+        await delete_unused_media(ad["media"])
+    return True
+
+
+async def toggle_advert(ad_id):
+    # Flip in a single statement so concurrent toggles don't overwrite each other
+    loads = adverts_cache.loads
+    count = await db.execute_raw(
+        "UPDATE `Advert` SET `active` = NOT `active` WHERE `id` = ?", ad_id
+    )
+    if not count:
+        return False
+
+    def mutate(adverts):
+        for ad in adverts:
+            if ad["id"] == ad_id:
+                ad["active"] = not ad["active"]
+
+    await adverts_cache.commit(mutate, loads)
+    return True
+
+
+async def set_advert_channels(ad_id, channels):
+    loads = adverts_cache.loads
+    async with db.tx() as tx:
+        await tx.advertchannel.delete_many(where={"advertId": ad_id})
+        await _link_channels(tx, ad_id, channels)
+
+    await adverts_cache.commit(
+        _patch_advert(ad_id, channels=[str(ch) for ch in channels]), loads
+    )
+    if channels:
+        await channels_cache.commit()
+
+
+async def delete_advert(ad_id):
+    ad = await get_advert(ad_id)
+    loads = adverts_cache.loads
+    count = await db.advert.delete_many(where={"id": ad_id})
+    if not count:
+        return False
+
+    def mutate(adverts):
+        adverts[:] = [ad for ad in adverts if ad["id"] != ad_id]
+
+    await adverts_cache.commit(mutate, loads)
+    await forget_advert(ad_id)
+    if ad:
+        await delete_unused_media(ad["media"])
+    return True
+
+
+async def _link_channels(client, ad_id, channels):
+    if not channels:
+        return
+    await client.channel.create_many(
+        data=[{"id": str(ch)} for ch in channels],
+        skip_duplicates=True,
+    )
+    await client.advertchannel.create_many(
+        data=[{"advertId": ad_id, "channelId": str(ch)} for ch in channels],
+        skip_duplicates=True,
     )
 
 
+# -------------------
+# Channels
+# -------------------
+async def _load_channels():
+    records = await db.channel.find_many(order={"createdAt": "asc"})
+    return [r.id for r in records]
+
+
 async def get_channels():
-    record = await db.cache.find_unique(where={"key": CACHE_KEY_CHANNELS})
+    return list(await channels_cache.get(_load_channels))
+
+
+async def get_channels_page(cursor=None, backward=False, size=CHANNELS_PAGE_SIZE):
+    page = await _page(db.channel, size, cursor, backward)
+    page.items = [r.id for r in page.items]
+    return page
+
+
+async def add_channels(ch_ids):
+    # Many channels in one write; returns the ids that weren't there yet
+    ch_ids = list(dict.fromkeys(str(ch) for ch in ch_ids))
+    if not ch_ids:
+        return []
+    existing = {r.id for r in await db.channel.find_many(where={"id": {"in": ch_ids}})}
+    new = [ch for ch in ch_ids if ch not in existing]
+    if new:
+        loads = channels_cache.loads
+        await db.channel.create_many(data=[{"id": ch} for ch in new], skip_duplicates=True)
+        await channels_cache.commit(
+            lambda channels: channels.extend(ch for ch in new if ch not in channels), loads
+        )
+    return new
+
+
+async def remove_channel(ch_id):
+    ch_id = str(ch_id)
+    channel_loads, advert_loads = channels_cache.loads, adverts_cache.loads
+    count = await db.channel.delete_many(where={"id": ch_id})
+    if not count:
+        return False
+    await channels_cache.commit(
+        lambda channels: channels.remove(ch_id) if ch_id in channels else None, channel_loads
+    )
+
+    # Links are removed by the cascade, mirror that in the cached adverts
+    def mutate(adverts):
+        for ad in adverts:
+            if ch_id in ad["channels"]:
+                ad["channels"].remove(ch_id)
+
+    await adverts_cache.commit(mutate, advert_loads)
+    # Any advert may have posted there, ads without a channel list post everywhere
+    await forget_channel(ch_id, [ad["id"] for ad in await get_adverts()])
+    return True
+
+
+# -------------------
+# Migration
+# -------------------
+async def _load_blob(key):
+    record = await db.cache.find_unique(where={"key": key})
     if not record or not record.value:
         return []
 
@@ -37,12 +364,38 @@ async def get_channels():
         return []
 
 
-async def set_channels(channels: list):
-    value = json.dumps(channels)
-    await db.cache.upsert(
-        where={"key": CACHE_KEY_CHANNELS},
-        data={
-            "update": {"value": value},
-            "create": {"key": CACHE_KEY_CHANNELS, "value": value},
-        },
-    )
+# One-shot: copies the legacy JSON blobs into row storage and leaves a marker
+async def migrate_cache_blob():
+    if await db.cache.find_unique(where={"key": CACHE_KEY_MIGRATED}):
+        return False
+
+    channels = await _load_blob(CACHE_KEY_CHANNELS)
+    adverts = await _load_blob(CACHE_KEY_ADVERTS)
+
+    async with db.tx() as tx:
+        if channels:
+            await tx.channel.create_many(
+                data=[{"id": str(ch)} for ch in channels],
+                skip_duplicates=True,
+            )
+        for ad in adverts:
+            await tx.advert.upsert(
+                where={"id": ad["id"]},
+                data={
+                    "create": {
+                        "id": ad["id"],
+                        "content": ad["content"],
+                        "schedule": ad["schedule"],
+                        "active": ad.get("active", False),
+                    },
+                    "update": {},
+                },
+            )
+            await _link_channels(tx, ad["id"], ad.get("channels", []))
+        await tx.cache.create(data={"key": CACHE_KEY_MIGRATED, "value": "1"})
+
+    await adverts_cache.commit()
+    await channels_cache.commit()
+
+    print(f"✅ Migrated {len(adverts)} adverts and {len(channels)} channels to row storage.")
+    return True
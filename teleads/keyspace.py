@@ -0,0 +1,239 @@
+import datetime
+from collections import Counter
+from redis.exceptions import ResponseError
+from .config import DRAFT_TTL, USER_SESSIONS
+from .entities import META_KEY
+from .membership import KICKED_KEY, MEMBER_KEY
+from .redis import redis
+from .rules import TZ, WEEK_RETENTION
+from .slots import SLOTS_KEY, _periods, forget_advert_slots, forget_channel_slots
+from .state import DRAFT_PREFIXES
+
+# Keys per SCAN step and per cleanup pipeline
+SCAN_COUNT = 1000
+
+# Keys per prefix whose MEMORY USAGE is sampled for the report
+MEMORY_SAMPLES = 50
+
+
+# -------------------
+# Cleanup
+# -------------------
+async def forget_advert(ad_id):
+    await forget_advert_slots(ad_id)
+
+
+async def forget_channel(ch_id, ad_ids):
+    # Everything kept per channel; its rule stays in case the channel is added back
+    ch_id = str(ch_id)
+    await forget_channel_slots(ch_id, ad_ids)
+    accounts = [name for name, _ in USER_SESSIONS]
+    await redis.delete(
+        META_KEY.format(ch_id),
+        *(MEMBER_KEY.format(name, ch_id) for name in accounts),
+        *(KICKED_KEY.format(name, ch_id) for name in accounts),
+    )
+
+
+# -------------------
+# Compaction
+# -------------------
+async def _scan(match):
+    # SCAN in batches of up to SCAN_COUNT keys
+    batch = []
+    async for key in redis.scan_iter(match=match, count=SCAN_COUNT):
+        batch.append(key)
+        if len(batch) >= SCAN_COUNT:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Compactor:
+    """Moves the pre-hash slot keys into the per-advert hashes and drops whatever
+    belongs to deleted adverts or channels. With dry_run nothing is written."""
+
+    def __init__(self, ad_ids, channels, dry_run=False):
+        self.ad_ids = set(ad_ids)
+        self.channels = {str(ch) for ch in channels}
+        self.dry_run = dry_run
+        self.counts = Counter()
+        self.now = datetime.datetime.now(TZ)
+
+    def _known(self, ad_id, ch_id):
+        return ad_id in self.ad_ids and ch_id in self.channels
+
+    async def _execute(self, pipe):
+        if not self.dry_run and len(pipe):
+            await pipe.execute()
+
+    async def migrate_legacy(self):
+        # ad_posted:{ad}:{ch}, ad_count:{ad}:{ch}:{date} and week_post:{ad}:{ch}:{week}
+        day, week = _periods(self.now)
+        this_week = str(self.now.isocalendar()[1])
+        for pattern in ("ad_posted:*", "ad_count:*", "week_post:*"):
+            async for keys in _scan(pattern):
+                values = await redis.mget(keys)
+                pipe = redis.pipeline(transaction=False)
+                migrated = 0
+                for key, value in zip(keys, values):
+                    prefix, _, rest = key.partition(":")
+                    parts = rest.split(":")
+                    pipe.delete(key)
+                    if len(parts) < 2 or value is None or not self._known(parts[0], parts[1]):
+                        continue
+                    ad_id, ch_id = parts[:2]
+                    hash_key = SLOTS_KEY.format(ad_id)
+                    if prefix == "ad_posted":
+                        # The hash may already hold a newer post, never overwrite it
+                        pipe.hsetnx(hash_key, f"{ch_id}:last", value)
+                    elif prefix == "ad_count" and parts[2:] == [day]:
+                        pipe.hsetnx(hash_key, f"{ch_id}:day", f"{day}|{value}")
+                    elif prefix == "week_post" and parts[2:] == [this_week]:
+                        pipe.hsetnx(hash_key, f"{ch_id}:week", f"{week}|{value}")
+                    else:
+                        continue
+                    migrated += 1
+                self.counts["migrated"] += migrated
+                self.counts["legacy_deleted"] += len(keys)
+                await self._execute(pipe)
+
+    async def trim_slots(self):
+        # Hashes of deleted adverts go, fields of deleted channels are dropped and
+        # hashes without a TTL (fresh from the migration) get the longest one
+        async for keys in _scan(SLOTS_KEY.format("*")):
+            read = redis.pipeline(transaction=False)
+            for key in keys:
+                read.hkeys(key)
+                read.ttl(key)
+            results = await read.execute()
+            pipe = redis.pipeline(transaction=False)
+            for i, key in enumerate(keys):
+                fields, ttl = results[2 * i], results[2 * i + 1]
+                if key.split(":", 2)[2] not in self.ad_ids:
+                    pipe.delete(key)
+                    self.counts["slots_deleted"] += 1
+                    continue
+                stale = [f for f in fields if f.rsplit(":", 1)[0] not in self.channels]
+                if stale:
+                    pipe.hdel(key, *stale)
+                    self.counts["fields_dropped"] += len(stale)
+                if ttl == -1:
+                    pipe.expire(key, WEEK_RETENTION)
+                    self.counts["ttl_added"] += 1
+            await self._execute(pipe)
+
+    async def drop_channel_keys(self):
+        # Metadata, memberships and kick marks of channels that are gone
+        patterns = [META_KEY.format("*"), MEMBER_KEY.format("*", "*"), KICKED_KEY.format("*", "*")]
+        for pattern in patterns:
+            async for keys in _scan(pattern):
+                doomed = [key for key in keys if key.rsplit(":", 1)[1] not in self.channels]
+                pipe = redis.pipeline(transaction=False)
+                if doomed:
+                    pipe.delete(*doomed)
+                self.counts["channel_keys_deleted"] += len(doomed)
+                await self._execute(pipe)
+
+    async def expire_drafts(self):
+        # Flow keys written before they had a TTL
+        for prefix in DRAFT_PREFIXES:
+            async for keys in _scan(f"{prefix}:*"):
+                read = redis.pipeline(transaction=False)
+                for key in keys:
+                    read.ttl(key)
+                forever = [key for key, ttl in zip(keys, await read.execute()) if ttl == -1]
+                pipe = redis.pipeline(transaction=False)
+                for key in forever:
+                    pipe.expire(key, DRAFT_TTL)
+                self.counts["ttl_added"] += len(forever)
+                await self._execute(pipe)
+
+    async def run(self):
+        await self.migrate_legacy()
+        await self.trim_slots()
+        await self.drop_channel_keys()
+        await self.expire_drafts()
+        return +self.counts
+
+
+async def compact(ad_ids, channels, dry_run=False):
+    return await Compactor(ad_ids, channels, dry_run).run()
+
+
+# -------------------
+# Report
+# -------------------
+def key_prefix(key):
+    # Segments up to the first id-like one (anything with a digit), e.g.
+    # teleads:slots:3f2a...  -> teleads:slots:*
+    prefix = []
+    for part in key.split(":"):
+        if any(c.isdigit() for c in part):
+            return ":".join(prefix + ["*"])
+        prefix.append(part)
+    return key
+
+
+async def key_report():
+    # {prefix: {"keys", "no_ttl", "bytes"}}; bytes are estimated from up to
+    # MEMORY_SAMPLES keys per prefix and None when the server has no MEMORY USAGE
+    report = {}
+    sampled = Counter()
+    sampled_bytes = Counter()
+    memory_usage = True
+    async for keys in _scan("*"):
+        pipe = redis.pipeline(transaction=False)
+        probes = []
+        for key in keys:
+            prefix = key_prefix(key)
+            pipe.ttl(key)
+            if memory_usage and sampled[prefix] < MEMORY_SAMPLES:
+                sampled[prefix] += 1
+                probes.append(prefix)
+                pipe.memory_usage(key)
+            else:
+                probes.append(None)
+        results = iter(await pipe.execute(raise_on_error=False))
+        for key, probe in zip(keys, probes):
+            row = report.setdefault(key_prefix(key), {"keys": 0, "no_ttl": 0, "bytes": None})
+            row["keys"] += 1
+            if next(results) == -1:
+                row["no_ttl"] += 1
+            if probe is None:
+                continue
+            usage = next(results)
+            if isinstance(usage, ResponseError):
+                memory_usage = False
+            else:
+                sampled_bytes[probe] += usage or 0
+
+    if memory_usage:
+        for prefix, row in report.items():
+            if sampled[prefix]:
+                row["bytes"] = sampled_bytes[prefix] * row["keys"] // sampled[prefix]
+    return report
+
+
+def _size(n):
+    for unit in ("B", "KB", "MB"):
+        if n < 1024:
+            return f"{n:.0f}{unit}"
+        n /= 1024
+    return f"{n:.1f}GB"
+
+
+def format_report(report, top=30):
+    if not report:
+        return "🗝 Redis is empty."
+    rows = sorted(report.items(), key=lambda item: (item[1]["bytes"] or 0, item[1]["keys"]), reverse=True)
+    total_keys = sum(row["keys"] for row in report.values())
+    lines = [f"🗝 {total_keys} keys under {len(report)} prefixes:"]
+    for prefix, row in rows[:top]:
+        size = _size(row["bytes"]) if row["bytes"] is not None else "n/a"
+        forever = f", {row['no_ttl']} without TTL" if row["no_ttl"] else ""
+        lines.append(f"{prefix}: {row['keys']} keys, ~{size}{forever}")
+    if len(rows) > top:
+        lines.append(f"... and {len(rows) - top} more prefixes")
+    return "\n".join(lines)
@@ -0,0 +1,144 @@
+import asyncio
+import os
+import socket
+import time
+from .config import LEADER_TTL
+from .redis import redis
+
+LEASE_KEY = "teleads:leader:{}"
+FENCE_KEY = "teleads:leader:{}:fence"
+
+# Take the lease and hand out the next fencing token in one step
+ACQUIRE = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    local token = redis.call('INCR', KEYS[2])
+    redis.call('SET', KEYS[1], ARGV[1] .. '|' .. token, 'PX', ARGV[2])
+    return token
+end
+return false
+"""
+
+# Extend or drop the lease only while we still hold it
+RENEW = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LeaseLost(Exception):
+    """Raised when a write is fenced off because another replica took the lease."""
+
+
+class LeaderLease:
+    # A Redis lease with a fencing token. Every replica runs elect(); the one holding
+    # the lease runs the work, renewing every ttl/3. Writers pass the token along
+    # and storage rejects it as soon as a newer leader has been elected, so a
+    # replica that stalled past its lease can't write behind the new leader.
+
+    def __init__(self, name, ttl=LEADER_TTL, holder=None):
+        self.name = name
+        self.ttl = ttl
+        self.holder = holder or f"{socket.gethostname()}-{os.getpid()}"
+        self.key = LEASE_KEY.format(name)
+        self.fence_key = FENCE_KEY.format(name)
+        self.token = None
+        self.renewed_at = 0.0
+        self.elections = 0
+        self.acquire_script = redis.register_script(ACQUIRE)
+        self.renew_script = redis.register_script(RENEW)
+        self.release_script = redis.register_script(RELEASE)
+
+    @property
+    def is_leader(self):
+        # Trust the lease only while it can't have expired on the server
+        return self.token is not None and time.monotonic() - self.renewed_at < self.ttl
+
+    @property
+    def value(self):
+        return f"{self.holder}|{self.token}"
+
+    async def acquire(self):
+        token = await self.acquire_script(
+            keys=[self.key, self.fence_key], args=[self.holder, self.ttl * 1000]
+        )
+        if not token:
+            return False
+        self.token = int(token)
+        self.renewed_at = time.monotonic()
+        self.elections += 1
+        print(f"👑 {self.holder} is now the {self.name} leader (token {self.token})")
+        return True
+
+    async def renew(self):
+        started = time.monotonic()
+        if await self.renew_script(keys=[self.key], args=[self.value, self.ttl * 1000]):
+            self.renewed_at = started
+            return True
+        return False
+
+    async def release(self):
+        if self.token is None:
+            return
+        try:
+            await self.release_script(keys=[self.key], args=[self.value])
+        finally:
+            self.token = None
+
+    async def current(self):
+        # (holder, token) of whoever leads right now, for the status screen
+        raw = await redis.get(self.key)
+        if not raw:
+            return None, None
+        holder, _, token = raw.rpartition("|")
+        return holder, int(token)
+
+    async def _keep(self):
+        # Returns once the lease is lost; Redis errors are retried until it would expire
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                if not await self.renew():
+                    return
+            except Exception as e:
+                print(f"⚠️ Lease renewal for {self.name} failed: {e}")
+            if not self.is_leader:
+                return
+
+    async def elect(self, work):
+        # work: async callable run only while this replica holds the lease
+        while True:
+            try:
+                acquired = await self.acquire()
+            except Exception as e:
+                print(f"⚠️ Leader election for {self.name} failed: {e}")
+                acquired = False
+            if not acquired:
+                await asyncio.sleep(self.ttl / 3)
+                continue
+
+            worker = asyncio.create_task(work())
+            keeper = asyncio.create_task(self._keep())
+            try:
+                done, _ = await asyncio.wait(
+                    {worker, keeper}, return_when=asyncio.FIRST_COMPLETED
+                )
+            finally:
+                worker.cancel()
+                keeper.cancel()
+                await asyncio.gather(worker, keeper, return_exceptions=True)
+                await self.release()
+            if worker in done:
+                print(f"❌ {self.name} stopped while leading: {worker.exception()}")
+            else:
+                print(f"👋 {self.holder} lost the {self.name} lease")
+            # Give the other replicas a chance before standing again
+            await asyncio.sleep(self.ttl / 3)
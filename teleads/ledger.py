@@ -0,0 +1,135 @@
+import asyncio
+import datetime
+from collections import defaultdict
+from .config import LEDGER_BATCH, LEDGER_FLUSH_INTERVAL, LEDGER_MAX_BUFFER
+from .prisma import db
+from .rules import TZ
+
+
+def _day(t):
+    # Calendar day in Europe/Vilnius, as the midnight Prisma stores for a Date column
+    d = t.astimezone(TZ).date()
+    return datetime.datetime(d.year, d.month, d.day, tzinfo=datetime.timezone.utc)
+
+
+# -------------------
+# Ledger
+# -------------------
+class PostLedger:
+    """Every send attempt, buffered in memory and written to PostLog in batches.
+
+    record() never waits on the database; run() flushes once LEDGER_BATCH attempts
+    are queued or LEDGER_FLUSH_INTERVAL has passed. A failed write is retried on
+    the next flush, and past LEDGER_MAX_BUFFER the oldest attempts are dropped.
+    """
+
+    def __init__(self, batch=LEDGER_BATCH, interval=LEDGER_FLUSH_INTERVAL, max_buffer=LEDGER_MAX_BUFFER):
+        self.batch = batch
+        self.interval = interval
+        self.max_buffer = max_buffer
+        self.buffer = []
+        self.written = 0
+        self.dropped = 0
+        self.full = asyncio.Event()
+        self.lock = asyncio.Lock()
+
+    def record(self, ad_id, ch_id, account, outcome, latency, message_id=None, error=None):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.buffer.append(
+            {
+                "advertId": str(ad_id),
+                "channelId": str(ch_id),
+                "account": account,
+                "messageId": message_id,
+                "outcome": outcome,
+                "error": error,
+                "latencyMs": int(latency * 1000),
+                "createdAt": now,
+                "day": _day(now),
+            }
+        )
+        if len(self.buffer) > self.max_buffer:
+            excess = len(self.buffer) - self.max_buffer
+            del self.buffer[:excess]
+            self.dropped += excess
+        if len(self.buffer) >= self.batch:
+            self.full.set()
+
+    async def flush(self):
+        async with self.lock:
+            while self.buffer:
+                rows, self.buffer = self.buffer[:self.batch], self.buffer[self.batch:]
+                try:
+                    await db.postlog.create_many(data=rows)
+                except Exception as e:
+                    print(f"❌ Post history write failed, retrying later: {e}")
+                    self.buffer[:0] = rows
+                    return False
+                self.written += len(rows)
+        return True
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.full.clear()
+            await self.flush()
+
+
+post_ledger = PostLedger()
+
+
+# -------------------
+# Stats
+# -------------------
+# Every query filters on a leading prefix of one PostLog index and groups by the
+# columns that follow it, so MySQL answers from the index alone.
+
+
+def since_day(days):
+    return _day(datetime.datetime.now(TZ) - datetime.timedelta(days=days - 1))
+
+
+async def _grouped(by, where):
+    # [(values of `by`..., count)] for the rows matching where
+    rows = await db.postlog.group_by(by=by, where=where, count=True)
+    return [tuple(row[field] for field in by) + (row["_count"]["_all"],) for row in rows]
+
+
+def _tally(rows):
+    # [(key, outcome, n)] -> {key: {outcome: n}}
+    tally = defaultdict(lambda: defaultdict(int))
+    for key, outcome, n in rows:
+        tally[key][outcome] += n
+    return tally
+
+
+async def posts_by_day(days=14, ad_id=None, ch_id=None):
+    # {day: {outcome: n}}, optionally for one advert or one channel
+    where = {"day": {"gte": since_day(days)}}
+    if ad_id:
+        where["advertId"] = ad_id
+    elif ch_id:
+        where["channelId"] = str(ch_id)
+    return _tally(await _grouped(["day", "outcome"], where))
+
+
+async def posts_by_channel(days=30, ad_id=None):
+    # {ch_id: {outcome: n}}, optionally for one advert
+    where = {"day": {"gte": since_day(days)}}
+    if ad_id:
+        where["advertId"] = ad_id
+    return _tally(await _grouped(["channelId", "outcome"], where))
+
+
+async def posts_by_account(days=30):
+    where = {"day": {"gte": since_day(days)}}
+    return _tally(await _grouped(["account", "outcome"], where))
+
+
+def failure_rate(outcomes):
+    # Share of attempts that ended without a post; deferrals and failovers don't count
+    done = outcomes.get("sent", 0) + outcomes.get("failed", 0)
+    return outcomes.get("failed", 0) / done if done else 0.0
@@ -0,0 +1,242 @@
+import asyncio
+import base64
+import hashlib
+import json
+from prisma.errors import UniqueViolationError
+from prisma.fields import Base64
+from telethon.errors import (
+    FileReferenceEmptyError,
+    FileReferenceExpiredError,
+    FileReferenceInvalidError,
+    MediaEmptyError,
+    MediaInvalidError,
+)
+from telethon.tl.types import (
+    DocumentAttributeFilename,
+    InputDocument,
+    InputPeerChannel,
+    InputPhoto,
+    MessageMediaDocument,
+    MessageMediaPhoto,
+)
+from .config import USER_SESSIONS
+from .membership import rpc
+from .prisma import db
+from .redis import redis
+
+# Telegram's handle for an uploaded creative, per account (access hashes are per
+# account): hash of media id -> {"kind", "id", "access_hash", "file_reference",
+# "peer", "msg"}, where peer/msg locate a message that carries it
+HANDLE_KEY = "teleads:media:{}"
+
+# Telegram's limit for a media caption, the advert text
+CAPTION_LIMIT = 1024
+
+# The bot sends on its own behalf when a user account lacks admin rights
+BOT_ACCOUNT = "bot"
+
+# File references expire every few hours; these mean "fetch a fresh one"
+FILE_REFERENCE_ERRORS = (FileReferenceEmptyError, FileReferenceExpiredError, FileReferenceInvalidError)
+# ...and these that the handle is no good at all, upload again
+HANDLE_ERRORS = (MediaEmptyError, MediaInvalidError)
+
+
+# -------------------
+# Storage
+# -------------------
+async def store_media(data, kind, mime_type, file_name):
+    # Content-addressed: the same file uploaded twice is stored once
+    media_id = hashlib.sha256(data).hexdigest()
+    # count() rather than find_unique, which would read the blob back
+    if not await db.media.count(where={"id": media_id}):
+        try:
+            await db.media.create(
+                data={
+                    "id": media_id,
+                    "kind": kind,
+                    "mimeType": mime_type,
+                    "fileName": file_name,
+                    "size": len(data),
+                    "data": Base64.encode(data),
+                }
+            )
+        except UniqueViolationError:
+            pass
+    return media_id
+
+
+async def load_media(media_id):
+    record = await db.media.find_unique(where={"id": media_id})
+    if not record:
+        return None
+    return {
+        "id": record.id,
+        "kind": record.kind,
+        "mime_type": record.mimeType,
+        "file_name": record.fileName,
+        "data": record.data.decode(),
+    }
+
+
+async def delete_unused_media(media_id):
+    # Drops the file and its Telegram handles once no advert points at it
+    if not media_id:
+        return False
+    count = await db.media.delete_many(where={"id": media_id, "adverts": {"none": {}}})
+    if not count:
+        return False
+    pipe = redis.pipeline(transaction=False)
+    for account in [name for name, _ in USER_SESSIONS] + [BOT_ACCOUNT]:
+        pipe.hdel(HANDLE_KEY.format(account), media_id)
+    await pipe.execute()
+    return True
+
+
+async def save_media(message, max_bytes):
+    # Stores the photo or video of a message sent to the bot; None if it has neither
+    info = media_from_message(message)
+    if not info:
+        return None
+    if message.file.size > max_bytes:
+        raise ValueError(f"the file is over the {max_bytes // 1024 // 1024} MB limit")
+    with rpc("download_media"):
+        data = await message.download_media(file=bytes)
+    return await store_media(data, *info)
+
+
+def media_from_message(message):
+    # (kind, mime type, file name) of a photo or video sent to the bot, else None
+    if message.photo:
+        return "photo", "image/jpeg", "advert.jpg"
+    if message.video:
+        document = message.video
+        name = next(
+            (a.file_name for a in document.attributes if isinstance(a, DocumentAttributeFilename)),
+            "advert.mp4",
+        )
+        return "video", document.mime_type or "video/mp4", name
+    return None
+
+
+# -------------------
+# Upload once, send everywhere
+# -------------------
+def _handle(media, peer, msg_id):
+    if isinstance(media, MessageMediaPhoto):
+        kind, file = "photo", media.photo
+    elif isinstance(media, MessageMediaDocument):
+        kind, file = "document", media.document
+    else:
+        return None
+    return {
+        "kind": kind,
+        "id": file.id,
+        "access_hash": file.access_hash,
+        "file_reference": base64.b64encode(file.file_reference).decode(),
+        "peer": [peer.channel_id, peer.access_hash] if isinstance(peer, InputPeerChannel) else peer,
+        "msg": msg_id,
+    }
+
+
+def _input_file(handle):
+    cls = InputPhoto if handle["kind"] == "photo" else InputDocument
+    return cls(handle["id"], handle["access_hash"], base64.b64decode(handle["file_reference"]))
+
+
+def _peer(handle):
+    peer = handle["peer"]
+    return InputPeerChannel(*peer) if isinstance(peer, list) else peer
+
+
+class MediaSender:
+    """Sends media adverts, uploading each file once per account.
+
+    The first send uploads the file; the photo or document Telegram creates for it
+    is cached in Redis and every later send only references it. An expired file
+    reference is refreshed by re-reading the message that carries the file, and
+    only when that fails is the file uploaded again.
+    """
+
+    def __init__(self):
+        self.locks = {}
+        self.uploads = 0
+
+    async def _get(self, account, media_id):
+        raw = await redis.hget(HANDLE_KEY.format(account), media_id)
+        return json.loads(raw) if raw else None
+
+    async def _remember(self, account, media_id, handle):
+        await redis.hset(HANDLE_KEY.format(account), media_id, json.dumps(handle))
+
+    async def _forget(self, account, media_id):
+        await redis.hdel(HANDLE_KEY.format(account), media_id)
+
+    async def _refresh(self, client, account, media_id, handle):
+        try:
+            with rpc("get_messages"):
+                message = await client.get_messages(_peer(handle), ids=handle["msg"])
+        except Exception:
+            return None
+        fresh = _handle(message.media, _peer(handle), handle["msg"]) if message else None
+        if fresh:
+            fresh["peer"] = handle["peer"]
+            await self._remember(account, media_id, fresh)
+        return fresh
+
+    async def _send_cached(self, client, account, media_id, handle, peer, caption):
+        # The sent message, or None when the handle is beyond repair
+        for attempt in range(2):
+            try:
+                with rpc("send_file"):
+                    return await client.send_file(peer, _input_file(handle), caption=caption)
+            except FILE_REFERENCE_ERRORS:
+                if attempt:
+                    break
+                handle = await self._refresh(client, account, media_id, handle)
+                if not handle:
+                    break
+            except HANDLE_ERRORS:
+                break
+        await self._forget(account, media_id)
+        return None
+
+    async def send(self, client, account, peer, media_id, caption):
+        handle = await self._get(account, media_id)
+        if handle:
+            message = await self._send_cached(client, account, media_id, handle, peer, caption)
+            if message:
+                return message
+
+        # One upload per account and file: concurrent sends wait for it, then reuse it
+        key = (account, media_id)
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            handle = await self._get(account, media_id)
+            if handle:
+                message = await self._send_cached(client, account, media_id, handle, peer, caption)
+                if message:
+                    return message
+
+            media = await load_media(media_id)
+            if not media:
+                raise ValueError(f"Media {media_id} no longer exists")
+            with rpc("upload_file"):
+                uploaded = await client.upload_file(media["data"], file_name=media["file_name"])
+            self.uploads += 1
+            with rpc("send_file"):
+                message = await client.send_file(
+                    peer,
+                    uploaded,
+                    caption=caption,
+                    mime_type=media["mime_type"],
+                    supports_streaming=media["kind"] == "video",
+                )
+            handle = _handle(message.media, peer, message.id)
+            if handle:
+                await self._remember(account, media_id, handle)
+        if not lock.locked():
+            self.locks.pop(key, None)
+        return message
+
+
+media_sender = MediaSender()
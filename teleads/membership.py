@@ -0,0 +1,95 @@
+import json
+from contextlib import contextmanager
+from telethon.errors import UserNotParticipantError
+from telethon.tl.functions.channels import JoinChannelRequest
+from telethon.tl.types import InputPeerChannel
+from telethon import utils
+from .config import MEMBERSHIP_TTL
+from .entities import META_KEY
+from .metrics import observe
+from .redis import redis
+
+MEMBER_KEY = "teleads:member:{}:{}"
+KICKED_KEY = "teleads:kicked:{}:{}"
+
+
+class RpcCounter:
+    # Telegram calls made on the send path, to check the cost of a post
+
+    def __init__(self):
+        self.calls = {}
+        self.posts = 0
+
+    def count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def post(self):
+        self.posts += 1
+
+    @property
+    def total(self):
+        return sum(self.calls.values())
+
+    def per_post(self):
+        return self.total / self.posts if self.posts else 0.0
+
+    def summary(self):
+        calls = ", ".join(f"{name} {n}" for name, n in sorted(self.calls.items()))
+        return f"{self.total} RPCs for {self.posts} posts ({self.per_post():.2f}/post): {calls or '-'}"
+
+
+rpc_counter = RpcCounter()
+
+
+@contextmanager
+def rpc(name):
+    # One Telegram call on the send path: counted per post and timed
+    rpc_counter.count(name)
+    with observe("telegram", name):
+        yield
+
+
+async def input_peer(client, ch_id, primary=True):
+    # Session cache first, then what the channel meta cache knows. Access hashes
+    # are per account, so the cached one only works for the primary account;
+    # the others resolve the channel by username once and keep it in their session.
+    try:
+        return await client.get_input_entity(int(ch_id))
+    except ValueError:
+        pass
+
+    raw = await redis.get(META_KEY.format(ch_id))
+    meta = json.loads(raw) if raw else {}
+    if primary and meta.get("access_hash") is not None:
+        real_id, _ = utils.resolve_id(int(ch_id))
+        return InputPeerChannel(real_id, meta["access_hash"])
+    if not primary and meta.get("username"):
+        with rpc("resolve_username"):
+            return await client.get_input_entity(meta["username"])
+
+    with rpc("get_entity"):
+        return utils.get_input_peer(await client.get_entity(int(ch_id)))
+
+
+async def ensure_member(client, account, ch_id, peer):
+    key = MEMBER_KEY.format(account, ch_id)
+    if await redis.get(key):
+        return
+
+    try:
+        with rpc("get_permissions"):
+            await client.get_permissions(peer, "me")
+    except (UserNotParticipantError, ValueError):
+        with rpc("join_channel"):
+            await client(JoinChannelRequest(peer))
+        print(f"Not in channel {ch_id}. Joined.")
+
+    await remember_member(account, ch_id)
+
+
+async def remember_member(account, ch_id):
+    await redis.set(MEMBER_KEY.format(account, ch_id), "1", ex=MEMBERSHIP_TTL)
+
+
+async def forget_member(account, ch_id):
+    await redis.delete(MEMBER_KEY.format(account, ch_id))
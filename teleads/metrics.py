@@ -0,0 +1,83 @@
+import functools
+import time
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from .config import METRICS_PORT
+
+# Telegram and Prisma calls take tens to hundreds of ms, Redis well under one
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+CALL_LATENCY = Histogram(
+    "teleads_call_seconds",
+    "Latency of calls to external systems",
+    ["system", "call"],
+    buckets=LATENCY_BUCKETS,
+)
+CALL_ERRORS = Counter(
+    "teleads_call_errors_total",
+    "Failed calls to external systems",
+    ["system", "call", "error"],
+)
+SCHEDULER_RUN = Histogram(
+    "teleads_scheduler_run_seconds",
+    "One scheduler pass: sync, plan and enqueue",
+    buckets=LATENCY_BUCKETS,
+)
+POSTS = Counter(
+    "teleads_posts_total",
+    "Posts by rule type and outcome (sent, failed, deferred)",
+    ["rule", "outcome"],
+)
+POSTS_SKIPPED = Counter(
+    "teleads_posts_skipped_total",
+    "Planned pairs not posted, by rule type and the policy or check that blocked them",
+    ["rule", "reason"],
+)
+FLOOD_SECONDS = Counter(
+    "teleads_flood_wait_seconds_total",
+    "Flood wait Telegram asked for, per account and scope (account or channel)",
+    ["account", "scope"],
+)
+HANDLER_LATENCY = Histogram(
+    "teleads_handler_seconds",
+    "Bot handler latency",
+    ["handler"],
+    buckets=LATENCY_BUCKETS,
+)
+STARTUP_PHASE = Gauge(
+    "teleads_startup_phase_seconds",
+    "Duration of each phase of the last startup; ready and warm are since process start",
+    ["phase"],
+)
+
+
+@contextmanager
+def observe(system, call):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        CALL_ERRORS.labels(system, call, type(e).__name__).inc()
+        raise
+    finally:
+        CALL_LATENCY.labels(system, call).observe(time.perf_counter() - started)
+
+
+def rule_kind(job):
+    return job.slot[2].kind if job.slot else "instant"
+
+
+def timed_handler(handler):
+    @functools.wraps(handler)
+    async def wrapper(event):
+        with HANDLER_LATENCY.labels(handler.__name__).time():
+            return await handler(event)
+
+    return wrapper
+
+
+def start_metrics_server():
+    # Prometheus scrape endpoint on /metrics; METRICS_PORT=0 turns it off
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+        print(f"📊 Metrics on :{METRICS_PORT}/metrics")
@@ -0,0 +1,162 @@
+import asyncio
+import re
+import time
+from telethon.errors import FloodWaitError, InviteRequestSentError, UserAlreadyParticipantError
+from telethon.tl.functions.channels import JoinChannelRequest
+from telethon.tl.functions.messages import CheckChatInviteRequest, ImportChatInviteRequest
+from telethon.tl.types import Channel, ChatInviteAlready
+from .config import ONBOARD_CONCURRENCY, ONBOARD_MAX_FLOOD_WAIT, ONBOARD_MAX_LINKS
+from .entities import meta_from_entity, store_channel_meta
+from .helpers import add_channels
+from .membership import remember_member
+from .metrics import observe
+
+# t.me/name, t.me/+hash, t.me/joinchat/hash, t.me/c/123 (private, by id) or @name
+LINK_RE = re.compile(
+    r"(?:https?://)?(?:t|telegram)\.me/(\+[\w-]+|joinchat/[\w-]+|c/\d+|[A-Za-z]\w{3,31})"
+    r"|(?<![\w@.])@([A-Za-z]\w{3,31})",
+    re.IGNORECASE,
+)
+
+# Files of links are small, anything bigger is not a list of links
+LINKS_FILE_MAX_BYTES = 1024 * 1024
+
+
+def parse_links(text):
+    # [(kind, value, link as written)], first occurrence of each channel reference
+    links = {}
+    for match in LINK_RE.finditer(text):
+        path, name = match.groups()
+        if name or not path.startswith(("+", "joinchat/", "c/")):
+            ref = ("username", (name or path).lower())
+        elif path.startswith("c/"):
+            ref = ("id", f"-100{path[2:]}")
+        else:
+            ref = ("invite", path.split("/", 1)[-1].lstrip("+"))
+        links.setdefault(ref, (*ref, match.group(0)))
+    return list(links.values())
+
+
+class Onboarding:
+    """Resolves and joins a batch of channel links, then adds them in one write.
+
+    Up to ONBOARD_CONCURRENCY links are resolved at once. A flood wait pauses
+    every worker, since Telegram applies it to the whole account; one longer than
+    ONBOARD_MAX_FLOOD_WAIT fails the links not resolved yet instead.
+    """
+
+    def __init__(self, client, account, links):
+        self.client = client
+        self.account = account
+        self.links = links[:ONBOARD_MAX_LINKS]
+        self.skipped = len(links) - len(self.links)
+        self.resolved = {}
+        self.failed = []
+        self.joined = 0
+        self.done = 0
+        self.paused_until = 0
+        self.gave_up = None
+        self.added = []
+        self.existing = []
+
+    async def _call(self, name, request):
+        # Telegram call that sits out flood waits shared by all workers
+        while True:
+            if self.gave_up:
+                raise self.gave_up
+            delay = self.paused_until - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            try:
+                with observe("telegram", name):
+                    return await request()
+            except FloodWaitError as e:
+                if e.seconds > ONBOARD_MAX_FLOOD_WAIT:
+                    self.gave_up = e
+                    raise
+                print(f"⚠️ Flood wait {e.seconds}s while adding channels, pausing.")
+                self.paused_until = max(self.paused_until, time.time() + e.seconds + 1)
+
+    async def _resolve(self, kind, value):
+        # (channel entity, whether this call joined it)
+        if kind == "invite":
+            invite = await self._call("check_chat_invite", lambda: self.client(CheckChatInviteRequest(value)))
+            if isinstance(invite, ChatInviteAlready):
+                return invite.chat, False
+            try:
+                updates = await self._call("import_chat_invite", lambda: self.client(ImportChatInviteRequest(value)))
+            except UserAlreadyParticipantError:
+                invite = await self._call("check_chat_invite", lambda: self.client(CheckChatInviteRequest(value)))
+                return invite.chat, False
+            return updates.chats[0], True
+
+        target = int(value) if kind == "id" else value
+        entity = await self._call("get_entity", lambda: self.client.get_entity(target))
+        if not isinstance(entity, Channel) or not getattr(entity, "left", False):
+            return entity, False
+        await self._call("join_channel", lambda: self.client(JoinChannelRequest(entity)))
+        return entity, True
+
+    async def _onboard(self, semaphore, kind, value, link):
+        async with semaphore:
+            try:
+                entity, joined = await self._resolve(kind, value)
+                if not isinstance(entity, Channel):
+                    raise ValueError("not a channel or supergroup")
+                # Same form as channels added before: -100 and the bare id
+                ch_id = f"-100{entity.id}"
+                await remember_member(self.account, ch_id)
+                self.joined += joined
+                self.resolved.setdefault(ch_id, (link, entity))
+            except InviteRequestSentError:
+                self.failed.append((link, "join request sent, add it again once approved"))
+            except FloodWaitError as e:
+                self.failed.append((link, f"flood wait {e.seconds}s, try again later"))
+            except Exception as e:
+                self.failed.append((link, str(e) or type(e).__name__))
+            finally:
+                self.done += 1
+
+    async def run(self):
+        semaphore = asyncio.Semaphore(ONBOARD_CONCURRENCY)
+        await asyncio.gather(*(self._onboard(semaphore, *link) for link in self.links))
+        await store_channel_meta(
+            {ch_id: meta_from_entity(entity) for ch_id, (_, entity) in self.resolved.items()}
+        )
+        self.added = await add_channels(self.resolved)
+        new = set(self.added)
+        self.existing = [ch_id for ch_id in self.resolved if ch_id not in new]
+        return self.added
+
+    def progress(self):
+        line = f"⏳ Adding channels: {self.done}/{len(self.links)} link(s) resolved"
+        wait = self.paused_until - time.time()
+        if wait > 0:
+            line += f", flood wait {wait:.0f}s"
+        return line
+
+    def report(self, limit=20):
+        lines = [
+            f"📥 {len(self.links)} link(s): ✅ {len(self.added)} added, "
+            f"⚠️ {len(self.existing)} already added, ❌ {len(self.failed)} failed"
+            + (f", 🔗 joined {self.joined}" if self.joined else "")
+        ]
+        duplicates = len(self.links) - len(self.failed) - len(self.resolved)
+        if duplicates:
+            lines.append(f"{duplicates} link(s) pointed at a channel listed twice")
+        if self.skipped:
+            lines.append(f"{self.skipped} link(s) over the limit of {ONBOARD_MAX_LINKS} were ignored")
+        if self.added:
+            lines.append("\nAdded:")
+            lines.extend(
+                f"• {getattr(self.resolved[ch][1], 'title', ch)}" for ch in self.added[:limit]
+            )
+            if len(self.added) > limit:
+                lines.append(f"... and {len(self.added) - limit} more")
+        if self.failed:
+            lines.append("\nFailed:")
+            lines.extend(f"• {link}: {reason}" for link, reason in self.failed[:limit])
+            if len(self.failed) > limit:
+                lines.append(f"... and {len(self.failed) - limit} more")
+        return "\n".join(lines)
@@ -0,0 +1,341 @@
+import asyncio
+import datetime
+import json
+import os
+import socket
+import time
+from collections import Counter
+from redis.exceptions import ResponseError
+from .config import (
+    OUTBOX_BATCH,
+    OUTBOX_CLAIM_IDLE,
+    OUTBOX_INFLIGHT_TTL,
+    OUTBOX_MAX_ATTEMPTS,
+)
+from .helpers import get_advert
+from .leader import LeaseLost
+from .metrics import POSTS_SKIPPED, rule_kind
+from .posting import PostJob
+from .redis import redis
+from .rules import rule_book
+from .scheduler import scheduler_now
+from .slots import claim_slots, load_slots, release_slots
+
+STREAM = "teleads:outbox"
+GROUP = "senders"
+DELAYED = "teleads:outbox:delayed"
+DEAD = "teleads:outbox:dead"
+DONE_KEY = "teleads:outbox:done:{}"
+INFLIGHT_KEY = "teleads:outbox:inflight:{}:{}"
+
+STREAM_MAXLEN = 100000
+DEAD_MAXLEN = 10000
+
+# Jobs per enqueue call, so one script never blocks Redis for long
+ENQUEUE_CHUNK = 500
+
+# Sets each pair's inflight key and adds its stream entry in one step, so a crash
+# or a cancelled task can't leave a pair in flight with nothing queued. With a
+# token (the scheduler leader) the fence is checked in the same script, so a
+# deposed leader can't queue anything after a failover.
+# KEYS: fence counter (unused without a token), stream, inflight keys...
+# ARGV: token or '', ttl, maxlen, fields...
+ENQUEUE = """
+if ARGV[1] ~= '' and tonumber(redis.call('GET', KEYS[1]) or '0') ~= tonumber(ARGV[1]) then
+    return -1
+end
+local queued = 0
+for i = 4, #ARGV do
+    if redis.call('SET', KEYS[i - 1], '1', 'NX', 'EX', ARGV[2]) then
+        local args = {KEYS[2], 'MAXLEN', '~', ARGV[3], '*'}
+        for name, value in pairs(cjson.decode(ARGV[i])) do
+            table.insert(args, name)
+            table.insert(args, tostring(value))
+        end
+        redis.call('XADD', unpack(args))
+        queued = queued + 1
+    end
+end
+return queued
+"""
+
+# Moves due delayed jobs back to the stream; removing and re-adding in one step
+# means a job is never in neither place, and only one replica re-queues it.
+# KEYS: delayed set, stream; ARGV: now, batch, maxlen
+PROMOTE = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, member in ipairs(due) do
+    redis.call('ZREM', KEYS[1], member)
+    local args = {KEYS[2], 'MAXLEN', '~', ARGV[3], '*'}
+    for name, value in pairs(cjson.decode(member)) do
+        table.insert(args, name)
+        table.insert(args, tostring(value))
+    end
+    redis.call('XADD', unpack(args))
+end
+return #due
+"""
+
+
+def _idempotency_key(ad_id, ch_id, planned_at):
+    return f"{ad_id}:{ch_id}:{int(planned_at.timestamp())}"
+
+
+def _fields(ad_id, ch_id, planned_at, key, attempt):
+    return {
+        "ad_id": ad_id,
+        "ch_id": ch_id,
+        "planned_at": planned_at,
+        "key": key,
+        "attempt": attempt,
+    }
+
+
+async def enqueue(jobs, lease=None):
+    # Scheduler side: turn planned jobs into stream entries. A pair that already
+    # has a job in flight is skipped, so overlapping runs can't queue it twice.
+    # With a lease the write is fenced and raises LeaseLost for a stale leader.
+    script = redis.register_script(ENQUEUE)
+    queued = 0
+    for start in range(0, len(jobs), ENQUEUE_CHUNK):
+        chunk = jobs[start : start + ENQUEUE_CHUNK]
+        if lease is not None and not lease.is_leader:
+            raise LeaseLost(lease.name)
+        keys = [lease.fence_key if lease else STREAM, STREAM]
+        args = [lease.token if lease else "", OUTBOX_INFLIGHT_TTL, STREAM_MAXLEN]
+        for job in chunk:
+            ad_id, ch_id, _, planned_at = job.slot
+            keys.append(INFLIGHT_KEY.format(ad_id, ch_id))
+            key = _idempotency_key(ad_id, ch_id, planned_at)
+            args.append(json.dumps(_fields(ad_id, ch_id, planned_at.isoformat(), key, 0)))
+        result = await script(keys=keys, args=args)
+        if result < 0:
+            raise LeaseLost(lease.name)
+        queued += result
+    return queued
+
+
+async def delivery(jobs):
+    # Where queued jobs stand: "sent" once a worker marked the job done, "waiting"
+    # while its pair is in flight (queued, sending or backing off), else "not sent"
+    # (skipped by a claim, dropped as a dead letter, or the pair was already in
+    # flight from an earlier job when it was planned)
+    counts = Counter()
+    for start in range(0, len(jobs), ENQUEUE_CHUNK):
+        pipe = redis.pipeline(transaction=False)
+        for job in jobs[start : start + ENQUEUE_CHUNK]:
+            ad_id, ch_id, _, planned_at = job.slot
+            pipe.exists(DONE_KEY.format(_idempotency_key(ad_id, ch_id, planned_at)))
+            pipe.exists(INFLIGHT_KEY.format(ad_id, ch_id))
+        results = await pipe.execute()
+        for done, inflight in zip(results[::2], results[1::2]):
+            counts["sent" if done else "waiting" if inflight else "not sent"] += 1
+    return counts
+
+
+async def stats():
+    pipe = redis.pipeline(transaction=False)
+    pipe.xlen(STREAM)
+    pipe.zcard(DELAYED)
+    pipe.xlen(DEAD)
+    pipe.xrevrange(DEAD, count=5)
+    length, delayed, dead, recent_dead = await pipe.execute()
+    try:
+        pending = (await redis.xpending(STREAM, GROUP))["pending"]
+    except ResponseError:
+        pending = 0
+    return {
+        "queued": length,
+        "pending": pending,
+        "delayed": delayed,
+        "dead": dead,
+        "recent_dead": recent_dead,
+    }
+
+
+class OutboxWorker:
+    # Sender side: consumes the stream through a consumer group, so several
+    # processes on different nodes share the work and a crashed consumer's
+    # entries are reclaimed after OUTBOX_CLAIM_IDLE seconds.
+
+    def __init__(self, engine, send, commit, account="user", consumer=None):
+        self.engine = engine
+        self.send = send
+        self.commit = commit
+        self.account = account
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+
+    async def ensure_group(self):
+        try:
+            await redis.xgroup_create(STREAM, GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def _promote_delayed(self):
+        await redis.register_script(PROMOTE)(
+            keys=[DELAYED, STREAM], args=[time.time(), OUTBOX_BATCH, STREAM_MAXLEN]
+        )
+
+    async def _delay(self, fields, ready_at):
+        await redis.zadd(DELAYED, {json.dumps(fields, sort_keys=True): ready_at})
+
+    async def _park(self, entry_id, fields, ready_at):
+        # Off the stream and into the delayed set; the pair stays in flight
+        await self._delay(fields, ready_at)
+        pipe = redis.pipeline(transaction=False)
+        pipe.xack(STREAM, GROUP, entry_id)
+        pipe.xdel(STREAM, entry_id)
+        await pipe.execute()
+
+    async def _read(self):
+        entries = []
+        _, claimed, *_ = await redis.xautoclaim(
+            STREAM,
+            GROUP,
+            self.consumer,
+            min_idle_time=OUTBOX_CLAIM_IDLE * 1000,
+            start_id="0-0",
+            count=OUTBOX_BATCH,
+        )
+        entries.extend(entry for entry in claimed if entry[1])
+
+        response = await redis.xreadgroup(
+            GROUP,
+            self.consumer,
+            {STREAM: ">"},
+            count=OUTBOX_BATCH,
+            block=5000,
+        )
+        for _, stream_entries in response or []:
+            entries.extend(stream_entries)
+        return entries
+
+    async def _finish(self, entry_id, fields, done=False):
+        pipe = redis.pipeline(transaction=False)
+        if done:
+            pipe.set(DONE_KEY.format(fields["key"]), "1", ex=OUTBOX_INFLIGHT_TTL)
+        pipe.delete(INFLIGHT_KEY.format(fields["ad_id"], fields["ch_id"]))
+        pipe.xack(STREAM, GROUP, entry_id)
+        pipe.xdel(STREAM, entry_id)
+        await pipe.execute()
+
+    async def _requeue(self, entry_id, fields, reason, permanent=False):
+        attempt = int(fields.get("attempt", 0)) + 1
+        fields = dict(fields, attempt=attempt, error=reason)
+        if permanent or attempt >= OUTBOX_MAX_ATTEMPTS:
+            await redis.xadd(DEAD, fields, maxlen=DEAD_MAXLEN, approximate=True)
+            await self._finish(entry_id, fields)
+            print(f"💀 Outbox job {fields['key']} moved to dead letters: {reason}")
+            return
+
+        # Back off a little more on every attempt
+        await self._park(entry_id, fields, time.time() + 60 * attempt)
+
+    async def _recheck(self, jobs, by_job):
+        # The rules are checked again at send time: a job back from a flood
+        # deferral or a retry may be hours late, outside its window or inside a
+        # gap since the last post. Eligible jobs are re-stamped with now, so the
+        # claim and the bookkeeping use the real send time, not the planned one.
+        if not jobs:
+            return []
+        now = scheduler_now()
+        states = await load_slots([job.slot[:2] for job in jobs], now)
+        ready = []
+        for job in jobs:
+            ad_id, ch_id, rule, _ = job.slot
+            when = rule.next_eligible(job.ad, states[(ad_id, ch_id)], now)
+            if when == now:
+                job.slot = (ad_id, ch_id, rule, now)
+                ready.append(job)
+                continue
+            POSTS_SKIPPED.labels(rule.kind, "stale").inc()
+            if when is None:
+                await self._finish(*by_job[id(job)])
+            else:
+                await self._park(*by_job[id(job)], when.timestamp())
+        return ready
+
+    async def process(self, entries):
+        if not entries:
+            return None
+
+        done = await redis.mget([DONE_KEY.format(fields["key"]) for _, fields in entries])
+        await rule_book.refresh()
+
+        jobs, by_job = [], {}
+        for (entry_id, fields), already_sent in zip(entries, done):
+            if already_sent:
+                # Sent before a crash or redelivery, just acknowledge it
+                await self._finish(entry_id, fields)
+                continue
+
+            ad = await get_advert(fields["ad_id"])
+            if not ad or not ad["active"]:
+                await self._finish(entry_id, fields)
+                continue
+
+            planned_at = datetime.datetime.fromisoformat(fields["planned_at"])
+            job = PostJob(
+                fields["ch_id"],
+                ad,
+                slot=(ad["id"], fields["ch_id"], rule_book.get(fields["ch_id"]), planned_at),
+            )
+            jobs.append(job)
+            by_job[id(job)] = (entry_id, fields)
+        jobs = await self._recheck(jobs, by_job)
+
+        # Claim the slots right before sending; a slot already taken (another
+        # sender, an overlapping run, a send that crashed before its write) or a
+        # full cap drops the job instead of posting it twice
+        claimed = await claim_slots(jobs)
+        taken = set(map(id, claimed))
+        for job in jobs:
+            if id(job) not in taken:
+                POSTS_SKIPPED.labels(rule_kind(job), "claimed").inc()
+                await self._finish(*by_job[id(job)])
+        jobs = claimed
+
+        results = {}
+
+        async def on_result(job, ok):
+            results[id(job)] = ok
+
+        async def on_defer(job, until):
+            entry_id, fields = by_job[id(job)]
+            results[id(job)] = None
+            await release_slots([job])
+            await self._park(entry_id, fields, until)
+
+        stats = await self.engine.run(
+            jobs,
+            self.send,
+            label="outbox",
+            account=self.account,
+            on_result=on_result,
+            on_defer=on_defer,
+            commit=self.commit,
+        )
+
+        await release_slots([job for job in jobs if results.get(id(job)) is False])
+        for job in jobs:
+            entry_id, fields = by_job[id(job)]
+            ok = results.get(id(job))
+            if ok:
+                await self._finish(entry_id, fields, done=True)
+            elif ok is False:
+                await self._requeue(entry_id, fields, job.error or "send failed", job.permanent)
+        return stats
+
+    async def run(self):
+        await self.ensure_group()
+        print(f"📬 Outbox worker {self.consumer} started.")
+        while True:
+            try:
+                await self._promote_delayed()
+                await self.process(await self._read())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Outbox worker error: {e}")
+                await asyncio.sleep(5)
@@ -0,0 +1,248 @@
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from .config import (
+    ACCOUNT_BURST,
+    ACCOUNT_RATE,
+    CHANNEL_BURST,
+    CHANNEL_RATE,
+    POST_CONCURRENCY,
+)
+from .floodwait import AccountUnavailable, FloodDeferred, SendFailed, flood_table, retry_queue
+from .ledger import post_ledger
+from .metrics import POSTS, rule_kind
+
+
+class TokenBucket:
+    # A rate of 0 or less means no limit
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        # The lock keeps waiters in FIFO order
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+@dataclass
+class PostJob:
+    ch_id: str
+    ad: dict
+    # Rule bookkeeping for scheduled posts: (ad_id, ch_id, rule, planned_at)
+    slot: tuple = None
+    # Owner token of the slot claim taken before sending, see slots.claim_slots
+    claim: str = None
+    # Why the last send failed, and whether retrying can't help
+    error: str = None
+    permanent: bool = False
+
+
+@dataclass
+class Posted:
+    # What a send function returns when another account (the bot) posted instead
+    message: object
+    account: str
+
+
+@dataclass
+class RunStats:
+    label: str
+    jobs: int = 0
+    sent: int = 0
+    failed: int = 0
+    deferred: int = 0
+    started: float = field(default_factory=time.monotonic)
+    elapsed: float = 0.0
+
+    @property
+    def throughput(self):
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return (
+            f"{self.label}: {self.sent}/{self.jobs} sent, {self.failed} failed, "
+            f"{self.deferred} deferred "
+            f"in {self.elapsed:.1f}s ({self.throughput:.2f} posts/s)"
+        )
+
+
+class PostingEngine:
+    def __init__(
+        self,
+        concurrency=POST_CONCURRENCY,
+        account_rate=ACCOUNT_RATE,
+        account_burst=ACCOUNT_BURST,
+        channel_rate=CHANNEL_RATE,
+        channel_burst=CHANNEL_BURST,
+        pool=None,
+    ):
+        self.concurrency = concurrency
+        self.account_rate = account_rate
+        self.account_burst = account_burst
+        self.channel_rate = channel_rate
+        self.channel_burst = channel_burst
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.account_buckets = {}
+        self.channel_buckets = {}
+        self.history = deque(maxlen=20)
+        # Optional AccountPool; when set, each job picks its account from the pool
+        self.pool = pool
+
+    def account_bucket(self, account):
+        if account not in self.account_buckets:
+            self.account_buckets[account] = TokenBucket(self.account_rate, self.account_burst)
+        return self.account_buckets[account]
+
+    def channel_bucket(self, ch_id):
+        if ch_id not in self.channel_buckets:
+            self.channel_buckets[ch_id] = TokenBucket(self.channel_rate, self.channel_burst)
+        return self.channel_buckets[ch_id]
+
+    async def _defer(self, job, send, account, commit, on_defer, stats, until):
+        stats.deferred += 1
+        POSTS.labels(rule_kind(job), "deferred").inc()
+        if on_defer:
+            await on_defer(job, until)
+        else:
+            retry_queue.defer(until, job, send, account, commit)
+
+    async def _route(self, job, account, tried):
+        # Without a pool every job goes out through the run's account
+        ch_id = str(job.ch_id)
+        if not self.pool:
+            if tried:
+                return None, None
+            return account, flood_table.blocked_until(account, ch_id)
+        picked = await self.pool.pick(ch_id, exclude=tried)
+        if picked is None:
+            return None, self.pool.available_at(ch_id)
+        return picked, None
+
+    async def _post(self, job, send, account, commit, on_defer, stats, sent, on_result):
+        tried = set()
+        while True:
+            picked, until = await self._route(job, account, tried)
+            if picked is None or until:
+                # Every account is under a flood ban for this channel: park the job
+                # without touching Telegram. No account at all means it can't be sent.
+                if until:
+                    await self._defer(job, send, account, commit, on_defer, stats, until)
+                    return
+                ok = False
+                break
+
+            # Wait for the channel and the account first, so a busy channel or a
+            # rate-limited account doesn't hold a send slot while it sleeps
+            await self.channel_bucket(str(job.ch_id)).acquire()
+            await self.account_bucket(picked).acquire()
+            async with self.semaphore:
+                deferred_until = None
+                message_id = error = None
+                started = time.perf_counter()
+                posted_as = picked
+                try:
+                    # send returns the sent message (or True), falsy on failure
+                    result = await send(job.ch_id, job.ad, picked)
+                    if isinstance(result, Posted):
+                        posted_as, result = result.account, result.message
+                    ok = bool(result)
+                    message_id = getattr(result, "id", None)
+                except FloodDeferred as e:
+                    deferred_until = e.until
+                except AccountUnavailable:
+                    ok = None
+                except SendFailed as e:
+                    ok = False
+                    error = job.error = e.error
+                    job.permanent = e.permanent
+                except Exception as e:
+                    print(f"Failed to send ad {job.ad['id']} to {job.ch_id}: {e}")
+                    ok = False
+                    error = job.error = type(e).__name__
+                outcome = (
+                    "deferred" if deferred_until
+                    else "unavailable" if ok is None
+                    else "sent" if ok
+                    else "failed"
+                )
+                post_ledger.record(
+                    job.ad["id"], job.ch_id, posted_as, outcome,
+                    time.perf_counter() - started, message_id, error,
+                )
+
+            if deferred_until or ok is None:
+                # Try the next account in the pool; parked outside the semaphore
+                # so the send slot is free again
+                tried.add(picked)
+                if self.pool:
+                    self.pool.accounts[picked].failovers += 1
+                    continue
+                if deferred_until:
+                    await self._defer(job, send, account, commit, on_defer, stats, deferred_until)
+                    return
+                ok = False
+            if self.pool and posted_as == picked:
+                self.pool.record(picked, ok)
+            break
+
+        if ok:
+            stats.sent += 1
+            sent.append(job)
+        else:
+            stats.failed += 1
+        POSTS.labels(rule_kind(job), "sent" if ok else "failed").inc()
+        if on_result:
+            await on_result(job, ok)
+
+    async def run(
+        self,
+        jobs,
+        send,
+        label="run",
+        account="user",
+        on_result=None,
+        commit=None,
+        on_defer=None,
+    ):
+        # commit, if given, receives every successfully sent job in one call at the end;
+        # on_defer replaces the in-process retry queue for flood-deferred jobs.
+        # send is called as send(ch_id, ad, account).
+        jobs = list(jobs)
+        stats = RunStats(label=label, jobs=len(jobs))
+        sent = []
+        if jobs:
+            await flood_table.load()
+        await asyncio.gather(
+            *(
+                self._post(job, send, account, commit, on_defer, stats, sent, on_result)
+                for job in jobs
+            )
+        )
+        if commit and sent:
+            await commit(sent)
+        stats.elapsed = time.monotonic() - stats.started
+        self.history.append(stats)
+        if jobs:
+            print(f"📈 {stats.summary()}")
+        return stats
+
+
+engine = PostingEngine()
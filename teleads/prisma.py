@@ -1,3 +1,15 @@
 from prisma import Prisma
+from .metrics import observe
 
-db = Prisma(auto_register=True)
+
+class InstrumentedPrisma(Prisma):
+    # All queries, raw ones and those inside transactions, go through _execute
+    async def _execute(self, *, method, arguments, model=None, root_selection=None):
+        call = f"{model.__name__.lower()}.{method}" if model else method
+        with observe("prisma", call):
+            return await super()._execute(
+                method=method, arguments=arguments, model=model, root_selection=root_selection
+            )
+
+
+db = InstrumentedPrisma(auto_register=True)
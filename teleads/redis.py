@@ -1,10 +1,36 @@
-from redis import Redis
-from .config import REDIS_HOST, REDIS_PASS, REDIS_PORT, REDIS_USER
+from redis.asyncio import ConnectionPool, Redis
+from redis.asyncio.client import Pipeline
+from .config import REDIS_HOST, REDIS_MAX_CONNECTIONS, REDIS_PASS, REDIS_PORT, REDIS_USER
+from .metrics import observe
 
-redis = Redis(
+
+class InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error=True):
+        with observe("redis", "PIPELINE"):
+            return await super().execute(raise_on_error)
+
+
+class InstrumentedRedis(Redis):
+    # Every command and pipeline round trip lands in the call latency histogram
+
+    async def execute_command(self, *args, **options):
+        with observe("redis", str(args[0]).upper()):
+            return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(
+            self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
+
+
+# Shared pool for every coroutine on the event loop; connections are opened lazily
+pool = ConnectionPool(
     host=REDIS_HOST,
     port=int(REDIS_PORT),
     username=REDIS_USER,
     password=REDIS_PASS,
     decode_responses=True,
+    max_connections=REDIS_MAX_CONNECTIONS,
 )
+
+redis = InstrumentedRedis(connection_pool=pool)
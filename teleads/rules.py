@@ -0,0 +1,291 @@
+import datetime
+import json
+from functools import lru_cache
+import pytz
+from .config import CHANNEL_RULES
+from .redis import redis
+
+TZ = pytz.timezone("Europe/Vilnius")
+
+RULES_KEY = "teleads:rules"
+RULES_VERSION_KEY = "teleads:rules:version"
+RULES_SEEDED_KEY = "teleads:rules:seeded"
+
+# Day and week counters are kept a day past the period they count
+DAY_RETENTION = 2 * 24 * 3600
+WEEK_RETENTION = 8 * 24 * 3600
+
+
+@lru_cache(maxsize=4096)
+def parse_schedule(schedule_str):
+    try:
+        hours, tz = schedule_str.split()
+        start, end = map(int, hours.split("-"))
+        offset = int(tz.replace("GMT", ""))
+        return start, end, offset
+    except Exception:
+        return None
+
+
+def _at(day, hour):
+    day += datetime.timedelta(days=hour // 24)
+    return TZ.localize(datetime.datetime.combine(day, datetime.time(hour % 24)))
+
+
+def _next_in_window(t, start, end):
+    # First instant at or after t whose hour falls in [start, end)
+    if start >= end:
+        return None
+    if start <= t.hour < end:
+        return t
+    if t.hour < start:
+        return _at(t.date(), start)
+    return _at(t.date() + datetime.timedelta(days=1), start)
+
+
+# -------------------
+# Policies
+# -------------------
+# Each policy answers one question: the earliest instant at or after t it allows
+# a post, given the slot state (None when it never will).
+
+
+class WindowPolicy:
+    name = "window"
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+    def next_open(self, ad, state, t):
+        return _next_in_window(t, self.start, self.end)
+
+
+class AdSchedulePolicy:
+    name = "schedule"
+
+    def next_open(self, ad, state, t):
+        parsed = parse_schedule(ad["schedule"])
+        if not parsed:
+            return None
+        start, end, _ = parsed
+        return _next_in_window(t, start, end)
+
+
+class MaxLengthPolicy:
+    name = "max_length"
+
+    def __init__(self, max_length):
+        self.max_length = max_length
+
+    def next_open(self, ad, state, t):
+        return t if len(ad["content"]) <= self.max_length else None
+
+
+class DailyCapPolicy:
+    name = "daily_cap"
+
+    def __init__(self, max_posts):
+        self.max_posts = max_posts
+
+    def next_open(self, ad, state, t):
+        if t.date() == state.day and state.day_count >= self.max_posts:
+            return _at(t.date() + datetime.timedelta(days=1), 0)
+        return t
+
+
+class WeeklyCapPolicy:
+    name = "weekly_cap"
+
+    def __init__(self, max_posts):
+        self.max_posts = max_posts
+
+    def next_open(self, ad, state, t):
+        if t.isocalendar()[:2] == state.week and state.week_count >= self.max_posts:
+            monday = t.date() + datetime.timedelta(days=7 - t.weekday())
+            return _at(monday, 0)
+        return t
+
+
+class HourBlockPolicy:
+    name = "hour_block"
+
+    def __init__(self, by_hours):
+        self.by_hours = max(1, by_hours)
+
+    def next_open(self, ad, state, t):
+        last = state.last
+        if not last:
+            return t
+        when = t
+        # One post per block of by_hours hours, blocks restart at midnight
+        if last.date() == t.date() and last.hour // self.by_hours == t.hour // self.by_hours:
+            when = _at(t.date(), (t.hour // self.by_hours + 1) * self.by_hours)
+        # ...and never closer than by_hours to the previous post
+        return max(when, last + datetime.timedelta(hours=self.by_hours))
+
+
+class OncePerHourPolicy:
+    name = "once_per_hour"
+
+    def next_open(self, ad, state, t):
+        last = state.last
+        if last and last.date() == t.date() and last.hour == t.hour:
+            return _at(t.date(), t.hour + 1)
+        return t
+
+
+class CompiledRule:
+    def __init__(self, kind, policies, spec):
+        self.kind = kind
+        self.policies = policies
+        self.spec = spec
+        self.day_cap = next((p.max_posts for p in policies if isinstance(p, DailyCapPolicy)), 0)
+        self.week_cap = next((p.max_posts for p in policies if isinstance(p, WeeklyCapPolicy)), 0)
+        self.tracks_day = bool(self.day_cap)
+        self.tracks_week = bool(self.week_cap)
+        self.block_hours = next(
+            (p.by_hours for p in policies if isinstance(p, HourBlockPolicy)), 1
+        )
+        # How long a pair's slot state matters after a post: past this, a missing
+        # state and the stored one lead to the same decisions
+        self.retention = max(
+            self.window_ttl,
+            DAY_RETENTION if self.tracks_day else 0,
+            WEEK_RETENTION if self.tracks_week else 0,
+        )
+
+    @property
+    def window_ttl(self):
+        return (self.block_hours + 1) * 3600
+
+    def window(self, t):
+        # The slot a post at t takes: (id, seconds until it surely ended).
+        # Hour blocks for hourly rules, the clock hour for everything else.
+        start = t.hour // self.block_hours * self.block_hours
+        return f"{t.date()}:{start}", self.window_ttl
+
+    def blocked_by(self, ad, state, now):
+        for policy in self.policies:
+            if policy.next_open(ad, state, now) != now:
+                return policy.name
+        return None
+
+    def next_eligible(self, ad, state, now):
+        t = now
+        # Push t forward until every policy agrees; a handful of rounds always settles
+        for _ in range(16):
+            moved = False
+            for policy in self.policies:
+                when = policy.next_open(ad, state, t)
+                if when is None:
+                    return None
+                if when > t:
+                    t = when
+                    moved = True
+            if not moved:
+                return t
+        return None
+
+
+def compile_rule(spec):
+    spec = dict(spec)
+    kind = spec.get("type", "normal")
+    policies = []
+
+    if kind == "barcelona":
+        policies.append(WindowPolicy(int(spec["start"]), int(spec["end"])))
+        policies.append(MaxLengthPolicy(int(spec["max_length"])))
+        policies.append(DailyCapPolicy(int(spec["max_posts_per_day"])))
+        policies.append(OncePerHourPolicy())
+    elif kind == "ltgrupe":
+        policies.append(WeeklyCapPolicy(int(spec.get("max_posts_per_week", 1))))
+        policies.append(WindowPolicy(int(spec["daytime_start"]), int(spec["daytime_end"])))
+    elif kind == "hourly":
+        policies.append(HourBlockPolicy(int(spec.get("by_hours", 1))))
+    elif kind == "custom":
+        # Any combination of the building blocks above
+        if "start" in spec or "end" in spec:
+            policies.append(WindowPolicy(int(spec.get("start", 0)), int(spec.get("end", 24))))
+        else:
+            policies.append(AdSchedulePolicy())
+        if "max_length" in spec:
+            policies.append(MaxLengthPolicy(int(spec["max_length"])))
+        if "max_posts_per_day" in spec:
+            policies.append(DailyCapPolicy(int(spec["max_posts_per_day"])))
+        if "max_posts_per_week" in spec:
+            policies.append(WeeklyCapPolicy(int(spec["max_posts_per_week"])))
+        if "by_hours" in spec:
+            policies.append(HourBlockPolicy(int(spec["by_hours"])))
+        else:
+            policies.append(OncePerHourPolicy())
+    elif kind == "normal":
+        policies.append(AdSchedulePolicy())
+        policies.append(OncePerHourPolicy())
+    else:
+        raise ValueError(f"Unknown rule type: {kind}")
+
+    return CompiledRule(kind, policies, spec)
+
+
+DEFAULT_RULE = compile_rule({"type": "normal"})
+
+
+# -------------------
+# Rule book
+# -------------------
+class RuleBook:
+    # Compiled rules per channel, reloaded whenever the Redis version stamp moves
+
+    def __init__(self):
+        self.rules = {}
+        self.version = None
+
+    def get(self, ch_id):
+        return self.rules.get(str(ch_id), DEFAULT_RULE)
+
+    def specs(self):
+        return {ch: rule.spec for ch, rule in self.rules.items()}
+
+    async def _seed(self):
+        # First start: copy the rules that used to be hard-coded in config.py
+        if CHANNEL_RULES and await redis.set(RULES_SEEDED_KEY, "1", nx=True):
+            await redis.hset(
+                RULES_KEY,
+                mapping={ch: json.dumps(spec) for ch, spec in CHANNEL_RULES.items()},
+            )
+            await redis.incr(RULES_VERSION_KEY)
+
+    async def refresh(self):
+        version = await redis.get(RULES_VERSION_KEY)
+        if version is None:
+            await self._seed()
+            version = await redis.get(RULES_VERSION_KEY) or "0"
+        if self.version is not None and version == self.version:
+            return False
+
+        rules = {}
+        for ch, raw in (await redis.hgetall(RULES_KEY)).items():
+            try:
+                rules[ch] = compile_rule(json.loads(raw))
+            except Exception as e:
+                print(f"❌ Invalid rule for {ch}, using default: {e}")
+        self.rules = rules
+        self.version = version
+        return True
+
+    async def set_rule(self, ch_id, spec):
+        compiled = compile_rule(spec)  # raises on invalid specs
+        await redis.hset(RULES_KEY, str(ch_id), json.dumps(compiled.spec))
+        await redis.incr(RULES_VERSION_KEY)
+        await self.refresh()
+        return compiled
+
+    async def delete_rule(self, ch_id):
+        removed = await redis.hdel(RULES_KEY, str(ch_id))
+        await redis.incr(RULES_VERSION_KEY)
+        await self.refresh()
+        return bool(removed)
+
+
+rule_book = RuleBook()
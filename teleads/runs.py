@@ -0,0 +1,158 @@
+import asyncio
+import time
+from collections import Counter
+from .config import SCHEDULER_RUN_CHUNK, SCHEDULER_RUN_FOLLOW
+from .helpers import get_adverts, get_channels
+from .outbox import delivery, enqueue
+from .scheduler import plan_posts, scheduler_now
+
+# Seconds between delivery checks while a run's posts go out
+DELIVERY_POLL = 2
+
+STATE_ICONS = {
+    "planning": "⚙️",
+    "sending": "📤",
+    "done": "✅",
+    "cancelled": "🛑",
+    "failed": "❌",
+}
+
+
+class SchedulerRun:
+    """One manual pass over every active advert and its channels, as a task.
+
+    Pairs are planned and queued SCHEDULER_RUN_CHUNK at a time so the counters
+    move while it runs; with follow the run then watches the outbox send its posts
+    for up to SCHEDULER_RUN_FOLLOW seconds. Cancelling stops planning between
+    chunks, never inside an enqueue; posts already queued still go out.
+    """
+
+    def __init__(self, follow=True, on_planned=None):
+        self.follow = follow
+        self.on_planned = on_planned
+        self.state = "planning"
+        self.started_at = time.time()
+        self.finished_at = None
+        self.pairs = 0
+        self.evaluated = 0
+        self.queued = 0
+        self.errors = 0
+        self.last_error = None
+        self.delivery = Counter()
+        self.jobs = []
+        self.cancelled = False
+        self.planned = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+
+    @property
+    def running(self):
+        return not self.task.done()
+
+    async def _plan(self, now):
+        adverts, all_channels = await asyncio.gather(get_adverts(), get_channels())
+        pairs = [
+            (ad, ch)
+            for ad in adverts
+            if ad["active"]
+            for ch in ad.get("channels") or all_channels
+        ]
+        self.pairs = len(pairs)
+        for start in range(0, len(pairs), SCHEDULER_RUN_CHUNK):
+            if self.cancelled:
+                return
+            chunk = pairs[start : start + SCHEDULER_RUN_CHUNK]
+            try:
+                jobs = await plan_posts([(ad, [ch]) for ad, ch in chunk], now)
+                self.queued += await enqueue(jobs)
+                self.jobs.extend(jobs)
+            except Exception as e:
+                # One bad chunk doesn't stop the rest of the run
+                self.errors += len(chunk)
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"❌ Scheduler run failed for {len(chunk)} pair(s): {e}")
+            self.evaluated += len(chunk)
+
+    async def _follow(self):
+        deadline = time.monotonic() + SCHEDULER_RUN_FOLLOW
+        while self.jobs:
+            self.delivery = await delivery(self.jobs)
+            if not self.delivery["waiting"] or time.monotonic() >= deadline:
+                return
+            await asyncio.sleep(DELIVERY_POLL)
+
+    async def _run(self):
+        try:
+            await self._plan(scheduler_now())
+            if self.on_planned:
+                self.on_planned()
+            self.planned.set()
+            if self.cancelled:
+                self.state = "cancelled"
+                return
+            if self.follow:
+                self.state = "sending"
+                await self._follow()
+            self.state = "done"
+        except asyncio.CancelledError:
+            self.state = "cancelled"
+        except Exception as e:
+            self.state = "failed"
+            self.last_error = f"{type(e).__name__}: {e}"
+            print(f"❌ Scheduler run failed: {e}")
+        finally:
+            self.finished_at = time.time()
+            self.planned.set()
+
+    def cancel(self):
+        if not self.running:
+            return False
+        self.cancelled = True
+        # Following only reads, so that part can stop right away
+        if self.state == "sending":
+            self.task.cancel()
+        return True
+
+    async def wait_planned(self):
+        # Queued posts once planning is over (or the run stopped early)
+        await self.planned.wait()
+        return self.queued
+
+    def summary(self):
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        lines = [
+            f"{STATE_ICONS[self.state]} Scheduler run: {self.state} ({elapsed:.0f}s)",
+            f"Pairs evaluated: {self.evaluated}/{self.pairs}",
+            f"Posts queued: {self.queued}",
+        ]
+        if self.delivery:
+            lines.append(
+                f"Sent: {self.delivery['sent']}, waiting: {self.delivery['waiting']}, "
+                f"not sent: {self.delivery['not sent']}"
+            )
+        if self.errors or self.last_error:
+            lines.append(f"Errors: {self.errors} pair(s), last: {self.last_error}")
+        return "\n".join(lines)
+
+
+class SchedulerRuns:
+    # Single flight: asking for a run while one is going joins it instead of
+    # starting a second pass over the same pairs
+
+    def __init__(self):
+        self.current = None
+        self.on_planned = None
+
+    @property
+    def running(self):
+        return self.current is not None and self.current.running
+
+    def start(self, follow=True):
+        if not self.running:
+            self.current = SchedulerRun(follow, self.on_planned)
+        return self.current
+
+    def cancel(self):
+        return self.running and self.current.cancel()
+
+
+scheduler_runs = SchedulerRuns()
@@ -0,0 +1,207 @@
+import asyncio
+import datetime
+import heapq
+from .config import SCHEDULER_MAX_SLEEP, SCHEDULER_MIN_RECHECK
+from .helpers import get_adverts, get_channels
+from .leader import LeaseLost
+from .metrics import POSTS_SKIPPED, SCHEDULER_RUN
+from .posting import PostJob
+from .rules import TZ, rule_book
+from .slots import load_slots
+
+
+def scheduler_now():
+    return datetime.datetime.now(TZ)
+
+
+# -------------------
+# Rule evaluation
+# -------------------
+async def plan_posts(targets, now):
+    # targets: [(ad, channels)]. State for every pair is fetched up front in one
+    # pipeline, then all rules are evaluated in memory.
+    await rule_book.refresh()
+    pairs = [
+        (ad, str(ch))
+        for ad, channels in targets
+        if ad["active"]
+        for ch in channels
+    ]
+    states = await load_slots([(ad["id"], ch) for ad, ch in pairs], now)
+
+    jobs = []
+    for ad, ch in pairs:
+        rule = rule_book.get(ch)
+        blocked = rule.blocked_by(ad, states[(ad["id"], ch)], now)
+        if blocked:
+            POSTS_SKIPPED.labels(rule.kind, blocked).inc()
+            continue
+        jobs.append(PostJob(ch, ad, slot=(ad["id"], ch, rule, now)))
+    return jobs
+
+
+async def next_eligible_many(pairs, now):
+    # pairs: [(ad, ch)] -> {(ad_id, ch): next eligible datetime or None}
+    states = await load_slots([(ad["id"], str(ch)) for ad, ch in pairs], now)
+    result = {}
+    for ad, ch in pairs:
+        key = (ad["id"], str(ch))
+        if not ad["active"]:
+            result[key] = None
+        else:
+            result[key] = rule_book.get(ch).next_eligible(ad, states[key], now)
+    return result
+
+
+# -------------------
+# Event-driven scheduler
+# -------------------
+def _fingerprint(ad, channels):
+    return (ad["active"], ad["content"], ad["schedule"], tuple(channels))
+
+
+class Scheduler:
+    # Keeps (next eligible time, ad, channel) in a heap and sleeps until the nearest one.
+    # Heap entries carry a generation; rescheduling a pair bumps it so old entries are skipped.
+
+    def __init__(self):
+        self.heap = []
+        self.generations = {}
+        self.pairs = {}
+        self.snapshot = {}
+        self.dirty = set()
+        self.full_rebuild = True
+        self.wakeup = asyncio.Event()
+
+    def invalidate_ad(self, ad_id):
+        self.dirty.add(ad_id)
+        self.wakeup.set()
+
+    def invalidate_all(self):
+        self.full_rebuild = True
+        self.wakeup.set()
+
+    def _drop_ad(self, ad_id):
+        for ch in self.pairs.pop(ad_id, ()):
+            self.generations.pop((ad_id, ch), None)
+        self.snapshot.pop(ad_id, None)
+
+    async def _schedule_pairs(self, pairs, now, not_before=None):
+        # pairs: [(ad, ch)]; not_before: {(ad_id, ch): earliest allowed datetime}
+        not_before = not_before or {}
+        eligible = await next_eligible_many(pairs, now)
+        for ad, ch in pairs:
+            key = (ad["id"], ch)
+            generation = self.generations.get(key, 0) + 1
+            self.generations[key] = generation
+            self.pairs.setdefault(ad["id"], set()).add(ch)
+
+            when = eligible[key]
+            if when is None:
+                continue
+            if key in not_before and when < not_before[key]:
+                when = not_before[key]
+            heapq.heappush(self.heap, (when.timestamp(), generation, ad["id"], ch))
+
+    async def sync(self, now):
+        if await rule_book.refresh():
+            # Rules changed (here or on another replica), every pair may move
+            self.full_rebuild = True
+        adverts = await get_adverts()
+        all_channels = None
+        if self.full_rebuild:
+            self.heap.clear()
+            self.generations.clear()
+            self.pairs.clear()
+            self.snapshot.clear()
+            self.full_rebuild = False
+
+        seen = set()
+        changed = []
+        for ad in adverts:
+            seen.add(ad["id"])
+            channels = ad.get("channels")
+            if not channels:
+                if all_channels is None:
+                    all_channels = await get_channels()
+                channels = all_channels
+            channels = [str(ch) for ch in channels]
+
+            fingerprint = _fingerprint(ad, channels)
+            if ad["id"] not in self.dirty and self.snapshot.get(ad["id"]) == fingerprint:
+                continue
+
+            self._drop_ad(ad["id"])
+            self.snapshot[ad["id"]] = fingerprint
+            changed.extend((ad, ch) for ch in channels)
+
+        if changed:
+            await self._schedule_pairs(changed, now)
+
+        for ad_id in list(self.snapshot):
+            if ad_id not in seen:
+                self._drop_ad(ad_id)
+        self.dirty.clear()
+        return {ad["id"]: ad for ad in adverts}
+
+    def _pop_due(self, now):
+        due = {}
+        while self.heap and self.heap[0][0] <= now.timestamp():
+            _, generation, ad_id, ch = heapq.heappop(self.heap)
+            if self.generations.get((ad_id, ch)) == generation:
+                due.setdefault(ad_id, []).append(ch)
+        return due
+
+    async def run_due(self, dispatch, now, adverts):
+        due = self._pop_due(now)
+        if not due:
+            return None
+
+        jobs = await plan_posts(
+            [(adverts[ad_id], channels) for ad_id, channels in due.items()], now
+        )
+        queued = await dispatch(jobs)
+
+        # Re-arm every evaluated pair, never sooner than the recheck interval.
+        # Sends happen elsewhere; pairs still in flight are gated by the outbox.
+        later = scheduler_now()
+        recheck = later + datetime.timedelta(seconds=SCHEDULER_MIN_RECHECK)
+        pairs = [
+            (adverts[ad_id], ch) for ad_id, channels in due.items() for ch in channels
+        ]
+        await self._schedule_pairs(pairs, later, {(ad["id"], ch): recheck for ad, ch in pairs})
+        return queued
+
+    def next_wakeup(self, now):
+        while self.heap and self.generations.get(self.heap[0][2:]) != self.heap[0][1]:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return SCHEDULER_MAX_SLEEP
+        return max(0, min(self.heap[0][0] - now.timestamp(), SCHEDULER_MAX_SLEEP))
+
+    async def run(self, dispatch):
+        # dispatch: async callable taking the planned jobs, e.g. outbox.enqueue
+        while True:
+            self.wakeup.clear()
+            now = scheduler_now()
+            try:
+                with SCHEDULER_RUN.time():
+                    adverts = await self.sync(now)
+                    await self.run_due(dispatch, now, adverts)
+            except LeaseLost:
+                # Another replica leads now, stop so the election loop notices
+                raise
+            except Exception as e:
+                print(f"❌ Scheduler iteration failed: {e}")
+                # Popped pairs are lost at this point, rebuild everything after a pause
+                self.full_rebuild = True
+                await asyncio.sleep(SCHEDULER_MIN_RECHECK)
+                continue
+
+            delay = self.next_wakeup(scheduler_now())
+            if delay <= 0:
+                continue
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
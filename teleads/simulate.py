@@ -0,0 +1,177 @@
+import asyncio
+import datetime
+import json
+from collections import Counter
+from dataclasses import replace
+from .config import ACCOUNT_RATE, CHANNEL_RULES, SCHEDULER_MIN_RECHECK
+from .redis import redis
+from .rules import DEFAULT_RULE, RULES_KEY, TZ, compile_rule
+from .slots import SlotState, load_slots
+
+
+# -------------------
+# Dry run
+# -------------------
+# Replays the rules over a simulated clock: no sends, no Redis writes. Each pair is
+# fast-forwarded to its first post; from there only the rule, the schedule, the
+# content length, that post and the counters it leaves decide the rest, so pairs
+# with different histories mostly share one simulation and are counted as a group.
+# The replay is CPU work and runs in a thread, off the event loop.
+
+
+async def load_rules():
+    # Read-only view of the rule book; the seed rules if it was never written
+    raw = await redis.hgetall(RULES_KEY)
+    specs = {ch: json.loads(spec) for ch, spec in raw.items()} if raw else CHANNEL_RULES
+    rules = {}
+    for ch, spec in specs.items():
+        try:
+            rules[str(ch)] = compile_rule(spec)
+        except Exception as e:
+            # Same fallback as the rule book: a bad rule never stops a dry run
+            print(f"❌ Invalid rule for {ch}, using default: {e}")
+    return rules
+
+
+def _record(rule, state, t):
+    # Same bookkeeping the sender does after a post
+    state.last = t
+    if rule.tracks_day:
+        state.day_count = state.day_count + 1 if state.day == t.date() else 1
+        state.day = t.date()
+    if rule.tracks_week:
+        week = t.isocalendar()[:2]
+        state.week_count = state.week_count + 1 if state.week == week else 1
+        state.week = week
+
+
+def simulate_pair(ad, rule, state, start, end):
+    # Every instant in [start, end) the scheduler would post this pair
+    state = replace(state)
+    recheck = datetime.timedelta(seconds=SCHEDULER_MIN_RECHECK)
+    posts = []
+    t = start
+    while True:
+        t = rule.next_eligible(ad, state, t)
+        if t is None or t >= end:
+            return posts
+        posts.append(t)
+        _record(rule, state, t)
+        # The scheduler never re-evaluates a pair sooner than this
+        t = TZ.normalize(t + recheck)
+
+
+def _signature(ad, rule, first, state):
+    # The reports count posts per minute, so the first post only matters to the
+    # minute; counters a rule doesn't track never change and never matter
+    return (
+        json.dumps(rule.spec, sort_keys=True),
+        ad["schedule"],
+        len(ad["content"]),
+        first and first.replace(second=0, microsecond=0),
+        state.day_count if rule.tracks_day and first else 0,
+        state.week_count if rule.tracks_week and first else 0,
+    )
+
+
+def _hour(t):
+    return t.replace(minute=0, second=0, microsecond=0)
+
+
+class Simulation:
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        # [(post times, [(ad_id, ch_id)])], one entry per distinct pair signature
+        self.groups = []
+        self.pairs = 0
+
+    def add(self, posts, pairs):
+        self.groups.append((posts, pairs))
+        self.pairs += len(pairs)
+
+    @property
+    def total(self):
+        return sum(len(posts) * len(pairs) for posts, pairs in self.groups)
+
+    def calendar(self):
+        # {ch_id: Counter(hour -> posts)}
+        calendar = {}
+        for posts, pairs in self.groups:
+            hours = Counter(_hour(t) for t in posts)
+            for ch, n in Counter(ch for _, ch in pairs).items():
+                counts = calendar.setdefault(ch, Counter())
+                for hour, posted in hours.items():
+                    counts[hour] += posted * n
+        return calendar
+
+    def histogram(self, bucket):
+        # Posts across all pairs per bucket (a function truncating a datetime)
+        counts = Counter()
+        for posts, pairs in self.groups:
+            for key, n in Counter(bucket(t) for t in posts).items():
+                counts[key] += n * len(pairs)
+        return counts
+
+    def peak(self, bucket):
+        counts = self.histogram(bucket)
+        return max(counts.items(), key=lambda item: item[1]) if counts else (None, 0)
+
+    def summary(self, accounts=1):
+        days = (self.end - self.start).total_seconds() / 86400
+        lines = [
+            f"🔮 {self.pairs} pair(s), {self.start:%Y-%m-%d %H:%M} → {self.end:%Y-%m-%d %H:%M}",
+            f"Posts: {self.total} ({self.total / days:.1f}/day)" if days else f"Posts: {self.total}",
+        ]
+        minute, per_minute = self.peak(lambda t: t.replace(second=0, microsecond=0))
+        hour, per_hour = self.peak(_hour)
+        if minute:
+            lines.append(f"Peak minute: {per_minute} posts at {minute:%Y-%m-%d %H:%M}")
+            lines.append(f"Peak hour: {per_hour} posts at {hour:%Y-%m-%d %H:00}")
+            # Above this the posting engine spreads the burst out
+            capacity = int(ACCOUNT_RATE * 60 * accounts)
+            if capacity > 0 and per_minute > capacity:
+                lines.append(
+                    f"⚠️ Peak exceeds the send rate of {capacity}/min, "
+                    f"the last posts of a burst go out ~{per_minute / capacity:.0f} min late"
+                )
+        return "\n".join(lines)
+
+
+def _replay(pairs, rules, states, start, end):
+    recheck = datetime.timedelta(seconds=SCHEDULER_MIN_RECHECK)
+    groups = {}
+    for ad, ch in pairs:
+        rule = rules.get(ch, DEFAULT_RULE)
+        state = replace(states.get((ad["id"], ch)) or SlotState())
+        first = rule.next_eligible(ad, state, start)
+        if first is None or first >= end:
+            first = None
+        else:
+            _record(rule, state, first)
+        key = _signature(ad, rule, first, state)
+        if key not in groups:
+            groups[key] = (ad, rule, first, state, [])
+        groups[key][4].append((ad["id"], ch))
+
+    simulation = Simulation(start, end)
+    for ad, rule, first, state, group in groups.values():
+        posts = []
+        if first:
+            posts = [first] + simulate_pair(ad, rule, state, TZ.normalize(first + recheck), end)
+        simulation.add(posts, group)
+    return simulation
+
+
+async def simulate(targets, start, days, fresh=False):
+    # targets: [(ad, channels)]; inactive ads are simulated as if switched on.
+    # Starts from the live slot state unless fresh.
+    end = start + datetime.timedelta(days=days)
+    rules = await load_rules()
+    pairs = [(ad, str(ch)) for ad, channels in targets for ch in channels]
+    states = {} if fresh else await load_slots([(ad["id"], ch) for ad, ch in pairs], start)
+    return await asyncio.to_thread(_replay, pairs, rules, states, start, end)
+
+
+def simulation_now():
+    return datetime.datetime.now(TZ).replace(second=0, microsecond=0)
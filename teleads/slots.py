@@ -0,0 +1,260 @@
+import datetime
+import uuid
+from dataclasses import dataclass
+from .redis import redis
+from .rules import TZ
+
+# Fields per HMGET so one advert with thousands of channels doesn't build one giant command
+HMGET_CHUNK = 3000
+
+CLAIM_KEY = "teleads:claim:{}:{}:{}"
+
+# Everything the rules track for one advert lives in a single hash, three fields per
+# channel: "{ch}:last" (ISO time of the last post), "{ch}:day" ("2024-05-01|2") and
+# "{ch}:week" ("2024-W18|1"). A counter from an earlier day or week reads as zero and
+# is overwritten in place, so the hash never grows past three fields per channel.
+# The hash expires once the longest rule window of its channels has passed.
+SLOTS_KEY = "teleads:slots:{}"
+
+# Shared by the scripts below: the count stored in a period field, or 0 when the
+# field belongs to another period; keep() only ever extends the hash TTL.
+SLOT_FUNCTIONS = """
+local function count(field, period)
+    local value = redis.call('HGET', KEYS[2], field)
+    if not value then
+        return 0
+    end
+    local sep = string.find(value, '|', 1, true)
+    if not sep or string.sub(value, 1, sep - 1) ~= period then
+        return 0
+    end
+    return tonumber(string.sub(value, sep + 1)) or 0
+end
+local function keep(ttl)
+    if redis.call('TTL', KEYS[2]) < tonumber(ttl) then
+        redis.call('EXPIRE', KEYS[2], ttl)
+    end
+end
+"""
+
+# Claim an (ad, channel, window) slot before sending. The caps are checked and the
+# counters reserved in the same step, so two senders can never both get the slot.
+# KEYS: claim, slots hash
+# ARGV: owner, claim ttl, day cap, week cap, channel, day, week, retention
+CLAIM = SLOT_FUNCTIONS + """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+local day_cap, week_cap = tonumber(ARGV[3]), tonumber(ARGV[4])
+local day_field, week_field = ARGV[5] .. ':day', ARGV[5] .. ':week'
+local day, week = count(day_field, ARGV[6]), count(week_field, ARGV[7])
+if day_cap > 0 and day >= day_cap then
+    return -1
+end
+if week_cap > 0 and week >= week_cap then
+    return -2
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+if day_cap > 0 then
+    redis.call('HSET', KEYS[2], day_field, ARGV[6] .. '|' .. (day + 1))
+end
+if week_cap > 0 then
+    redis.call('HSET', KEYS[2], week_field, ARGV[7] .. '|' .. (week + 1))
+end
+if day_cap > 0 or week_cap > 0 then
+    keep(ARGV[8])
+end
+return 1
+"""
+
+# The send failed: give the slot and the reserved counters back
+# KEYS: claim, slots hash; ARGV: owner, day cap, week cap, channel, day, week
+RELEASE = SLOT_FUNCTIONS + """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+local day_field, week_field = ARGV[4] .. ':day', ARGV[4] .. ':week'
+local day, week = count(day_field, ARGV[5]), count(week_field, ARGV[6])
+if tonumber(ARGV[2]) > 0 and day > 0 then
+    redis.call('HSET', KEYS[2], day_field, ARGV[5] .. '|' .. (day - 1))
+end
+if tonumber(ARGV[3]) > 0 and week > 0 then
+    redis.call('HSET', KEYS[2], week_field, ARGV[6] .. '|' .. (week - 1))
+end
+return 1
+"""
+
+# The send went out: keep the slot taken until its window ends and record the post
+# KEYS: claim, slots hash; ARGV: owner, channel, time, retention
+CONFIRM = SLOT_FUNCTIONS + """
+local ttl = redis.call('PTTL', KEYS[1])
+if redis.call('GET', KEYS[1]) == ARGV[1] and ttl > 0 then
+    redis.call('SET', KEYS[1], 'sent', 'PX', ttl)
+end
+redis.call('HSET', KEYS[2], ARGV[2] .. ':last', ARGV[3])
+keep(ARGV[4])
+return 1
+"""
+
+# A post that went out without a claim (instant posts): record it and bump the counters.
+# KEYS: unused, slots hash; ARGV: channel, time, day or '', week or '', retention
+RECORD = SLOT_FUNCTIONS + """
+redis.call('HSET', KEYS[2], ARGV[1] .. ':last', ARGV[2])
+if ARGV[3] ~= '' then
+    local field = ARGV[1] .. ':day'
+    redis.call('HSET', KEYS[2], field, ARGV[3] .. '|' .. (count(field, ARGV[3]) + 1))
+end
+if ARGV[4] ~= '' then
+    local field = ARGV[1] .. ':week'
+    redis.call('HSET', KEYS[2], field, ARGV[4] .. '|' .. (count(field, ARGV[4]) + 1))
+end
+keep(ARGV[5])
+return 1
+"""
+
+
+@dataclass
+class SlotState:
+    # What the rules need to know about one (ad, channel) pair
+    last: datetime.datetime = None
+    day: datetime.date = None
+    day_count: int = 0
+    week: tuple = None
+    week_count: int = 0
+
+
+def _periods(now):
+    year, week = now.isocalendar()[:2]
+    return now.date().isoformat(), f"{year}-W{week:02d}"
+
+
+def _fields(ch_id):
+    return [f"{ch_id}:last", f"{ch_id}:day", f"{ch_id}:week"]
+
+
+def _count(value, period):
+    if not value:
+        return 0
+    stored, _, count = value.partition("|")
+    return int(count or 0) if stored == period else 0
+
+
+def _state(values, now):
+    last, day_count, week_count = values
+    day, week = _periods(now)
+    return SlotState(
+        last=datetime.datetime.fromisoformat(last).astimezone(TZ) if last else None,
+        day=now.date(),
+        day_count=_count(day_count, day),
+        week=now.isocalendar()[:2],
+        week_count=_count(week_count, week),
+    )
+
+
+async def load_slots(pairs, now):
+    # pairs: [(ad_id, ch_id)] -> {(ad_id, ch_id): SlotState}, fetched in one pipeline
+    pairs = list(dict.fromkeys(pairs))
+    if not pairs:
+        return {}
+
+    by_ad = {}
+    for ad_id, ch_id in pairs:
+        by_ad.setdefault(ad_id, []).extend(_fields(ch_id))
+    pipe = redis.pipeline(transaction=False)
+    for ad_id, fields in by_ad.items():
+        for i in range(0, len(fields), HMGET_CHUNK):
+            pipe.hmget(SLOTS_KEY.format(ad_id), fields[i:i + HMGET_CHUNK])
+    chunks = iter(await pipe.execute())
+
+    states = {}
+    for ad_id, fields in by_ad.items():
+        values = []
+        for _ in range(0, len(fields), HMGET_CHUNK):
+            values.extend(next(chunks))
+        for i in range(0, len(fields), 3):
+            ch_id = fields[i].rsplit(":", 1)[0]
+            states[(ad_id, ch_id)] = _state(values[i:i + 3], now)
+    return states
+
+
+def _claim_keys(job):
+    ad_id, ch_id, rule, now = job.slot
+    window, _ = rule.window(now)
+    return [CLAIM_KEY.format(ad_id, ch_id, window), SLOTS_KEY.format(ad_id)]
+
+
+async def claim_slots(jobs):
+    # Claims every job's slot in one pipeline; winners get job.claim set.
+    # Returns the jobs that may be sent.
+    jobs = [job for job in jobs if job.slot]
+    if not jobs:
+        return []
+    pipe = redis.pipeline(transaction=False)
+    for job in jobs:
+        _, ch_id, rule, now = job.slot
+        _, ttl = rule.window(now)
+        job.claim = uuid.uuid4().hex
+        args = [job.claim, ttl, rule.day_cap, rule.week_cap, ch_id, *_periods(now), rule.retention]
+        pipe.eval(CLAIM, 2, *_claim_keys(job), *args)
+    results = await pipe.execute()
+
+    claimed = []
+    for job, result in zip(jobs, results):
+        if result == 1:
+            claimed.append(job)
+        else:
+            job.claim = None
+    return claimed
+
+
+async def release_slots(jobs):
+    jobs = [job for job in jobs if job.slot and job.claim]
+    if not jobs:
+        return
+    pipe = redis.pipeline(transaction=False)
+    for job in jobs:
+        _, ch_id, rule, now = job.slot
+        args = [job.claim, rule.day_cap, rule.week_cap, ch_id, *_periods(now)]
+        pipe.eval(RELEASE, 2, *_claim_keys(job), *args)
+        job.claim = None
+    await pipe.execute()
+
+
+async def record_sent_many(jobs):
+    # Bookkeeping for every scheduled job that went out, in one pipelined write.
+    # Claimed jobs already reserved their counters, confirming keeps the slot taken.
+    pipe = redis.pipeline(transaction=False)
+    for job in jobs:
+        if not job.slot:
+            continue
+        ad_id, ch_id, rule, now = job.slot
+        keys = _claim_keys(job)
+        if job.claim:
+            pipe.eval(CONFIRM, 2, *keys, job.claim, ch_id, now.isoformat(), rule.retention)
+            continue
+        day, week = _periods(now)
+        args = [
+            ch_id,
+            now.isoformat(),
+            day if rule.tracks_day else "",
+            week if rule.tracks_week else "",
+            rule.retention,
+        ]
+        pipe.eval(RECORD, 2, *keys, *args)
+    if len(pipe):
+        await pipe.execute()
+
+
+async def forget_advert_slots(ad_id):
+    await redis.delete(SLOTS_KEY.format(ad_id))
+
+
+async def forget_channel_slots(ch_id, ad_ids):
+    # Drops the channel's fields from every advert's hash, in one pipeline
+    if not ad_ids:
+        return
+    pipe = redis.pipeline(transaction=False)
+    for ad_id in ad_ids:
+        pipe.hdel(SLOTS_KEY.format(ad_id), *_fields(ch_id))
+    await pipe.execute()
@@ -0,0 +1,105 @@
+import asyncio
+import datetime
+import json
+import time
+from contextlib import asynccontextmanager
+from .config import STARTUP_HISTORY, WARM_CHUNK
+from .entities import get_channel_meta
+from .helpers import get_adverts, get_channels
+from .metrics import STARTUP_PHASE
+from .redis import redis
+from .rules import TZ, rule_book
+
+# The last STARTUP_HISTORY startups, newest first, as JSON {"at", "role", "phases"}
+STARTUP_KEY = "teleads:startups"
+
+
+class Startup:
+    """Wall time of each startup phase.
+
+    Phases may overlap (the connections run concurrently), so each one is
+    reported on its own next to the milestones "ready" (serving) and "warm"
+    (caches filled), which count from the moment the Startup was created.
+    """
+
+    def __init__(self, role):
+        self.role = role
+        self.started = time.perf_counter()
+        self.phases = {}
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @asynccontextmanager
+    async def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - started
+            STARTUP_PHASE.labels(name).set(self.phases[name])
+
+    async def timed(self, name, coro):
+        async with self.phase(name):
+            return await coro
+
+    def mark(self, name):
+        # A milestone: seconds since startup began
+        self.phases[name] = self.elapsed()
+        STARTUP_PHASE.labels(name).set(self.phases[name])
+
+    def summary(self):
+        return ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
+
+    async def save(self):
+        entry = {
+            "at": datetime.datetime.now(TZ).isoformat(timespec="seconds"),
+            "role": self.role,
+            "phases": {name: round(seconds, 3) for name, seconds in self.phases.items()},
+        }
+        pipe = redis.pipeline(transaction=False)
+        pipe.lpush(STARTUP_KEY, json.dumps(entry))
+        pipe.ltrim(STARTUP_KEY, 0, STARTUP_HISTORY - 1)
+        await pipe.execute()
+
+
+async def warm_caches(startup, client):
+    # Fills what the first menu taps and the first scheduler pass read: the
+    # advert and channel lists, the rule book and every channel's metadata.
+    # Missing metadata is resolved in batched get_entity calls, which also puts
+    # the channels in the primary account's session cache.
+    try:
+        async with startup.phase("warm lists"):
+            _, channels, _ = await asyncio.gather(get_adverts(), get_channels(), rule_book.refresh())
+        async with startup.phase("warm channels"):
+            for i in range(0, len(channels), WARM_CHUNK):
+                await get_channel_meta(client, channels[i:i + WARM_CHUNK])
+    except Exception as e:
+        print(f"⚠️ Cache warm-up failed, caches fill on first use: {e}")
+    startup.mark("warm")
+    print(f"🔥 Caches warm: {startup.summary()}")
+    try:
+        await startup.save()
+    except Exception as e:
+        # Only the /startups history misses this one
+        print(f"⚠️ Could not save startup timings: {e}")
+
+
+async def startup_history():
+    return [json.loads(raw) for raw in await redis.lrange(STARTUP_KEY, 0, -1)]
+
+
+def format_history(history):
+    if not history:
+        return "⏱ No startups recorded."
+    lines = ["⏱ Recent startups (seconds):"]
+    for entry in history:
+        phases = entry["phases"]
+        lines.append(
+            f"{entry['at']} {entry['role']}: ready {phases.get('ready', 0):.2f}, "
+            f"warm {phases.get('warm', 0):.2f}"
+        )
+        lines.append("   " + ", ".join(
+            f"{name} {seconds:.2f}" for name, seconds in phases.items() if name not in ("ready", "warm")
+        ))
+    return "\n".join(lines)
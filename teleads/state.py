@@ -0,0 +1,31 @@
+from .config import DRAFT_TTL
+from .redis import redis
+
+# Per-user keys of the bot's multi-step flows. They all expire after DRAFT_TTL,
+# so a flow abandoned halfway doesn't leave anything behind for good.
+DRAFT_PREFIXES = ("state", "temp_ad", "temp_ad_content", "temp_edit_ad", "ad_search", "temp_ad_media")
+
+
+async def get_state(uid):
+    return await redis.get(f"state:{uid}")
+
+
+async def set_state(uid, state):
+    await redis.set(f"state:{uid}", state, ex=DRAFT_TTL)
+
+
+async def clear_state(uid):
+    await redis.delete(f"state:{uid}")
+
+
+# Content prefix the advert menus are filtered by
+async def get_search(uid):
+    return await redis.get(f"ad_search:{uid}")
+
+
+async def set_search(uid, prefix):
+    await redis.set(f"ad_search:{uid}", prefix, ex=DRAFT_TTL)
+
+
+async def clear_search(uid):
+    await redis.delete(f"ad_search:{uid}")
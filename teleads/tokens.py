@@ -0,0 +1,93 @@
+import base64
+import hashlib
+import json
+import time
+from .config import CALLBACK_TOKEN_CAP, CALLBACK_TOKEN_TTL
+from .redis import redis
+
+TOKEN_KEY = "teleads:cb:{}"
+TOKEN_INDEX = "teleads:cb:index"
+
+# Telegram rejects callback data longer than this
+CALLBACK_DATA_LIMIT = 64
+
+# Tokens per script call
+ISSUE_CHUNK = 500
+
+# Stores the payloads and evicts the least recently used tokens beyond the cap.
+# The index is a sorted set of token -> last use, so it never outgrows the cap either.
+# KEYS: index; ARGV: ttl, cap, now, key prefix, token, payload, token, payload...
+ISSUE = """
+local ttl, cap, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - ttl)
+for i = 5, #ARGV, 2 do
+    redis.call('SET', ARGV[4] .. ARGV[i], ARGV[i + 1], 'EX', ttl)
+    redis.call('ZADD', KEYS[1], now, ARGV[i])
+end
+local excess = redis.call('ZCARD', KEYS[1]) - cap
+if excess > 0 then
+    for _, token in ipairs(redis.call('ZRANGE', KEYS[1], 0, excess - 1)) do
+        redis.call('DEL', ARGV[4] .. token)
+    end
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, excess - 1)
+end
+return excess
+"""
+
+
+class CallbackTokens:
+    """Short tokens standing in for callback payloads that don't fit in 64 bytes.
+
+    A token is derived from its payload, so re-rendering a menu reuses the same
+    entries instead of adding new ones. Shared by every replica and kept across
+    restarts; a token that expired or was evicted resolves to None.
+    """
+
+    def __init__(self, ttl=CALLBACK_TOKEN_TTL, cap=CALLBACK_TOKEN_CAP):
+        self.ttl = ttl
+        self.cap = cap
+
+    @staticmethod
+    def token(payload):
+        digest = hashlib.blake2b(payload.encode(), digest_size=9).digest()
+        return base64.urlsafe_b64encode(digest).decode()
+
+    async def issue_many(self, payloads):
+        # [json-serialisable payload] -> [token], one round trip per ISSUE_CHUNK
+        encoded = [json.dumps(payload, sort_keys=True) for payload in payloads]
+        tokens = [self.token(payload) for payload in encoded]
+        entries = list(dict(zip(tokens, encoded)).items())
+        if not entries:
+            return tokens
+        pipe = redis.pipeline(transaction=False)
+        for i in range(0, len(entries), ISSUE_CHUNK):
+            args = [arg for entry in entries[i:i + ISSUE_CHUNK] for arg in entry]
+            pipe.eval(ISSUE, 1, TOKEN_INDEX, self.ttl, self.cap, time.time(), TOKEN_KEY.format(""), *args)
+        await pipe.execute()
+        return tokens
+
+    async def issue(self, payload):
+        return (await self.issue_many([payload]))[0]
+
+    async def resolve(self, token):
+        # The payload, or None once the token is gone; a hit counts as a use
+        pipe = redis.pipeline(transaction=False)
+        pipe.get(TOKEN_KEY.format(token))
+        pipe.expire(TOKEN_KEY.format(token), self.ttl)
+        pipe.zadd(TOKEN_INDEX, {token: time.time()}, xx=True)
+        raw, _, _ = await pipe.execute()
+        return json.loads(raw) if raw is not None else None
+
+    async def data(self, action, payload):
+        # Callback data for a button: "action:token"
+        return (await self.data_many(action, [payload]))[0]
+
+    async def data_many(self, action, payloads):
+        tokens = await self.issue_many(payloads)
+        data = [f"{action}:{token}".encode() for token in tokens]
+        if data and len(data[0]) > CALLBACK_DATA_LIMIT:
+            raise ValueError(f"Callback action {action!r} is too long for a token")
+        return data
+
+
+callback_tokens = CallbackTokens()